@@ -0,0 +1,112 @@
+"""
+Semantic answer cache for the VWAT RAG system
+Reuses a previous LLM answer when a new question is nearly identical to an
+earlier one in the same language and retrieves the same documents
+"""
+
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """Bounded cache of ``(query embedding, language, doc IDs) -> response``.
+
+    Entries live in fixed-size arrays: a matrix of normalized query
+    embeddings plus per-slot language, doc IDs, response, expiry time and
+    last-use tick, so a lookup is one matrix-vector product. A cached
+    answer is returned only when the cosine similarity reaches
+    ``threshold``, the language matches and the retrieved document IDs are
+    the same set, so the answer was generated from the same context.
+    Entries expire after ``ttl_seconds``; when full, the least recently
+    used entry is replaced. ``clear`` drops everything (e.g. after the
+    index is rebuilt).
+    """
+
+    def __init__(self, dim: int, max_entries=512, ttl_seconds=3600.0, threshold=0.93):
+        self.dim = dim
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._expires = np.zeros(max_entries, dtype=np.float64)
+        self._ticks = np.zeros(max_entries, dtype=np.int64)  # 0 marks an empty slot
+        self._languages = np.empty(max_entries, dtype=object)
+        self._doc_ids = [None] * max_entries
+        self._responses = [None] * max_entries
+        self._clock = 0
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _similar_slots(self, vector: np.ndarray, language: str, doc_ids: frozenset, threshold: float):
+        """Live slots for the language and doc set at or above threshold, best first"""
+        live = (self._ticks > 0) & (self._expires > time.monotonic()) & (self._languages == language)
+        if not live.any():
+            return []
+        scores = np.where(live, self._vectors @ vector, -np.inf)
+        slots = np.flatnonzero(scores >= threshold)
+        slots = slots[np.argsort(-scores[slots])]
+        return [int(slot) for slot in slots if self._doc_ids[slot] == doc_ids]
+
+    def get(self, vector: np.ndarray, language: str, doc_ids: Iterable[str]) -> Optional[str]:
+        vector = self._normalize(vector)
+        doc_ids = frozenset(doc_ids)
+        with self._lock:
+            slots = self._similar_slots(vector, language, doc_ids, self.threshold)
+            if not slots:
+                self.misses += 1
+                return None
+            self._clock += 1
+            self._ticks[slots[0]] = self._clock
+            self.hits += 1
+            return self._responses[slots[0]]
+
+    def put(self, vector: np.ndarray, language: str, doc_ids: Iterable[str], response: str):
+        vector = self._normalize(vector)
+        doc_ids = frozenset(doc_ids)
+        with self._lock:
+            # Refresh an entry for practically the same question instead of duplicating it
+            existing = self._similar_slots(vector, language, doc_ids, 0.999)
+            if existing:
+                slot = existing[0]
+            else:
+                # Empty or expired slots first, then the least recently used
+                live = self._expires > time.monotonic()
+                slot = int(np.argmin(np.where(live, self._ticks, 0)))
+                if self._ticks[slot] > 0 and live[slot]:
+                    self.evictions += 1
+
+            self._clock += 1
+            self._vectors[slot] = vector
+            self._expires[slot] = time.monotonic() + self.ttl_seconds
+            self._ticks[slot] = self._clock
+            self._languages[slot] = language
+            self._doc_ids[slot] = doc_ids
+            self._responses[slot] = response
+
+    def clear(self):
+        with self._lock:
+            self._ticks[:] = 0
+            self._languages[:] = None
+            self._doc_ids = [None] * self.max_entries
+            self._responses = [None] * self.max_entries
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': int(np.count_nonzero(self._ticks)),
+                'capacity': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -6,11 +6,19 @@ import signal
 import sys
 import atexit
 import csv
+import hmac
 from datetime import datetime
-from rag_system import initialize_rag, get_rag_response, cleanup_rag, detect_query_language
+from rag_system import (initialize_rag, get_rag_response, stream_rag_response, cleanup_rag,
+                        detect_query_language, reload_rag, ReloadInProgressError)
 
 app = Flask(__name__)
 
+# Bearer token for admin endpoints; they are disabled when unset
+ADMIN_TOKEN = os.environ.get('RAG_ADMIN_TOKEN', '')
+
+# Time budget of one chat request; the LLM call gets whatever retrieval left of it
+CHAT_DEADLINE_SECONDS = float(os.environ.get('CHAT_DEADLINE_SECONDS', 40.0))
+
 # Conversation CSV file path
 CONVERSATION_CSV = os.path.join('data', 'conversation.csv')
 
@@ -43,6 +51,55 @@ def save_conversation_to_csv(timestamp, language, question, answer, sources, use
     except Exception as e:
         print(f"ERROR: Failed to save conversation to CSV: {e}")
 
+def log_user_query(timestamp, user_id, language, user_message):
+    """Append a typed question to data/user.txt as soon as it arrives"""
+    try:
+        log_file = os.path.join('data', 'user.txt')
+        with open(log_file, 'a', encoding='utf-8') as f:
+            f.write(f"[{timestamp}] [{user_id}] [{language}] {user_message}\n")
+            f.flush()  # Ensure immediate write to disk
+            os.fsync(f.fileno())  # Force write to disk
+        print(f"Logged user query: [{user_id}] {user_message[:50]}...")  # Debug confirmation
+    except Exception as log_error:
+        print(f"ERROR: Failed to log user query: {log_error}")
+
+def reply_language(user_message, requested_language):
+    """Reply in the language of the user's message"""
+    try:
+        return detect_query_language(user_message)
+    except Exception:
+        # Fallback to previously provided language if detection fails
+        return requested_language if requested_language in ('vi','en') else 'en'
+
+def chat_error_message(language):
+    """Apology shown when answering failed"""
+    if language == 'vi':
+        return 'Xin lỗi, đã xảy ra lỗi. Vui lòng thử lại hoặc liên hệ chúng tôi tại info@vwat.org hoặc +1-647-343-8928.'
+    return 'Sorry, I encountered an error. Please try again or contact us directly at info@vwat.org or +1-647-343-8928.'
+
+def empty_message_error(language):
+    return 'Vui lòng nhập câu hỏi.' if language == 'vi' else 'Please enter a question.'
+
+def top_sources(retrieved_docs):
+    """Top 3 sources of an answer, as returned to the frontend"""
+    return [{
+        'source': doc['source'],
+        'score': doc['score']
+    } for doc in retrieved_docs[:3]]
+
+def chat_reply(rag_result):
+    """Body of a successful /chat response, also sent as the stream's "done" event"""
+    return {
+        'response': rag_result['response'],
+        'status': 'success',
+        'sources': top_sources(rag_result['retrieved_docs']),
+        'answer_source': rag_result.get('answer_source', 'llm')
+    }
+
+def sse_event(event, payload):
+    """One Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
 # Cleanup handler for graceful shutdown
 def cleanup_handler(signum=None, frame=None):
     """Clean up resources before exit"""
@@ -125,12 +182,14 @@ def chat():
         language = data.get('language', 'vi')  # initial value (may be overridden)
         
         if not user_message.strip():
-            error_msg = 'Vui lòng nhập câu hỏi.' if language == 'vi' else 'Please enter a question.'
+            error_msg = empty_message_error(language)
             return jsonify({
                 'response': error_msg,
                 'status': 'error'
             })
         
+        deadline = time.monotonic() + CHAT_DEADLINE_SECONDS
+        
         # Get user ID from request
         user_id = data.get('user_id', 'anonymous')
         
@@ -138,56 +197,120 @@ def chat():
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
         # Log user query to file immediately
-        try:
-            log_file = os.path.join('data', 'user.txt')
-            with open(log_file, 'a', encoding='utf-8') as f:
-                f.write(f"[{timestamp}] [{user_id}] [{language}] {user_message}\n")
-                f.flush()  # Ensure immediate write to disk
-                os.fsync(f.fileno())  # Force write to disk
-            print(f"Logged user query: [{user_id}] {user_message[:50]}...")  # Debug confirmation
-        except Exception as log_error:
-            print(f"ERROR: Failed to log user query: {log_error}")
+        log_user_query(timestamp, user_id, language, user_message)
         
         # Force response language to match the user's message
-        try:
-            language = detect_query_language(user_message)
-        except Exception:
-            # Fallback to previously provided language if detection fails
-            language = language if language in ('vi','en') else 'en'
+        language = reply_language(user_message, language)
         
         # Use RAG system to generate response with language parameter
-        rag_result = get_rag_response(user_message, language)
+        rag_result = get_rag_response(user_message, language, deadline=deadline)
         
-        # Prepare sources for response
-        sources = [{
-            'source': doc['source'],
-            'score': doc['score']
-        } for doc in rag_result['retrieved_docs'][:3]]  # Return top 3 sources
+        # Prepare the response with its sources
+        reply = chat_reply(rag_result)
         
         # Save conversation to CSV
         save_conversation_to_csv(
             timestamp=timestamp,
             language=language,
             question=user_message,
-            answer=rag_result['response'],
-            sources=sources,
+            answer=reply['response'],
+            sources=reply['sources'],
             user_id=user_id
         )
         
-        return jsonify({
-            'response': rag_result['response'],
-            'status': 'success',
-            'sources': sources
-        })
+        return jsonify(reply)
     except Exception as e:
         print(f"Error in chat endpoint: {str(e)}")
-        error_msg = 'Xin lỗi, đã xảy ra lỗi. Vui lòng thử lại hoặc liên hệ chúng tôi tại info@vwat.org hoặc +1-647-343-8928.' if data.get('language') == 'vi' else 'Sorry, I encountered an error. Please try again or contact us directly at info@vwat.org or +1-647-343-8928.'
+        error_msg = chat_error_message(data.get('language'))
         return jsonify({
             'response': error_msg,
             'status': 'error',
             'error': str(e)
         }), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Streaming variant of /chat: the answer is sent as Server-Sent Events while
+    the LLM generates it. Each "token" event carries {"text": ...} (sanitized
+    HTML to append); a final "done" event carries the same fields as /chat.
+    The question is logged once the first event has been sent: a browser that
+    got no event falls back to /chat, which logs it instead. The complete
+    answer is logged to the conversation CSV when the stream ends.
+    """
+    deadline = time.monotonic() + CHAT_DEADLINE_SECONDS
+    data = request.get_json(silent=True) or {}
+    user_message = data.get('message', '')
+    requested_language = language = data.get('language', 'vi')
+    user_id = data.get('user_id', 'anonymous')
+    
+    if not user_message.strip():
+        error_msg = empty_message_error(language)
+        return Response(sse_event('done', {'response': error_msg, 'status': 'error'}), mimetype='text/event-stream')
+    
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    language = reply_language(user_message, language)
+    
+    def generate():
+        events = generate_events()
+        try:
+            yield next(events)
+        finally:
+            log_user_query(timestamp, user_id, requested_language, user_message)
+        yield from events
+    
+    def generate_events():
+        try:
+            for event, payload in stream_rag_response(user_message, language, deadline=deadline):
+                if event == 'token':
+                    yield sse_event('token', {'text': payload})
+                    continue
+                
+                reply = chat_reply(payload)
+                save_conversation_to_csv(
+                    timestamp=timestamp,
+                    language=language,
+                    question=user_message,
+                    answer=reply['response'],
+                    sources=reply['sources'],
+                    user_id=user_id
+                )
+                yield sse_event('done', reply)
+        except Exception as e:
+            print(f"Error in chat stream: {str(e)}")
+            error_msg = chat_error_message(language)
+            yield sse_event('done', {'response': error_msg, 'status': 'error', 'error': str(e)})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Stop proxies from buffering the stream
+    })
+
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    """
+    Hot-reload the knowledge base without restarting the app.
+    Optional JSON body: {"snapshot": "current" | "<version>"} switches to a prebuilt
+    snapshot; otherwise the index is rebuilt from the data folder. Requests keep
+    being served from the old index until the new one is ready.
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({'status': 'error', 'error': 'Admin endpoints are disabled'}), 404
+    
+    auth_header = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(auth_header.encode('utf-8'), f"Bearer {ADMIN_TOKEN}".encode('utf-8')):
+        return jsonify({'status': 'error', 'error': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        result = reload_rag(snapshot=data.get('snapshot'))
+        return jsonify({'status': 'success', **result})
+    except ReloadInProgressError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 409
+    except Exception as e:
+        print(f"Error reloading knowledge base: {str(e)}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
 if __name__ == '__main__':
     # Disable reloader to prevent Qdrant locking issues
     # Use environment PORT for cloud deployment, default to 8000 for local
@@ -0,0 +1,140 @@
+"""
+ASGI entry point for the VWAT chatbot
+/chat and /chat/stream are served on asyncio, so a chat waiting on the LLM
+holds no worker thread; every other route is the Flask app, mounted as WSGI.
+
+Run with: python asgi.py   (or: uvicorn asgi:app --host 0.0.0.0 --port 8000)
+"""
+
+import asyncio
+import contextlib
+import os
+import time
+from datetime import datetime
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import rag_system
+from app import (CHAT_DEADLINE_SECONDS, app as flask_app, chat_error_message, chat_reply, empty_message_error,
+                 log_user_query, reply_language, save_conversation_to_csv, sse_event)
+
+
+async def _read_chat_request(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    return data if isinstance(data, dict) else {}
+
+
+async def chat(request):
+    """Async /chat: same request and response as the Flask endpoint"""
+    deadline = time.monotonic() + CHAT_DEADLINE_SECONDS
+    data = await _read_chat_request(request)
+    language = data.get('language', 'vi')
+    try:
+        user_message = data.get('message', '')
+        if not user_message.strip():
+            return JSONResponse({'response': empty_message_error(language), 'status': 'error'})
+
+        user_id = data.get('user_id', 'anonymous')
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        # File writes (with fsync) go to the default executor, not the event loop
+        await asyncio.to_thread(log_user_query, timestamp, user_id, language, user_message)
+        language = reply_language(user_message, language)
+
+        rag_result = await rag_system.get_rag_response_async(user_message, language, deadline=deadline)
+        reply = chat_reply(rag_result)
+        await asyncio.to_thread(save_conversation_to_csv, timestamp=timestamp, language=language,
+                                question=user_message, answer=reply['response'], sources=reply['sources'],
+                                user_id=user_id)
+        return JSONResponse(reply)
+    except Exception as e:
+        print(f"Error in chat endpoint: {str(e)}")
+        return JSONResponse({
+            'response': chat_error_message(data.get('language')),
+            'status': 'error',
+            'error': str(e)
+        }, status_code=500)
+
+
+async def chat_stream(request):
+    """Async /chat/stream: same Server-Sent Events (and query logging) as the Flask endpoint.
+    If the browser disconnects, the LLM request is closed with the stream."""
+    deadline = time.monotonic() + CHAT_DEADLINE_SECONDS
+    data = await _read_chat_request(request)
+    user_message = data.get('message', '')
+    requested_language = language = data.get('language', 'vi')
+    user_id = data.get('user_id', 'anonymous')
+
+    if not user_message.strip():
+        error_msg = empty_message_error(language)
+        return StreamingResponse(iter([sse_event('done', {'response': error_msg, 'status': 'error'})]),
+                                 media_type='text/event-stream')
+
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    language = reply_language(user_message, language)
+
+    async def generate():
+        events = generate_events()
+        try:
+            try:
+                yield await events.__anext__()
+            finally:
+                # After the first event, so a browser falling back to /chat doesn't log twice
+                await asyncio.to_thread(log_user_query, timestamp, user_id, requested_language, user_message)
+            async for event in events:
+                yield event
+        finally:
+            await events.aclose()  # Closes the LLM request if the browser went away
+
+    async def generate_events():
+        try:
+            stream = rag_system.stream_rag_response_async(user_message, language, deadline=deadline)
+            async for event, payload in stream:
+                if event == 'token':
+                    yield sse_event('token', {'text': payload})
+                    continue
+
+                reply = chat_reply(payload)
+                await asyncio.to_thread(save_conversation_to_csv, timestamp=timestamp, language=language,
+                                        question=user_message, answer=reply['response'], sources=reply['sources'],
+                                        user_id=user_id)
+                yield sse_event('done', reply)
+        except Exception as e:
+            print(f"Error in chat stream: {str(e)}")
+            yield sse_event('done', {'response': chat_error_message(language), 'status': 'error', 'error': str(e)})
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Stop proxies from buffering the stream
+    })
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    await rag_system.initialize_async_rag()
+    try:
+        yield
+    finally:
+        await rag_system.cleanup_async_rag()
+
+
+app = Starlette(routes=[
+    Route('/chat', chat, methods=['POST']),
+    Route('/chat/stream', chat_stream, methods=['POST']),
+    # Pages, static files, /log_interaction, /data and /admin/reload
+    Mount('/', app=WSGIMiddleware(flask_app, workers=int(os.environ.get('WSGI_WORKERS', 10))))
+], lifespan=lifespan)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.environ.get('PORT', 8000))
+    host = os.environ.get('HOST', '0.0.0.0')
+    # One process and one event loop: the RAG index and models are loaded once
+    uvicorn.run(app, host=host, port=port, workers=1)
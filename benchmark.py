@@ -0,0 +1,643 @@
+"""
+Micro-benchmarks for the VWAT RAG system
+Run a single benchmark with: python benchmark.py <name>
+"""
+
+import argparse
+import json
+import os
+import time
+
+
+def _best_of(fn, repeat=5):
+    """Best wall-clock time of several runs, in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _sample_text(data_dir='./data') -> str:
+    """Real knowledge-base prose used as benchmark input"""
+    with open(os.path.join(data_dir, 'vwat_complete_rag_data.json'), 'r', encoding='utf-8') as f:
+        items = json.load(f)
+    return "\n\n".join(f"{item.get('title', '')}\n\n{item.get('content', '')}" for item in items)
+
+
+def bench_chunking(args):
+    """Chunking time on growing documents; time per token should stay flat"""
+    from rag_system import DocumentProcessor
+
+    processor = DocumentProcessor(max_chunk_tokens=args.max_chunk_tokens)
+    base = _sample_text()
+    # One huge "sentence" without punctuation was the quadratic worst case
+    unpunctuated = base.replace('.', ' ').replace('\n', ' ')
+
+    for label, source in (('prose', base), ('no punctuation', unpunctuated)):
+        print(f"\n{label}:")
+        print(f"{'tokens':>10} {'chunks':>8} {'ms':>10} {'us/token':>10}")
+        for factor in (1, 4, 16, 64):
+            text = " ".join([source] * factor)
+            n_tokens = processor.count_tokens(text)
+            chunks = processor.chunk_text(text)
+            elapsed = _best_of(lambda: processor.chunk_text(text), repeat=args.repeat)
+            print(f"{n_tokens:>10} {len(chunks):>8} {elapsed * 1000:>10.2f} {elapsed * 1e6 / n_tokens:>10.3f}")
+
+
+def _logged_queries(data_dir='./data'):
+    """User questions from the conversation log and the raw query log"""
+    import csv
+
+    with open(os.path.join(data_dir, 'conversation.csv'), 'r', encoding='utf-8-sig', newline='') as f:
+        queries = [row['Question'] for row in csv.DictReader(f) if row.get('Question')]
+    with open(os.path.join(data_dir, 'user.txt'), 'r', encoding='utf-8') as f:
+        # "[time] [user] [lang] question"
+        queries += [line.split('] ', 3)[-1].strip() for line in f if line.strip()]
+    return queries
+
+
+def bench_classifiers(args):
+    """Per-query cost of the off-topic and language pre-filters, one at a time and batched"""
+    from query_classifier import detect_query_language, is_query_relevant
+
+    queries = _logged_queries()
+    rounds = args.repeat * 20
+    print(f"{len(queries)} logged queries, best of {args.repeat}")
+    print(f"{'':>30} {'us/query':>10}")
+    for label, fn in (('detect_query_language', detect_query_language),
+                      ('is_query_relevant', is_query_relevant)):
+        single = _best_of(lambda: [fn(q) for _ in range(rounds) for q in queries], repeat=args.repeat)
+        batched = _best_of(lambda: [fn(queries) for _ in range(rounds)], repeat=args.repeat)
+        print(f"{label:>30} {single * 1e6 / (rounds * len(queries)):>10.2f}")
+        print(f"{label + ' (batch)':>30} {batched * 1e6 / (rounds * len(queries)):>10.2f}")
+
+
+def bench_sanitizer(args):
+    """Equivalence with the old two-pass sanitizer, stream/batch agreement and throughput"""
+    import random
+    from response_sanitizer import StreamSanitizer, sanitize_response
+    from tests.helpers import legacy_format_response, response_corpus
+
+    responses = response_corpus()
+    plain = [r for r in responses if '<' not in r]
+    differing = [r for r in responses if sanitize_response(r) != legacy_format_response(r)]
+    print(f"{len(responses)} responses: {len(responses) - len(differing)} identical to the old sanitizer, "
+          f"{sum(r in differing for r in plain)} of {len(plain)} without markup differ")
+    # The old pipeline left tag fragments such as "VWAT</strong" behind
+    for response in differing[:3]:
+        print(f"  old: {legacy_format_response(response)[:100]!r}")
+        print(f"  new: {sanitize_response(response)[:100]!r}")
+
+    def stream(text, rng):
+        sanitizer, out, i = StreamSanitizer(), [], 0
+        while i < len(text):
+            step = rng.randint(1, 12)  # A few characters per chunk, like LLM tokens
+            out.append(sanitizer.feed(text[i:i + step]))
+            i += step
+        out.append(sanitizer.finish())
+        return ''.join(out)
+
+    rng = random.Random(0)
+    mismatches = sum(stream(r, rng) != sanitize_response(r) for r in responses for _ in range(20))
+    print(f"streamed vs whole-text output: {mismatches} mismatches in {len(responses) * 20} random chunkings")
+
+    total_mb = sum(len(r.encode('utf-8')) for r in responses) / 1e6
+    rows = (
+        ('old (2 passes)', lambda: [legacy_format_response(r) for r in responses]),
+        ('sanitize_response', lambda: [sanitize_response(r) for r in responses]),
+        ('StreamSanitizer', lambda: [stream(r, random.Random(0)) for r in responses]),
+    )
+    print(f"\n{'':>18} {'MB/s':>8} {'us/answer':>10}")
+    for label, fn in rows:
+        elapsed = _best_of(fn, repeat=args.repeat)
+        print(f"{label:>18} {total_mb / elapsed:>8.1f} {elapsed * 1e6 / len(responses):>10.1f}")
+
+
+def bench_llm(args):
+    """Per-question overhead of the LLM client against a local stand-in server"""
+    import numpy as np
+    import requests
+    from llm_client import LLMClient, LLMError
+    from tests.helpers import start_stand_in_llm
+
+    server, url = start_stand_in_llm(delay_ms=args.llm_delay_ms, paths=('/generate',))
+    prompt = _sample_text()[:4000]
+
+    def unpooled(prompt):
+        # Previous behaviour: a fresh connection per call, endpoints tried in order
+        for path in LLMClient.ENDPOINT_PATHS:
+            response = requests.post(f"{url.rstrip('/')}{path}", json={'prompt': prompt}, timeout=30)
+            if response.status_code == 200:
+                return response.json()['response']
+
+    client = LLMClient(api_url=url)
+    print(f"stand-in LLM at {url}, {args.llm_delay_ms} ms generation, /api/generate returns 404")
+    print(f"{'':>10} {'p50 ms':>8} {'p95 ms':>8} {'connections':>12}")
+    for label, fn in (('unpooled', unpooled), ('pooled', client.generate)):
+        server.connections = 0
+        latencies = []
+        for _ in range(args.queries):
+            start = time.perf_counter()
+            fn(prompt)
+            latencies.append((time.perf_counter() - start) * 1000)
+        print(f"{label:>10} {np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 95):>8.2f} "
+              f"{server.connections:>12}")
+
+    # The service moves to another API: the client re-probes once and carries on
+    server.paths = {'/v1/completions'}
+    answered = 0
+    for _ in range(5):
+        try:
+            client.generate(prompt)
+            answered += 1
+        except LLMError:
+            pass
+    print(f"\nafter moving the API: endpoint {client.endpoint}, {answered}/5 answered")
+    print(f"stats: {json.dumps(client.stats(), indent=2)}")
+    client.close()
+    server.shutdown()
+
+
+def bench_streaming(args):
+    """Time to first visible token vs full answer, streamed from a stand-in LLM through the sanitizer"""
+    import re
+    import numpy as np
+    from llm_client import LLMClient
+    from response_sanitizer import StreamSanitizer, sanitize_response
+    from tests.helpers import start_stand_in_llm
+
+    # A knowledge-base answer with an HTML artifact, split like LLM tokens
+    answer = ('VWAT Family Services\n\nPhone: <strong>+1-647-343-8928, ext. 116</strong>\n'
+              'Website: href="https://www.vwat.org" target="_blank">www.vwat.org\n\n'
+              + _sample_text()[:1500])
+    tokens = re.findall(r'\s*\S+', answer)
+    generation_ms = len(tokens) * args.token_delay_ms
+    server, url = start_stand_in_llm(delay_ms=generation_ms, paths=('/api/generate',), tokens=tokens,
+                                token_delay_ms=args.token_delay_ms)
+    client = LLMClient(api_url=url)
+    client.generate('warm up')  # Discover the endpoint and open the connection
+
+    blocking, first, total, mismatches = [], [], [], 0
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        expected = sanitize_response(client.generate('question'))
+        blocking.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        sanitizer, parts, first_at = StreamSanitizer(), [], None
+        for delta in client.generate_stream('question'):
+            text = sanitizer.feed(delta)
+            if text:
+                first_at = first_at or time.perf_counter()
+                parts.append(text)
+        parts.append(sanitizer.finish())
+        total.append(time.perf_counter() - start)
+        first.append(first_at - start)
+        mismatches += ''.join(parts) != expected
+
+    print(f"{len(tokens)} tokens at {args.token_delay_ms} ms each")
+    print(f"blocking generate:  answer after {np.median(blocking) * 1000:8.1f} ms")
+    print(f"generate_stream:    first text after {np.median(first) * 1000:8.1f} ms, "
+          f"complete after {np.median(total) * 1000:8.1f} ms")
+    print(f"streamed text differs from the blocking answer in {mismatches}/{args.repeat} runs")
+    client.close()
+    server.shutdown()
+
+
+def bench_concurrency(args):
+    """Many chats waiting on a slow LLM at once: thread-per-request vs the asyncio client"""
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+    from llm_client import AsyncLLMClient, LLMClient
+    from tests.helpers import start_stand_in_llm
+
+    server, url = start_stand_in_llm(delay_ms=args.llm_delay_ms, paths=('/api/generate',))
+    prompt = _sample_text()[:4000]
+    print(f"{args.chats} concurrent chats, stand-in LLM answering in {args.llm_delay_ms} ms")
+    print(f"{'':>22} {'total s':>8} {'p50 ms':>8} {'p95 ms':>8} {'connections':>12}")
+
+    def report(label, total, latencies):
+        print(f"{label:>22} {total:>8.2f} {np.percentile(latencies, 50):>8.1f} "
+              f"{np.percentile(latencies, 95):>8.1f} {server.connections:>12}")
+
+    # A threaded WSGI server: each chat holds one of ``threads`` workers until the LLM answers
+    client = LLMClient(api_url=url, pool_size=args.threads)
+    client.generate('warm up')
+    server.connections = 0
+
+    def timed_chat(submitted):
+        client.generate(prompt)
+        return (time.perf_counter() - submitted) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        futures = [pool.submit(timed_chat, time.perf_counter()) for _ in range(args.chats)]
+        latencies = [f.result() for f in futures]
+    report(f"{args.threads} threads", time.perf_counter() - start, latencies)
+    client.close()
+
+    async def run_async():
+        client = AsyncLLMClient(api_url=url)
+        await client.generate('warm up')
+        server.connections = 0
+
+        async def timed_chat():
+            submitted = time.perf_counter()
+            await client.generate(prompt)
+            return (time.perf_counter() - submitted) * 1000
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*[timed_chat() for _ in range(args.chats)])
+        report('asyncio (no threads)', time.perf_counter() - start, latencies)
+        await client.close()
+
+    asyncio.run(run_async())
+    server.shutdown()
+
+
+def bench_resilience(args):
+    """LLM outage with and without the circuit breaker, and hedged requests against a slow tail"""
+    import numpy as np
+    from llm_client import LLMClient, LLMError
+    from tests.helpers import start_stand_in_llm
+
+    server, url = start_stand_in_llm(delay_ms=args.llm_delay_ms, paths=('/api/generate',))
+    read_timeout = 0.5
+    outage_calls = 40
+
+    print(f"outage: stand-in stops answering within the {read_timeout:g}s read timeout, {outage_calls} calls")
+    print(f"{'':>18} {'total s':>8} {'LLM calls':>10}")
+    for label, threshold in (('no breaker', 10 ** 9), ('circuit breaker', 5)):
+        client = LLMClient(api_url=url, read_timeout=read_timeout, breaker_threshold=threshold,
+                           breaker_reset_timeout=0.5)
+        client.generate('warm up')
+        server.delay = read_timeout * 4
+        before = sum(s['requests'] for s in client.stats()['endpoints'].values())
+        start = time.perf_counter()
+        for _ in range(outage_calls):
+            try:
+                client.generate('question')
+            except LLMError:
+                pass
+        elapsed = time.perf_counter() - start
+        calls = sum(s['requests'] for s in client.stats()['endpoints'].values()) - before
+        print(f"{label:>18} {elapsed:>8.2f} {calls:>10}")
+
+        # Recovery: the trial request after the reset timeout closes the circuit again
+        server.delay = args.llm_delay_ms / 1000.0
+        time.sleep(0.6)
+        try:
+            client.generate('question')
+        except LLMError:
+            pass
+        client.close()
+    print(f"circuit after recovery: {client.stats()['circuit']}")
+
+    server.slow_fraction, server.slow_delay = 0.05, args.llm_delay_ms * 20 / 1000.0
+    print(f"\nslow tail: 5% of answers take {args.llm_delay_ms * 20:g} ms instead of {args.llm_delay_ms:g} ms")
+    print(f"{'':>18} {'p50 ms':>8} {'p99 ms':>8} {'hedged':>8}")
+    for label, percentile in (('no hedging', None), ('hedge at p90', 90)):
+        client = LLMClient(api_url=url, hedge_percentile=percentile, hedge_max_ratio=0.2)
+        latencies = []
+        for _ in range(max(args.queries, 1000)):
+            start = time.perf_counter()
+            client.generate('question')
+            latencies.append((time.perf_counter() - start) * 1000)
+        print(f"{label:>18} {np.percentile(latencies, 50):>8.1f} {np.percentile(latencies, 99):>8.1f} "
+              f"{client.hedges:>8}")
+        client.close()
+    server.shutdown()
+
+
+def _corpus_vectors(scale=1, noise=0.05, seed=0):
+    """Normalized knowledge-base vectors from the current snapshot, replicated
+    with noise to simulate a larger corpus (random vectors without a snapshot)"""
+    import numpy as np
+    from rag_system import resolve_snapshot
+
+    rng = np.random.default_rng(seed)
+    snapshot_dir = resolve_snapshot()
+    if snapshot_dir:
+        base = np.load(os.path.join(snapshot_dir, 'vectors.npy')).astype(np.float32)
+        print(f"Vectors from snapshot {os.path.basename(snapshot_dir)}")
+    else:
+        base = rng.standard_normal((2000, 384), dtype=np.float32)
+        print("No snapshot found, using random vectors")
+
+    vectors = np.concatenate([base] + [
+        base + rng.standard_normal(base.shape, dtype=np.float32) * noise * np.abs(base).mean()
+        for _ in range(scale - 1)
+    ])
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def bench_quantization(args):
+    """Memory, latency and recall@5 of quantized search with exact rescoring"""
+    import numpy as np
+    from rag_system import QuantizedIndex
+
+    vectors = _corpus_vectors(scale=args.scale)
+    rng = np.random.default_rng(1)
+    # Queries near existing chunks, like real questions about indexed content
+    rows = rng.choice(len(vectors), size=args.queries, replace=False)
+    queries = vectors[rows] + rng.standard_normal((args.queries, vectors.shape[1]), dtype=np.float32) * 0.03
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    k = 5
+    exact_top = [set(np.argpartition(-(vectors @ q), k)[:k]) for q in queries]
+
+    def run(search):
+        latencies, hits = [], 0
+        for q, truth in zip(queries, exact_top):
+            start = time.perf_counter()
+            ids = search(q)
+            latencies.append(time.perf_counter() - start)
+            hits += len(truth & set(ids[:k]))
+        return np.median(latencies) * 1000, hits / (k * len(queries))
+
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, {args.queries} queries")
+    print(f"{'mode':>16} {'memory MB':>10} {'p50 ms':>8} {'recall@5':>9}")
+    latency, recall = run(lambda q: np.argpartition(-(vectors @ q), k)[:k])
+    print(f"{'float32':>16} {vectors.nbytes / 1e6:>10.2f} {latency:>8.3f} {recall:>9.3f}")
+
+    for mode in ('int8', 'binary'):
+        index = QuantizedIndex(vectors, mode=mode)
+        for oversampling in (1.0, args.oversampling):
+            latency, recall = run(lambda q: index.search(q, k, vectors, oversampling=oversampling)[0])
+            label = f"{mode} x{oversampling:g}"
+            print(f"{label:>16} {index.nbytes / 1e6:>10.2f} {latency:>8.3f} {recall:>9.3f}")
+
+
+def _write_vector_snapshot(snapshot_dir, vectors):
+    """Minimal snapshot layout (vectors.npy + payloads.jsonl) for synthetic vectors"""
+    import numpy as np
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    np.save(os.path.join(snapshot_dir, 'vectors.npy'), vectors.astype(np.float32))
+    with open(os.path.join(snapshot_dir, 'payloads.jsonl'), 'w', encoding='utf-8') as f:
+        for i in range(len(vectors)):
+            f.write(json.dumps({'id': i, 'payload': {'text': f"chunk {i}", 'source': 'synthetic'}}) + '\n')
+
+
+def bench_backends(args):
+    """Latency of the Qdrant and NumPy retrieval backends, plus a top-k parity check"""
+    import tempfile
+    import numpy as np
+    from qdrant_client import QdrantClient
+    from qdrant_client.http import models
+    from rag_system import NumpyRetriever, QdrantRetriever
+
+    vectors = _corpus_vectors(scale=args.scale)
+    rng = np.random.default_rng(1)
+    rows = rng.choice(len(vectors), size=args.queries, replace=False)
+    queries = vectors[rows] + rng.standard_normal((args.queries, vectors.shape[1]), dtype=np.float32) * 0.03
+
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        _write_vector_snapshot(snapshot_dir, vectors)
+        numpy_retriever = NumpyRetriever(snapshot_dir)
+
+        client = QdrantClient(location=':memory:')
+        client.create_collection('bench', vectors_config=models.VectorParams(
+            size=vectors.shape[1], distance=models.Distance.COSINE))
+        for start in range(0, len(vectors), 1024):
+            client.upsert('bench', points=[
+                models.PointStruct(id=i, vector=vectors[i].tolist(), payload=numpy_retriever.payloads[i])
+                for i in range(start, min(start + 1024, len(vectors)))
+            ])
+        qdrant_retriever = QdrantRetriever(client, 'bench')
+
+        k = 5
+        results = {}
+        print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, {args.queries} queries")
+        print(f"{'backend':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for retriever in (qdrant_retriever, numpy_retriever):
+            latencies, hits = [], []
+            for q in queries:
+                start = time.perf_counter()
+                hits.append(retriever.search(q, k))
+                latencies.append(time.perf_counter() - start)
+            results[retriever.backend] = hits
+            print(f"{retriever.backend:>8} {np.percentile(latencies, 50) * 1000:>8.3f} "
+                  f"{np.percentile(latencies, 99) * 1000:>8.3f}")
+        numpy_retriever.close()
+
+    # Parity: same chunks in the same order, scores equal up to float rounding
+    mismatches = 0
+    max_score_diff = 0.0
+    for expected, actual in zip(results['qdrant'], results['numpy']):
+        if [point_id for point_id, _, _ in expected] != [point_id for point_id, _, _ in actual]:
+            mismatches += 1
+        for (_, expected_score, _), (_, actual_score, _) in zip(expected, actual):
+            max_score_diff = max(max_score_diff, abs(expected_score - actual_score))
+    print(f"\nparity: {len(queries) - mismatches}/{len(queries)} identical top-{k} lists, "
+          f"max score difference {max_score_diff:.2e}")
+
+
+def bench_batching(args):
+    """Query embedding throughput and latency with and without micro-batching"""
+    import threading
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+    from embedding_batcher import EmbeddingBatcher
+
+    model = SentenceTransformer(args.model)
+    with open(os.path.join('data', 'faqs.json'), 'r', encoding='utf-8') as f:
+        questions = [faq['q'] for faq in json.load(f) if faq.get('q')]
+    model.encode(questions[:4], show_progress_bar=False)  # Warm up
+
+    def run(embed, threads):
+        latencies = []
+        lock = threading.Lock()
+
+        def worker(offset):
+            local = []
+            for i in range(args.queries):
+                # Unique texts so nothing is served from a cache
+                text = f"{questions[(offset + i) % len(questions)]} ({offset}-{i})"
+                start = time.perf_counter()
+                embed(text)
+                local.append(time.perf_counter() - start)
+            with lock:
+                latencies.extend(local)
+
+        workers = [threading.Thread(target=worker, args=(n * 7,)) for n in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return len(latencies) / elapsed, np.percentile(latencies, 50) * 1000
+
+    batcher = EmbeddingBatcher(lambda texts: model.encode(texts, show_progress_bar=False),
+                               max_batch_size=args.batch_size, max_wait_ms=args.max_wait_ms)
+    modes = (
+        ('direct', lambda text: model.encode([text], show_progress_bar=False)[0]),
+        ('batched', batcher.encode),
+    )
+
+    print(f"{args.queries} queries per thread, batch size {args.batch_size}, max wait {args.max_wait_ms} ms")
+    print(f"{'threads':>8} {'mode':>8} {'qps':>8} {'p50 ms':>8}")
+    for threads in (1, 4, 16, 32):
+        for label, embed in modes:
+            qps, p50 = run(embed, threads)
+            print(f"{threads:>8} {label:>8} {qps:>8.1f} {p50:>8.2f}")
+    print(f"\nbatcher: {batcher.stats()}")
+    batcher.close()
+
+
+def bench_lexical(args):
+    """BM25 lookup latency on the knowledge-base texts, replicated to a larger corpus"""
+    import numpy as np
+    from sparse_index import BM25Index
+
+    paragraphs = [p for p in _sample_text().split('\n\n') if p.strip()]
+    texts = [f"{paragraphs[i % len(paragraphs)]} variant{i // len(paragraphs)}"
+             for i in range(len(paragraphs) * args.scale)]
+    ids = [str(i) for i in range(len(texts))]
+
+    start = time.perf_counter()
+    index = BM25Index.build(ids, texts)
+    build_seconds = time.perf_counter() - start
+
+    queries = ["LINC", "gio lam viec", "647-343-8928", "English classes for newcomers",
+               "chuong trinh nguoi cao tuoi", "How do I book an appointment?"]
+    latencies = []
+    for _ in range(args.repeat * 20):
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query, 20)
+            latencies.append(time.perf_counter() - start)
+
+    size_mb = (index.postings.nbytes + index.weights.nbytes + index.offsets.nbytes) / 1e6
+    print(f"{len(texts)} chunks, {len(index.vocab)} terms, {size_mb:.2f} MB postings, built in {build_seconds:.2f}s")
+    print(f"lookup p50 {np.percentile(latencies, 50) * 1e6:.1f} us, p99 {np.percentile(latencies, 99) * 1e6:.1f} us")
+
+
+def _open_rag(**kwargs):
+    """RAG system over the current snapshot, or over ./data indexed into a temporary store"""
+    import tempfile
+    from rag_system import RAGSystem, resolve_snapshot
+
+    snapshot_dir = resolve_snapshot()
+    if snapshot_dir:
+        return RAGSystem(snapshot_dir=snapshot_dir, embedding_cache_dir=None, **kwargs)
+    rag = RAGSystem(qdrant_path=tempfile.mkdtemp(), embedding_cache_dir=None, **kwargs)
+    rag.index_documents(data_dir='./data', parse_workers=0)
+    return rag
+
+
+def bench_rerank(args):
+    """Added latency, prompt size and FAQ hit rate of cross-encoder reranking vs dense top-5"""
+    import numpy as np
+
+    rag = _open_rag(reranker_model=args.reranker_model, rerank_budget_ms=args.budget_ms,
+                    rerank_candidates=args.candidates, rerank_top_k=args.top_k, answer_cache_size=0)
+    with open(os.path.join('data', 'faqs.json'), 'r', encoding='utf-8') as f:
+        faqs = [faq for faq in json.load(f) if faq.get('q')]
+
+    rows = {}
+    for label, top_k, rerank in (('dense top-5', 5, False), (f"rerank top-{args.top_k}", args.top_k, True)):
+        latencies, tokens, hits = [], [], 0
+        for faq in faqs:
+            rag.embed_query(faq['q'])  # Exclude embedding time; it is the same for both
+            start = time.perf_counter()
+            docs = rag.retrieve(faq['q'], top_k=top_k, rerank=rerank, route=False)
+            latencies.append(time.perf_counter() - start)
+            tokens.append(rag.processor.count_tokens(rag.generate_context(docs, faq['q'])))
+            hits += any(faq['q'] in doc['text'] for doc in docs)
+        rows[label] = (np.percentile(latencies, 50) * 1000, np.percentile(latencies, 95) * 1000,
+                       np.mean(tokens), hits / len(faqs))
+
+    print(f"{len(faqs)} FAQ questions, {args.candidates} candidates, budget {args.budget_ms} ms")
+    print(f"{'':>14} {'p50 ms':>8} {'p95 ms':>8} {'ctx tokens':>11} {'FAQ hit':>8}")
+    for label, (p50, p95, mean_tokens, hit_rate) in rows.items():
+        print(f"{label:>14} {p50:>8.2f} {p95:>8.2f} {mean_tokens:>11.0f} {hit_rate:>8.2f}")
+    print(f"\nreranker: {rag.reranker.stats()}")
+    rag.close()
+
+
+def bench_coalescing(args):
+    """A burst of the same question from many users, with and without single-flight coalescing"""
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+    import rag_system
+    from llm_client import LLMClient
+    from tests.helpers import start_stand_in_llm
+
+    server, url = start_stand_in_llm(delay_ms=args.llm_delay_ms, paths=('/api/generate',))
+    # No answer cache, so only coalescing can spare LLM calls
+    rag_system.rag_system = _open_rag(answer_cache_size=0, faq_direct_threshold=0)
+    rag_system.llm_client = LLMClient(api_url=url, pool_size=args.threads)
+    question = "How can VWAT help me find a job after arriving in Canada?"
+    # Case and spacing differences still share one answer
+    variants = [question, question.upper(), f"  {question}  ", question.replace(' ', '  ')]
+    rag_system.get_rag_response(question, 'en')  # Warm up
+
+    print(f"{args.chats} chats asking the same question, {args.threads} threads, "
+          f"stand-in LLM answering in {args.llm_delay_ms} ms")
+    print(f"{'':>14} {'total s':>8} {'p50 ms':>8} {'p95 ms':>8} {'LLM calls':>10} {'answers':>8}")
+    for label, ask in (('independent', lambda q: rag_system._get_rag_response(q, 'en', None)),
+                       ('single-flight', lambda q: rag_system.get_rag_response(q, 'en'))):
+        before = sum(s['requests'] for s in rag_system.llm_client.stats()['endpoints'].values())
+        responses = set()
+
+        def timed_chat(i, submitted):
+            responses.add(ask(variants[i % len(variants)])['response'])
+            return (time.perf_counter() - submitted) * 1000
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            futures = [pool.submit(timed_chat, i, time.perf_counter()) for i in range(args.chats)]
+            latencies = [f.result() for f in futures]
+        elapsed = time.perf_counter() - start
+        calls = sum(s['requests'] for s in rag_system.llm_client.stats()['endpoints'].values()) - before
+        print(f"{label:>14} {elapsed:>8.2f} {np.percentile(latencies, 50):>8.1f} "
+              f"{np.percentile(latencies, 95):>8.1f} {calls:>10} {len(responses):>8}")
+    print(f"\nsingle-flight: {rag_system.query_flight.stats()}")
+    rag_system.cleanup_rag()
+    server.shutdown()
+
+
+BENCHMARKS = {
+    'backends': bench_backends,
+    'batching': bench_batching,
+    'chunking': bench_chunking,
+    'classifiers': bench_classifiers,
+    'coalescing': bench_coalescing,
+    'concurrency': bench_concurrency,
+    'lexical': bench_lexical,
+    'llm': bench_llm,
+    'quantization': bench_quantization,
+    'rerank': bench_rerank,
+    'resilience': bench_resilience,
+    'sanitizer': bench_sanitizer,
+    'streaming': bench_streaming,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="VWAT RAG micro-benchmarks")
+    parser.add_argument('name', choices=sorted(BENCHMARKS), help="Benchmark to run")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement (best is reported)")
+    parser.add_argument('--max-chunk-tokens', type=int, default=512)
+    parser.add_argument('--scale', type=int, default=50, help="Corpus replication factor for vector benchmarks")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--oversampling', type=float, default=3.0)
+    parser.add_argument('--model', default='paraphrase-multilingual-MiniLM-L12-v2')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--reranker-model', default='cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')
+    parser.add_argument('--budget-ms', type=float, default=150.0)
+    parser.add_argument('--candidates', type=int, default=20)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--llm-delay-ms', type=float, default=20.0, help="Stand-in LLM generation time")
+    parser.add_argument('--chats', type=int, default=300, help="Concurrent chats for the concurrency benchmark")
+    parser.add_argument('--threads', type=int, default=16, help="Worker threads of the threaded server")
+    parser.add_argument('--token-delay-ms', type=float, default=20.0, help="Stand-in LLM time per streamed token")
+    args = parser.parse_args()
+
+    BENCHMARKS[args.name](args)
@@ -0,0 +1,117 @@
+"""
+Micro-batching scheduler for query embeddings
+Queries submitted by concurrent request threads are grouped into a single
+batched encode call, which is much cheaper than many tiny forward passes
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+import numpy as np
+
+
+class EmbeddingBatcher:
+    """Group concurrent ``encode`` requests into batches on a background thread.
+
+    Each ``submit`` returns a Future for one text's embedding. The worker
+    takes the first waiting text and collects more for at most
+    ``max_wait_ms`` or until ``max_batch_size`` texts are queued, then
+    encodes them in one call. The wait only applies while there is
+    concurrent traffic (the previous batch held more than one text), so a
+    lone request is encoded immediately and low-load latency is unchanged.
+    """
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray],
+                 max_batch_size=32, max_wait_ms=2.0):
+        self.encode_batch = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self.batches = 0
+        self.items = 0
+        self._last_batch_size = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        if self._closed:
+            raise RuntimeError("Embedding batcher is closed")
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def encode(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        """Embedding of a single text, batched with concurrent callers"""
+        return self.submit(text).result(timeout)
+
+    def _collect(self) -> Optional[list]:
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+
+        wait = self.max_wait if self._last_batch_size > 1 else 0.0
+        deadline = time.monotonic() + wait
+        while len(batch) < self.max_batch_size:
+            try:
+                remaining = deadline - time.monotonic()
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            # Skip requests whose caller cancelled the future
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            self._last_batch_size = len(batch)
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                vectors = self.encode_batch([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': round(self.items / self.batches, 2) if self.batches else 0.0
+        }
+
+    def close(self, timeout=5.0):
+        """Encode everything already submitted, then stop the worker"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+            # Fail requests that raced with close instead of leaving them pending
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None and item[1].set_running_or_notify_cancel():
+                    item[1].set_exception(RuntimeError("Embedding batcher is closed"))
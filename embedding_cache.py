@@ -0,0 +1,308 @@
+"""
+Embedding caches for the VWAT RAG system
+EmbeddingCache stores vectors in a memory-mapped array on disk, keyed by a hash
+of the embedding model name and the normalized text, with LRU eviction under a
+size cap. QueryEmbeddingCache is a small in-process LRU/TTL cache for queries.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import portalocker
+
+
+KEY_BYTES = 16
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalize and collapse whitespace so trivially different texts share a key"""
+    return _WHITESPACE_RE.sub(' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def normalize_query(text: str) -> str:
+    """Case-insensitive form of a query, so "Hours?" and "  hours? " share an entry"""
+    return unicodedata.normalize('NFC', normalize_text(text).casefold())
+
+
+class EmbeddingCache:
+    """On-disk embedding cache shared by indexing and query paths.
+
+    Three memory-mapped files hold the data: ``vectors.dat`` (capacity x dim),
+    ``keys.dat`` (a 16-byte hash per slot) and ``ticks.dat`` (last-use counter
+    per slot, 0 for empty slots). The key -> slot index is rebuilt from
+    ``keys.dat`` on open. Keys include the model name, and the cache is wiped
+    automatically when it was created for a different model or dimension.
+
+    Only one process writes to a cache directory: it holds an exclusive lock
+    on ``writer.lock`` until ``close``. Other processes, and any process
+    opened with ``read_only=True`` or on a read-only filesystem, map the files
+    read-only and never store vectors or allocate slots. Readers verify the
+    slot key after copying the vector, so they never return a wrong vector;
+    a slot the writer has reused since simply becomes a miss.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, dim: int,
+                 max_bytes=256 * 1024 * 1024, dtype='float16', read_only=False):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.capacity = max(1, max_bytes // (dim * self.dtype.itemsize))
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._writer_lock = None
+
+        self.read_only = read_only
+        if not read_only:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                self.read_only = not self._lock_writer()
+            except OSError as e:
+                print(f"Embedding cache directory is not writable ({e}), opening it read-only")
+                self.read_only = True
+        self._open()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def _lock_writer(self) -> bool:
+        """Become the only process writing to the cache directory"""
+        handle = open(self._path('writer.lock'), 'a')
+        try:
+            portalocker.lock(handle, portalocker.LOCK_EX | portalocker.LOCK_NB)
+        except portalocker.exceptions.LockException:
+            handle.close()
+            print("Embedding cache is written by another process, opening it read-only")
+            return False
+        self._writer_lock = handle
+        return True
+
+    def _open(self):
+        meta = {
+            'model_name': self.model_name,
+            'dim': self.dim,
+            'dtype': self.dtype.name,
+            'capacity': self.capacity
+        }
+
+        existing = None
+        try:
+            with open(self._path('meta.json'), 'r', encoding='utf-8') as f:
+                existing = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        if self.read_only:
+            self._open_read_only(existing == meta)
+            return
+
+        if existing != meta:
+            if existing is not None:
+                print(f"Embedding cache was built for {existing.get('model_name')}, resetting")
+            for name in ('vectors.dat', 'keys.dat', 'ticks.dat'):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+            with open(self._path('meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+
+        self._vectors = self._memmap('vectors.dat', self.dtype, (self.capacity, self.dim))
+        self._keys = self._memmap('keys.dat', np.uint8, (self.capacity, KEY_BYTES))
+        self._ticks = self._memmap('ticks.dat', np.int64, (self.capacity,))
+
+        used = np.flatnonzero(self._ticks)
+        self._slots: Dict[bytes, int] = {self._keys[slot].tobytes(): int(slot) for slot in used}
+        self._free = sorted(set(range(self.capacity)) - set(self._slots.values()), reverse=True)
+        self._clock = int(self._ticks.max()) if len(used) else 0
+
+    def _open_read_only(self, compatible: bool):
+        paths = [self._path(name) for name in ('vectors.dat', 'keys.dat', 'ticks.dat')]
+        self._slots = {}
+        self._free = []
+        self._clock = 0
+        if not compatible or not all(os.path.exists(path) for path in paths):
+            # Nothing usable yet; every lookup is a miss
+            self._vectors = self._keys = self._ticks = None
+            return
+
+        self._vectors = np.memmap(paths[0], dtype=self.dtype, mode='r', shape=(self.capacity, self.dim))
+        self._keys = np.memmap(paths[1], dtype=np.uint8, mode='r', shape=(self.capacity, KEY_BYTES))
+        self._ticks = np.memmap(paths[2], dtype=np.int64, mode='r', shape=(self.capacity,))
+        self._slots = {self._keys[slot].tobytes(): int(slot) for slot in np.flatnonzero(self._ticks)}
+
+    def _memmap(self, name: str, dtype, shape) -> np.memmap:
+        path = self._path(name)
+        mode = 'r+' if os.path.exists(path) else 'w+'
+        return np.memmap(path, dtype=dtype, mode=mode, shape=shape)
+
+    def key(self, text: str) -> bytes:
+        data = f"{self.model_name}\x00{normalize_text(text)}".encode('utf-8')
+        return hashlib.blake2b(data, digest_size=KEY_BYTES).digest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Return the cached vector for each text, or None on a miss"""
+        results = []
+        with self._lock:
+            for text in texts:
+                key = self.key(text)
+                slot = self._slots.get(key)
+                vector = None
+                if slot is not None:
+                    vector = np.array(self._vectors[slot], dtype=np.float32)
+                    # Another process may have reused the slot
+                    if self._keys[slot].tobytes() != key:
+                        del self._slots[key]
+                        vector = None
+                    elif not self.read_only:
+                        self._clock += 1
+                        self._ticks[slot] = self._clock
+
+                if vector is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                results.append(vector)
+        return results
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        """Store vectors, evicting the least recently used entries when full
+        (does nothing on a read-only cache)"""
+        if self.read_only:
+            return
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                slot = self._slots.get(key)
+                if slot is None:
+                    slot = self._allocate_slot()
+                    self._slots[key] = slot
+
+                # Clear the key first so concurrent readers never pair it with a partial vector
+                self._keys[slot] = 0
+                self._vectors[slot] = vector
+                self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+                self._clock += 1
+                self._ticks[slot] = self._clock
+
+    def _allocate_slot(self) -> int:
+        if self._free:
+            return self._free.pop()
+
+        slot = int(np.argmin(self._ticks))
+        old_key = self._keys[slot].tobytes()
+        if self._slots.get(old_key) == slot:
+            del self._slots[old_key]
+        self.evictions += 1
+        return slot
+
+    def embed(self, texts: List[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Return embeddings for texts, calling ``encode`` only for cache misses"""
+        cached = self.get_many(texts)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+
+        if missing:
+            # Encode each distinct missing text once
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            encoded = np.asarray(encode(unique_texts), dtype=np.float32)
+            self.put_many(unique_texts, encoded)
+            by_text = dict(zip(unique_texts, encoded))
+            for i in missing:
+                cached[i] = by_text[texts[i]]
+
+        if not cached:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack(cached)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'entries': len(self._slots),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'read_only': self.read_only
+        }
+
+    def flush(self):
+        if self.read_only:
+            return
+        with self._lock:
+            for array in (self._vectors, self._keys, self._ticks):
+                array.flush()
+
+    def close(self):
+        self.flush()
+        if self._writer_lock is not None:
+            portalocker.unlock(self._writer_lock)
+            self._writer_lock.close()
+            self._writer_lock = None
+
+
+class QueryEmbeddingCache:
+    """Thread-safe in-memory LRU cache of query embeddings with a TTL.
+
+    Keys are ``normalize_query`` forms, so repeated questions that differ only
+    in case, spacing or Unicode composition skip the embedding model. Cached
+    vectors are read-only and shared between callers.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()  # key -> (expires_at, vector)
+        self._lock = threading.Lock()
+
+    def get(self, query: str) -> Optional[np.ndarray]:
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, query: str, vector: np.ndarray):
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'capacity': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,587 @@
+"""
+LLM client for the VWAT RAG system
+Talks to the Ollama/Gemma service over a pooled keep-alive session and
+remembers which of the supported endpoints actually works
+"""
+
+import asyncio
+import collections
+import contextlib
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Dict, Generator, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class LLMError(RuntimeError):
+    """The LLM did not produce an answer"""
+
+
+class LLMUnavailableError(LLMError):
+    """No endpoint answered: connection errors, timeouts or server errors"""
+
+
+class LLMQuotaError(LLMError):
+    """The service refused the request with 429/503 (rate limit or quota exceeded)"""
+
+
+class CircuitOpenError(LLMError):
+    """The circuit breaker is open, so the LLM was not called"""
+
+
+class DeadlineExceededError(LLMError):
+    """The request deadline passed before the LLM answered"""
+
+
+class CircuitBreaker:
+    """Fail fast while the LLM service is down.
+
+    After ``failure_threshold`` consecutive failed requests the circuit
+    opens (a request is one ``generate`` call, however many endpoints it
+    tried) and calls are refused for ``reset_timeout`` seconds. Then a
+    single trial request is let through: success closes the circuit again,
+    failure keeps it open for another ``reset_timeout``.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = 'closed'
+        self.opened = 0
+        self.rejected = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a request may go to the LLM now"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            now = time.monotonic()
+            if self.state == 'open' and now - self._opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            # A trial that never reported back (e.g. cancelled) is replaced after reset_timeout
+            if self.state == 'half_open' and (self._trial_started is None
+                                              or now - self._trial_started >= self.reset_timeout):
+                self._trial_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                print("LLM circuit closed, service is answering again")
+            self.state = 'closed'
+            self._failures = 0
+            self._trial_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                if self.state != 'open':
+                    print(f"LLM circuit open after {self._failures} failure(s), "
+                          f"failing fast for {self.reset_timeout:g}s")
+                    self.opened += 1
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                self._trial_started = None
+
+    def release(self):
+        """The admitted request ended without saying anything about the service"""
+        with self._lock:
+            self._trial_started = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'state': self.state, 'opened': self.opened, 'rejected': self.rejected}
+
+
+class _EndpointClient:
+    """Everything but the HTTP calls, shared by the sync and async clients: endpoint
+    discovery, payload formats, circuit breaker, deadlines, hedging budget and stats"""
+
+    ENDPOINT_PATHS = ('/api/generate', '/generate', '/v1/completions', '/api/chat')
+
+    def __init__(self, api_url='https://ollama-gemma-683508575972.us-central1.run.app/', model='gemma3:4b',
+                 connect_timeout=3.05, read_timeout=30.0, failure_threshold=2, latency_window=256,
+                 breaker_threshold=5, breaker_reset_timeout=30.0, hedge_percentile=None,
+                 hedge_min_samples=20, hedge_max_ratio=0.1):
+        self.api_url = api_url.rstrip('/')
+        self.model = model
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.failure_threshold = failure_threshold
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset_timeout)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_ratio = hedge_max_ratio
+
+        self._lock = threading.Lock()
+        self._endpoint: Optional[str] = None  # Discovered working endpoint
+        self._consecutive_failures = 0
+        self.probes = 0
+        self.requests = 0
+        self.hedges = 0
+        self._stats = {
+            path: {'requests': 0, 'errors': 0, 'latencies': collections.deque(maxlen=latency_window)}
+            for path in self.ENDPOINT_PATHS
+        }
+
+    @property
+    def endpoint(self) -> Optional[str]:
+        """Endpoint path currently in use, or None until one has answered"""
+        return self._endpoint
+
+    def _payload(self, path: str, prompt: str, max_tokens: int, temperature: float,
+                 stream=False) -> Dict[str, Any]:
+        if path == '/v1/completions':
+            return {"model": self.model, "prompt": prompt, "max_tokens": max_tokens,
+                    "temperature": temperature, "stream": stream}
+        options = {"temperature": temperature, "num_predict": max_tokens}
+        if path == '/api/chat':
+            return {"model": self.model, "messages": [{"role": "user", "content": prompt}],
+                    "stream": stream, "options": options}
+        return {"model": self.model, "prompt": prompt, "stream": stream, "options": options}
+
+    @staticmethod
+    def _extract_text(result: Dict[str, Any]) -> str:
+        if result.get('choices'):
+            return result['choices'][0].get('text') or ''
+        if isinstance(result.get('message'), dict):
+            return result['message'].get('content', '')
+        return result.get('response', result.get('text', result.get('content', '')))
+
+    def _record(self, path: str, latency: Optional[float]):
+        with self._lock:
+            stats = self._stats[path]
+            stats['requests'] += 1
+            if latency is None:
+                stats['errors'] += 1
+            else:
+                stats['latencies'].append(latency)
+
+    def _mark_failure(self, path: str, missing=False):
+        """Count a failure of ``path``; drop it as the cached endpoint when it is
+        missing (404 and similar) or has failed ``failure_threshold`` times in a row"""
+        with self._lock:
+            if self._endpoint != path:
+                return
+            self._consecutive_failures += 1
+            if missing or self._consecutive_failures >= self.failure_threshold:
+                print(f"LLM endpoint {path} failed {self._consecutive_failures} time(s) in a row, probing again")
+                self._endpoint = None
+                self._consecutive_failures = 0
+
+    def _mark_success(self, path: str):
+        with self._lock:
+            if self._endpoint != path:
+                print(f"Using LLM endpoint {self.api_url}{path}")
+            self._endpoint = path
+            self._consecutive_failures = 0
+
+    def _admit(self):
+        """Count a request, or raise ``CircuitOpenError`` while the circuit is open"""
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM circuit is open after repeated failures")
+        with self._lock:
+            self.requests += 1
+
+    def _read_timeout(self, deadline: Optional[float]) -> float:
+        """Read timeout for the next attempt, shortened to what is left before ``deadline``
+        (a ``time.monotonic()`` timestamp)"""
+        if deadline is None:
+            return self.read_timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceededError("Request deadline passed before the LLM was called")
+        return min(self.read_timeout, remaining)
+
+    @staticmethod
+    def _deadline_passed(deadline: Optional[float]) -> bool:
+        return deadline is not None and time.monotonic() >= deadline
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Seconds after which a hedged second request is sent, or None not to hedge.
+
+        Hedging needs ``hedge_percentile`` set, a known endpoint with at least
+        ``hedge_min_samples`` latencies, and at most ``hedge_max_ratio`` of
+        requests hedged so far, so it cannot multiply load during an outage.
+        """
+        path = self._endpoint
+        if self.hedge_percentile is None or path is None:
+            return None
+        with self._lock:
+            latencies = list(self._stats[path]['latencies'])
+            if len(latencies) < self.hedge_min_samples or self.hedges >= self.hedge_max_ratio * self.requests:
+                return None
+        return float(np.percentile(latencies, self.hedge_percentile))
+
+    def _candidates(self) -> Tuple[Optional[str], List[str]]:
+        """``(cached endpoint, paths to try)``; a probe of every path when none is cached"""
+        known = self._endpoint
+        if known:
+            return known, [known]
+        with self._lock:
+            self.probes += 1
+        return None, list(self.ENDPOINT_PATHS)
+
+    def _rejected(self, path: str, status: int) -> bool:
+        """Handle a non-200 status: raises ``LLMQuotaError`` on a rate limit,
+        otherwise returns whether the endpoint looks moved (4xx)"""
+        if status == 429 or status == 503:
+            # The endpoint itself exists, so keep using it
+            self._mark_success(path)
+            print(f"Quota limit exceeded (status {status})")
+            raise LLMQuotaError(f"LLM quota exceeded (status {status})")
+        print(f"API returned status {status} for {self.api_url}{path}")
+        self._mark_failure(path, missing=status < 500)
+        return status < 500
+
+    def _attempts(self, prompt: str, max_tokens: int, temperature: float, stream=False,
+                  deadline: Optional[float] = None) -> Generator[Tuple[str, Dict[str, Any], float],
+                                                                 Tuple[Optional[int], Optional[str]], str]:
+        """Endpoint discovery for one request, without the HTTP call.
+
+        Yields ``(path, payload, read timeout)`` for each POST to make, and is
+        sent back ``(status, None)`` or ``(None, error description)``. Returns
+        the path that answered 200, or raises an ``LLMError`` subclass. The
+        recorded latency is to the full response, or to its headers when
+        streaming.
+        """
+        known, candidates = self._candidates()
+        moved = False
+        error = 'no endpoint answered'
+        for path in candidates:
+            start = time.perf_counter()
+            status, error = yield (path, self._payload(path, prompt, max_tokens, temperature, stream),
+                                   self._read_timeout(deadline))
+            self._record(path, time.perf_counter() - start if status == 200 else None)
+            if status is None:
+                print(f"Error with endpoint {self.api_url}{path}: {error}")
+                if self._deadline_passed(deadline):
+                    raise DeadlineExceededError(f"Request deadline passed waiting for the LLM: {error}")
+                self._mark_failure(path)
+                continue
+
+            if status == 200:
+                self._mark_success(path)
+                return path
+            error = f"status {status}"
+            moved = self._rejected(path, status)
+
+        if known and moved and self._endpoint is None:
+            # The cached endpoint is gone (e.g. the service was redeployed with
+            # another API): find the new one for this question
+            return (yield from self._attempts(prompt, max_tokens, temperature, stream, deadline))
+        raise LLMUnavailableError(f"No LLM endpoint answered ({error})")
+
+    @contextlib.contextmanager
+    def _guarded(self):
+        """Circuit breaker around one request: refuses it while the circuit is open,
+        and counts a failure when the block raises ``LLMUnavailableError`` or
+        ``LLMQuotaError``, once however many endpoints were tried"""
+        self._admit()
+        try:
+            yield
+        except (LLMUnavailableError, LLMQuotaError):
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+
+    def _start_hedge(self):
+        with self._lock:
+            self.hedges += 1
+
+    def _answer_text(self, path: str, body: Union[str, bytes]) -> str:
+        try:
+            return self._extract_text(json.loads(body))
+        except ValueError as e:
+            raise LLMUnavailableError(f"Invalid response from {path}: {e}") from e
+
+    def _stream_broke(self, path: str, error: Exception) -> LLMUnavailableError:
+        """Count a stream lost mid-answer as a failure of ``path`` and of the service"""
+        self._mark_failure(path)
+        self.breaker.record_failure()
+        return LLMUnavailableError(f"LLM stream from {path} broke off: {error}")
+
+    def _parse_stream_line(self, line: Union[str, bytes]) -> Tuple[str, bool]:
+        """Text delta of one Ollama NDJSON or OpenAI ``data:`` line, and whether the stream ended"""
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if line.startswith('data:'):
+            line = line[5:].strip()
+            if line == '[DONE]':
+                return '', True
+        if not line:
+            return '', False
+        chunk = json.loads(line)
+        return self._extract_text(chunk), bool(chunk.get('done'))
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-endpoint request/error counts and latency percentiles (ms) of successful calls,
+        plus circuit breaker state and hedged request count"""
+        with self._lock:
+            endpoints = {}
+            for path, stats in self._stats.items():
+                if not stats['requests']:
+                    continue
+                latencies = np.array(stats['latencies']) * 1000.0
+                endpoints[path] = {
+                    'requests': stats['requests'],
+                    'errors': stats['errors'],
+                    'p50_ms': round(float(np.percentile(latencies, 50)), 1) if len(latencies) else None,
+                    'p95_ms': round(float(np.percentile(latencies, 95)), 1) if len(latencies) else None
+                }
+            return {'endpoint': self._endpoint, 'probes': self.probes, 'requests': self.requests,
+                    'hedges': self.hedges, 'circuit': self.breaker.stats(), 'endpoints': endpoints}
+
+
+class LLMClient(_EndpointClient):
+    """Client for Ollama/Gemma LLM API.
+
+    Requests go through one ``requests.Session`` with a connection pool, so
+    TLS and TCP setup are paid once per connection instead of per question.
+    The endpoint paths in ``ENDPOINT_PATHS`` are tried in order only until
+    one answers; that endpoint is then used directly. A 4xx from it means the
+    API moved, so the list is probed again right away; connection errors,
+    timeouts and 5xx responses (other than quota limits) only drop it after
+    ``failure_threshold`` consecutive failures, so a struggling service is
+    not hit with four requests per question.
+    Connect and read timeouts are separate, so an unreachable host fails in
+    seconds while a slow generation still has time to finish.
+
+    Failures raise ``LLMError`` subclasses. After ``breaker_threshold``
+    failed requests in a row the circuit breaker refuses calls at once
+    (``CircuitOpenError``) for ``breaker_reset_timeout`` seconds. A
+    ``deadline`` caps how long one call may take. With ``hedge_percentile``
+    set, a call still running after that latency percentile gets a second,
+    identical request and the first answer wins.
+    """
+
+    def __init__(self, api_url='https://ollama-gemma-683508575972.us-central1.run.app/', model='gemma3:4b',
+                 connect_timeout=3.05, read_timeout=30.0, pool_size=16, failure_threshold=2,
+                 latency_window=256, **resilience):
+        super().__init__(api_url, model, connect_timeout, read_timeout, failure_threshold, latency_window,
+                         **resilience)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._hedge_pool: Optional[ThreadPoolExecutor] = None
+        if self.hedge_percentile is not None:
+            self._hedge_pool = ThreadPoolExecutor(max_workers=2 * pool_size, thread_name_prefix='llm-hedge')
+
+    def _post(self, path: str, payload: Dict[str, Any], read_timeout: float,
+              stream=False) -> Tuple[Optional[requests.Response], Optional[str]]:
+        """POST to one endpoint: (response, None) or (None, error description)"""
+        try:
+            return self.session.post(f"{self.api_url}{path}", json=payload,
+                                     timeout=(self.connect_timeout, read_timeout), stream=stream), None
+        except requests.RequestException as e:
+            return None, str(e)
+
+    def _request(self, prompt: str, max_tokens: int, temperature: float, stream=False,
+                 deadline: Optional[float] = None) -> Tuple[str, requests.Response]:
+        """``(endpoint path, 200 response)`` from the cached or a discovered endpoint"""
+        attempts = self._attempts(prompt, max_tokens, temperature, stream, deadline)
+        outcome = response = None
+        while True:
+            try:
+                path, payload, read_timeout = attempts.send(outcome)
+            except StopIteration as answered:
+                return answered.value, response
+            response, error = self._post(path, payload, read_timeout, stream=stream)
+            if response is not None and response.status_code != 200:
+                response.close()
+            outcome = (response.status_code if response is not None else None, error)
+
+    def _generate_once(self, prompt: str, max_tokens: int, temperature: float,
+                       deadline: Optional[float]) -> str:
+        path, response = self._request(prompt, max_tokens, temperature, deadline=deadline)
+        return self._answer_text(path, response.content)
+
+    def _generate_hedged(self, prompt: str, max_tokens: int, temperature: float,
+                         deadline: Optional[float], delay: float) -> str:
+        args = (prompt, max_tokens, temperature, deadline)
+        primary = self._hedge_pool.submit(self._generate_once, *args)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        self._start_hedge()
+        # The slower request keeps running in the background; its answer is dropped
+        pending = {primary, self._hedge_pool.submit(self._generate_once, *args)}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def generate(self, prompt: str, max_tokens=512, temperature=0.7, deadline: Optional[float] = None) -> str:
+        """Generate response from LLM; raises an ``LLMError`` subclass when there is no answer.
+        ``deadline`` is a ``time.monotonic()`` timestamp the call must finish by."""
+        with self._guarded():
+            delay = self._hedge_delay()
+            if delay is None:
+                return self._generate_once(prompt, max_tokens, temperature, deadline)
+            return self._generate_hedged(prompt, max_tokens, temperature, deadline, delay)
+
+    def generate_stream(self, prompt: str, max_tokens=512, temperature=0.7,
+                        deadline: Optional[float] = None) -> Iterator[str]:
+        """Generate a response as text deltas, as the LLM produces them.
+
+        Reads Ollama's NDJSON lines (``/api/generate``, ``/api/chat``) or
+        OpenAI-style ``data:`` lines (``/v1/completions``). Raises the same
+        errors as ``generate`` before the first delta; ``deadline`` bounds
+        the wait for the stream to start. A connection lost mid-answer
+        raises ``LLMUnavailableError`` after the text received so far.
+        """
+        with self._guarded():
+            path, response = self._request(prompt, max_tokens, temperature, stream=True, deadline=deadline)
+
+        with response:
+            try:
+                for line in response.iter_lines():
+                    text, done = self._parse_stream_line(line)
+                    if text:
+                        yield text
+                    if done:
+                        break
+            except (requests.RequestException, ValueError) as e:
+                raise self._stream_broke(path, e) from e
+
+    def close(self):
+        if self._hedge_pool is not None:
+            self._hedge_pool.shutdown(wait=False)
+        self.session.close()
+
+
+class AsyncLLMClient(_EndpointClient):
+    """asyncio counterpart of ``LLMClient`` over an ``aiohttp`` session.
+
+    Endpoint discovery, errors, circuit breaker, deadlines, hedging and
+    stats behave exactly as in ``LLMClient``, but a request waiting on the
+    LLM holds no thread, so one event loop can keep hundreds of chats in
+    flight. ``max_connections`` caps the open connections to the LLM
+    service; further requests wait for a free connection for at most the
+    read timeout. The slower of two hedged requests is cancelled.
+    Create it inside the event loop that will use it.
+    """
+
+    def __init__(self, api_url='https://ollama-gemma-683508575972.us-central1.run.app/', model='gemma3:4b',
+                 connect_timeout=3.05, read_timeout=30.0, max_connections=100, failure_threshold=2,
+                 latency_window=256, **resilience):
+        import aiohttp
+
+        super().__init__(api_url, model, connect_timeout, read_timeout, failure_threshold, latency_window,
+                         **resilience)
+        self._aiohttp = aiohttp
+        self._errors = (aiohttp.ClientError, asyncio.TimeoutError)
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=max_connections))
+
+    async def _post(self, path: str, payload: Dict[str, Any], read_timeout: float, stream=False):
+        """POST to one endpoint: (response, None) or (None, error description)"""
+        timeout = self._aiohttp.ClientTimeout(total=None, connect=read_timeout, sock_connect=self.connect_timeout,
+                                              sock_read=read_timeout)
+        try:
+            response = await self.session.post(f"{self.api_url}{path}", json=payload, timeout=timeout)
+            if response.status == 200 and not stream:
+                await response.read()
+        except self._errors as e:
+            return None, str(e) or type(e).__name__
+        return response, None
+
+    async def _request(self, prompt: str, max_tokens: int, temperature: float, stream=False,
+                       deadline: Optional[float] = None):
+        """``(endpoint path, 200 response)`` from the cached or a discovered endpoint"""
+        attempts = self._attempts(prompt, max_tokens, temperature, stream, deadline)
+        outcome = response = None
+        while True:
+            try:
+                path, payload, read_timeout = attempts.send(outcome)
+            except StopIteration as answered:
+                return answered.value, response
+            response, error = await self._post(path, payload, read_timeout, stream=stream)
+            if response is not None and response.status != 200:
+                response.release()
+            outcome = (response.status if response is not None else None, error)
+
+    async def _generate_once(self, prompt: str, max_tokens: int, temperature: float,
+                             deadline: Optional[float]) -> str:
+        path, response = await self._request(prompt, max_tokens, temperature, deadline=deadline)
+        return self._answer_text(path, await response.read())
+
+    async def _generate_hedged(self, prompt: str, max_tokens: int, temperature: float,
+                               deadline: Optional[float], delay: float) -> str:
+        args = (prompt, max_tokens, temperature, deadline)
+        pending = {asyncio.ensure_future(self._generate_once(*args))}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return done.pop().result()
+
+            self._start_hedge()
+            pending.add(asyncio.ensure_future(self._generate_once(*args)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def generate(self, prompt: str, max_tokens=512, temperature=0.7,
+                       deadline: Optional[float] = None) -> str:
+        """Generate response from LLM; raises an ``LLMError`` subclass when there is no answer"""
+        with self._guarded():
+            delay = self._hedge_delay()
+            if delay is None:
+                return await self._generate_once(prompt, max_tokens, temperature, deadline)
+            return await self._generate_hedged(prompt, max_tokens, temperature, deadline, delay)
+
+    async def generate_stream(self, prompt: str, max_tokens=512, temperature=0.7,
+                              deadline: Optional[float] = None) -> AsyncIterator[str]:
+        """Generate a response as text deltas, like ``LLMClient.generate_stream``.
+        Closing the generator early (e.g. the browser went away) closes the LLM request."""
+        with self._guarded():
+            path, response = await self._request(prompt, max_tokens, temperature, stream=True, deadline=deadline)
+
+        finished = False
+        try:
+            async for line in response.content:
+                if finished:
+                    continue  # Read to the end so the connection can be reused
+                text, finished = self._parse_stream_line(line.strip())
+                if text:
+                    yield text
+            finished = True
+        except (*self._errors, ValueError) as e:
+            raise self._stream_broke(path, e) from e
+        finally:
+            if finished:
+                response.release()
+            else:
+                response.close()
+
+    async def close(self):
+        await self.session.close()
@@ -0,0 +1,113 @@
+"""
+Query pre-filters for the VWAT RAG system
+Off-topic and language checks that run before every retrieval, backed by
+patterns compiled once from the keyword lists in data/query_keywords.json
+"""
+
+import json
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+QUERY_KEYWORDS_FILE = os.environ.get(
+    'RAG_QUERY_KEYWORDS',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'query_keywords.json')
+)
+
+# Characters with Vietnamese diacritics
+VIETNAMESE_CHARS = ("ăâđêôơưÁÀẢÃẠẮẰẲẴẶẤẦẨẪẬÉÈẺẼẸẾỀỂỄỆÍÌỈĨỊÓÒỎÕỌỐỒỔỖỘỚỜỞỠỢÚÙỦŨỤỨỪỬỮỰÝỲỶỸỴ"
+                    "áàảãạắằẳẵặấầẩẫậéèẻẽẹếềểễệíìỉĩịóòỏõọốồổỗộớờởỡợúùủũụứừửữựýỳỷỹỵ")
+
+# Punctuation ignored around a word, as in ``token.strip(".,!?;:")``
+_WORD_PUNCT = '.,!?;:'
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """Regex alternation of ``words`` factored by common prefix.
+
+    ``cook``, ``cooking`` and ``crypto`` become ``c(?:ook(?:ing)?|rypto)``, so
+    the regex engine walks a keyword trie at each position instead of
+    retrying every keyword in turn.
+    """
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        # A word ends here, so the rest is optional
+        return f"(?:{body})?" if '' in node else body
+
+    return build(trie)
+
+
+def compile_substring_matcher(keywords: Iterable[str]) -> re.Pattern:
+    """One pattern that matches if any keyword occurs as a substring of lowercased text"""
+    keywords = {k.lower() for k in keywords if k}
+    if not keywords:
+        return re.compile(r'(?!)')
+    return re.compile(_trie_pattern(keywords))
+
+
+def compile_language_matcher(vietnamese_words: Iterable[str]) -> re.Pattern:
+    """Vietnamese diacritic anywhere, or a known word typed without accents.
+
+    A word only counts as a whole whitespace-separated token, optionally
+    wrapped in ``.,!?;:``, and is matched case-insensitively.
+    """
+    words = {w.lower() for w in vietnamese_words if w}
+    parts = [f"[{re.escape(VIETNAMESE_CHARS)}]"]
+    if words:
+        punct = re.escape(_WORD_PUNCT)
+        parts.append(rf"(?<!\S)[{punct}]*(?i:{_trie_pattern(words)})[{punct}]*(?!\S)")
+    return re.compile('|'.join(parts))
+
+
+_off_topic_re: re.Pattern = re.compile(r'(?!)')
+_vietnamese_re: re.Pattern = compile_language_matcher(())
+
+
+def load_query_keywords(path: Optional[str] = None) -> Dict[str, List[str]]:
+    """Read the keyword lists and rebuild the module-level matchers"""
+    global _off_topic_re, _vietnamese_re
+    with open(path or QUERY_KEYWORDS_FILE, 'r', encoding='utf-8') as f:
+        keywords = json.load(f)
+    off_topic = keywords.get('off_topic', [])
+    vietnamese_words = keywords.get('vietnamese_words', [])
+
+    # Compile both before swapping so readers never see a half-loaded state
+    off_topic_re = compile_substring_matcher(off_topic)
+    vietnamese_re = compile_language_matcher(vietnamese_words)
+    _off_topic_re, _vietnamese_re = off_topic_re, vietnamese_re
+    return {'off_topic': off_topic, 'vietnamese_words': vietnamese_words}
+
+
+def detect_query_language(query: Union[str, Sequence[str]]) -> Union[str, List[str]]:
+    """Lightweight detection of whether a query is Vietnamese ('vi') or English ('en').
+    Uses presence of Vietnamese diacritics and a few common words as a heuristic.
+    Accepts one query or a list of queries.
+    """
+    pattern = _vietnamese_re
+    if isinstance(query, str):
+        return 'vi' if pattern.search(query) else 'en'
+    return ['vi' if pattern.search(q) else 'en' for q in query]
+
+
+def is_query_relevant(query: Union[str, Sequence[str]], language: str = 'vi') -> Union[bool, List[bool]]:
+    """Check if query is related to VWAT services, programs, or organization.
+    Only clearly off-topic queries are rejected; ambiguous ones are left to
+    retrieval. Accepts one query or a list of queries.
+    """
+    pattern = _off_topic_re
+    if isinstance(query, str):
+        return pattern.search(query.lower()) is None
+    return [pattern.search(q.lower()) is None for q in query]
+
+
+load_query_keywords()
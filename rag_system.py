@@ -3,223 +3,1135 @@ Advanced RAG System for VWAT Chatbot
 Implements chunking, embedding, vector storage with Qdrant, and retrieval
 """
 
+import asyncio
+import bisect
+import collections
+import contextlib
+import fnmatch
+import hashlib
+import itertools
 import json
+import multiprocessing
 import os
-from typing import List, Dict, Any, Tuple
+import queue
+import re
+import shutil
+import threading
+import time
+import unicodedata
+import uuid
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import List, Dict, Any, Tuple, Optional, Iterator, Iterable, AsyncIterator
 import tiktoken
-from sentence_transformers import SentenceTransformer
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 import requests
 import numpy as np
 from portalocker import exceptions as portalocker_exceptions
+from answer_cache import SemanticAnswerCache
+from embedding_batcher import EmbeddingBatcher
+from embedding_cache import EmbeddingCache, QueryEmbeddingCache, normalize_query
+from llm_client import AsyncLLMClient, DeadlineExceededError, LLMClient, LLMError
+from query_classifier import detect_query_language, is_query_relevant
+from response_sanitizer import StreamSanitizer, sanitize_response
+from single_flight import AsyncSingleFlight, SingleFlight, SingleFlightTimeout
+from sparse_index import BM25Index, fold_diacritics, tokenize
+
+
+# Manifest of indexed chunks, stored next to the Qdrant data
+INDEX_MANIFEST_FILENAME = 'index_manifest.json'
+
+
+def compute_chunk_id(chunk: Dict) -> str:
+    """Stable point ID derived from a hash of the chunk source and text"""
+    source = chunk.get('metadata', {}).get('source', '')
+    digest = hashlib.sha256(f"{source}\x00{chunk['text']}".encode('utf-8')).hexdigest()
+    return str(uuid.UUID(digest[:32]))
+
+
+def compute_payload_hash(payload: Dict) -> str:
+    """Hash of a point payload, used to detect metadata-only changes"""
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:16]
+
+
+# Versioned, immutable index snapshots served read-only at runtime
+SNAPSHOT_ROOT = os.environ.get('RAG_SNAPSHOT_ROOT', './index_snapshots')
+SNAPSHOT_POINTER = 'CURRENT'
+SNAPSHOT_MANIFEST = 'manifest.json'
+SPARSE_INDEX_FILENAME = 'sparse_index.npz'
+
+# Below this total input size, files are parsed in the indexing process itself;
+# spawning a process pool costs more than it saves
+PARALLEL_PARSE_MIN_BYTES = 8 * 1024 * 1024
+# Chunks sent per message from a parser process
+PARSE_MESSAGE_CHUNKS = 64
+
+
+# Sentence ends for English and Vietnamese text: terminal punctuation (with any
+# closing quotes/brackets) followed by whitespace, or a line break
+_SENTENCE_END_RE = re.compile(r'[.!?…]+["\'”’)\]]*(?=\s)|\n')
+
+# Abbreviations whose trailing period does not end a sentence
+# (street addresses, titles, Vietnamese "TP." / "Q." / "P." / "ThS." ...)
+_ABBREVIATIONS = {
+    'st', 'ave', 'rd', 'blvd', 'dr', 'mr', 'mrs', 'ms', 'prof', 'inc', 'ltd',
+    'e.g', 'i.e', 'vs', 'tp', 'q', 'p', 'ths', 'ts', 'bs'
+}
 
 
 class DocumentProcessor:
     """Process and chunk documents for RAG"""
     
-    def __init__(self, max_chunk_tokens=512):
+    def __init__(self, max_chunk_tokens=512, chunk_overlap_tokens=0, respect_sentences=True):
+        if not 0 <= chunk_overlap_tokens < max_chunk_tokens:
+            raise ValueError("chunk_overlap_tokens must be between 0 and max_chunk_tokens - 1")
         self.max_chunk_tokens = max_chunk_tokens
+        self.chunk_overlap_tokens = chunk_overlap_tokens
+        self.respect_sentences = respect_sentences
         self.tokenizer = tiktoken.get_encoding("cl100k_base")
     
     def count_tokens(self, text: str) -> int:
         """Count tokens in text"""
         return len(self.tokenizer.encode(text))
     
+    @staticmethod
+    def _sentence_ends(text: str) -> Iterator[int]:
+        """Character offsets at which a sentence ends"""
+        for match in _SENTENCE_END_RE.finditer(text):
+            if match.group() != '\n':
+                # Skip periods that belong to an abbreviation like "St." or "TP."
+                preceding = text[max(0, match.start() - 6):match.start()].split()
+                if preceding and preceding[-1].lower() in _ABBREVIATIONS:
+                    continue
+            yield match.end()
+    
+    def split_sentences(self, text: str) -> List[str]:
+        """Split text into sentences (and lines), dropping empty ones"""
+        sentences = []
+        start = 0
+        for end in self._sentence_ends(text):
+            sentences.append(text[start:end].strip())
+            start = end
+        sentences.append(text[start:].strip())
+        return [sentence for sentence in sentences if sentence]
+    
+    def _sentence_boundaries(self, text: str, offsets: List[int]) -> List[int]:
+        """Token indices at which a new sentence starts"""
+        boundaries = []
+        for end in self._sentence_ends(text):
+            token_idx = bisect.bisect_left(offsets, end)
+            if 0 < token_idx < len(offsets) and (not boundaries or boundaries[-1] != token_idx):
+                boundaries.append(token_idx)
+        return boundaries
+    
     def chunk_text(self, text: str, metadata: Dict = None) -> List[Dict]:
-        """Chunk text into smaller pieces with metadata"""
-        chunks = []
-        sentences = text.split('. ')
+        """Chunk text into smaller pieces with metadata.
         
-        current_chunk = ""
-        current_tokens = 0
+        The text is tokenized once; chunks are windows of at most
+        ``max_chunk_tokens`` tokens that end on a sentence boundary when one
+        falls inside the window, and consecutive chunks share up to
+        ``chunk_overlap_tokens`` tokens.
+        """
+        tokens = self.tokenizer.encode(text)
+        n_tokens = len(tokens)
+        if n_tokens == 0:
+            return []
         
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
+        if n_tokens <= self.max_chunk_tokens:
+            chunk = text.strip()
+            return [{'text': chunk, 'tokens': n_tokens, 'metadata': metadata or {}}] if chunk else []
+        
+        # Character offset of every token, so chunks can be sliced from the text
+        _, offsets = self.tokenizer.decode_with_offsets(tokens)
+        boundaries = self._sentence_boundaries(text, offsets) if self.respect_sentences else []
+        
+        chunks = []
+        start = 0
+        prev_end = 0
+        while start < n_tokens:
+            end = min(start + self.max_chunk_tokens, n_tokens)
             
-            # Add period back if it was removed
-            if not sentence.endswith('.'):
-                sentence += '.'
+            # Prefer ending the chunk at the last sentence boundary in the window
+            # (past the previous chunk's end, so overlapping chunks still advance)
+            if end < n_tokens and boundaries:
+                i = bisect.bisect_right(boundaries, end) - 1
+                if i >= 0 and boundaries[i] > max(start, prev_end):
+                    end = boundaries[i]
             
-            sentence_tokens = self.count_tokens(sentence)
+            char_end = offsets[end] if end < n_tokens else len(text)
+            chunk = text[offsets[start]:char_end].strip()
+            if chunk:
+                chunks.append({
+                    'text': chunk,
+                    'tokens': end - start,
+                    'metadata': metadata or {}
+                })
             
-            # If single sentence exceeds max tokens, split it
-            if sentence_tokens > self.max_chunk_tokens:
-                if current_chunk:
-                    chunks.append({
-                        'text': current_chunk.strip(),
-                        'tokens': current_tokens,
-                        'metadata': metadata or {}
-                    })
-                    current_chunk = ""
-                    current_tokens = 0
-                
-                # Split long sentence by words
-                words = sentence.split()
-                temp_chunk = ""
-                for word in words:
-                    test_chunk = temp_chunk + " " + word if temp_chunk else word
-                    if self.count_tokens(test_chunk) > self.max_chunk_tokens:
-                        if temp_chunk:
-                            chunks.append({
-                                'text': temp_chunk.strip(),
-                                'tokens': self.count_tokens(temp_chunk),
-                                'metadata': metadata or {}
-                            })
-                        temp_chunk = word
-                    else:
-                        temp_chunk = test_chunk
-                
-                if temp_chunk:
-                    current_chunk = temp_chunk
-                    current_tokens = self.count_tokens(temp_chunk)
+            if end >= n_tokens:
+                break
             
-            # Normal case: add sentence to current chunk
-            elif current_tokens + sentence_tokens <= self.max_chunk_tokens:
-                current_chunk = current_chunk + " " + sentence if current_chunk else sentence
-                current_tokens += sentence_tokens
-            else:
-                # Save current chunk and start new one
-                if current_chunk:
-                    chunks.append({
-                        'text': current_chunk.strip(),
-                        'tokens': current_tokens,
-                        'metadata': metadata or {}
-                    })
-                current_chunk = sentence
-                current_tokens = sentence_tokens
-        
-        # Add last chunk
-        if current_chunk:
-            chunks.append({
-                'text': current_chunk.strip(),
-                'tokens': current_tokens,
-                'metadata': metadata or {}
-            })
+            prev_end = end
+            next_start = end
+            if self.chunk_overlap_tokens:
+                next_start = end - self.chunk_overlap_tokens
+                # Start the overlap on a sentence boundary when possible
+                i = bisect.bisect_left(boundaries, next_start)
+                if i < len(boundaries) and boundaries[i] < end:
+                    next_start = boundaries[i]
+            start = max(next_start, start + 1)
         
         return chunks
     
+    def iter_json_file(self, filepath: str) -> Iterator[Dict]:
+        """Lazily yield chunks from a JSON file using the registered parsers"""
+        filename = os.path.basename(filepath)
+        records = iter_json_records(filepath)
+        
+        parser = find_parser(filename)
+        if parser is None:
+            # No glob claims the file: pick a parser by the schema of its first record
+            first = next(records, None)
+            if first is None:
+                return
+            parser = find_parser(filename, first)
+            if parser is None:
+                print(f"No parser registered for {filename}, skipping")
+                return
+            records = itertools.chain([first], records)
+        
+        yield from parser.iter_chunks(records, filename, self)
+    
     def process_json_file(self, filepath: str) -> List[Dict]:
         """Process a JSON file and return chunks with metadata"""
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        return list(self.iter_json_file(filepath))
+
+
+def iter_json_records(filepath: str) -> Iterator[Any]:
+    """Yield the records of a JSON file without loading the whole file.
+    
+    A top-level array yields its elements one by one (streamed with ijson
+    when installed); any other document is yielded as a single record.
+    """
+    with open(filepath, 'rb') as f:
+        head = f.read(64).lstrip(b'\xef\xbb\xbf \t\r\n')
+        f.seek(0)
         
-        chunks = []
-        filename = os.path.basename(filepath)
+        if head.startswith(b'['):
+            try:
+                import ijson
+            except ImportError:
+                ijson = None
+            
+            if ijson is not None:
+                yield from ijson.items(f, 'item', use_float=True)
+                return
         
-        # Handle different JSON structures
-        if filename == 'vwat_complete_rag_data.json':
-            # Handle the comprehensive RAG-optimized data
-            for item in data:
-                if isinstance(item, dict):
-                    title = item.get('title', '')
-                    content = item.get('content', '')
-                    category = item.get('category', '')
-                    keywords = item.get('keywords', [])
-                    
-                    text = f"{title}\n\n{content}"
-                    if keywords:
-                        text += f"\n\nKeywords: {', '.join(keywords)}"
-                    
-                    metadata = {
-                        'source': filename,
-                        'type': 'rag_optimized',
-                        'category': category,
-                        'id': item.get('id', ''),
-                        'keywords': keywords
-                    }
-                    chunks.extend(self.chunk_text(text, metadata))
-        
-        elif filename == 'faqs.json' or filename == 'faq_converted.json':
-            for item in data:
-                if isinstance(item, dict):
-                    q = item.get('q', item.get('Unnamed: 0', ''))
-                    a = item.get('a', item.get('Unnamed: 1', ''))
-                    text = f"Question: {q}\nAnswer: {a}"
-                    metadata = {
-                        'source': filename,
-                        'type': 'faq',
-                        'question': q,
-                        'answer': a
-                    }
-                    chunks.extend(self.chunk_text(text, metadata))
-        
-        elif filename == 'services.json':
-            for service in data:
-                if isinstance(service, dict):
-                    category = service.get('category', '')
-                    short = service.get('short', '')
-                    offers = service.get('offers', [])
-                    
-                    text = f"Service Category: {category}\nDescription: {short}\n"
-                    if offers:
-                        text += "Offerings:\n" + "\n".join([f"• {offer}" for offer in offers])
-                    
-                    metadata = {
-                        'source': filename,
-                        'type': 'service',
-                        'category': category
-                    }
-                    chunks.extend(self.chunk_text(text, metadata))
-        
-        elif filename == 'programs.json' or filename == 'programs_vietnamese.json':
-            for program in data:
-                if isinstance(program, dict):
-                    name = program.get('name', '')
-                    category = program.get('category', '')
-                    desc = program.get('description', '')
-                    
-                    # Clean HTML from description
-                    import re
-                    desc_clean = re.sub('<[^<]+?>', '', desc)
-                    
-                    text = f"Program: {name}\nCategory: {category}\nDescription: {desc_clean}"
-                    metadata = {
-                        'source': filename,
-                        'type': 'program',
-                        'name': name,
-                        'category': category
-                    }
-                    chunks.extend(self.chunk_text(text, metadata))
-        
-        elif filename == 'org.json':
-            if isinstance(data, dict):
-                text = f"Organization: {data.get('name', '')}\n"
-                text += f"Mission: {data.get('mission', '')}\n"
-                
-                address = data.get('address', {})
-                if address:
-                    text += f"Address: {address.get('street', '')}, {address.get('city', '')}, {address.get('province', '')} {address.get('postal_code', '')}\n"
-                
-                hours = data.get('hours', {})
-                if hours:
-                    text += f"Hours: {hours.get('monday_friday', '')}\n"
-                
-                emails = data.get('emails', {})
-                if emails:
-                    text += f"Emails: {', '.join([f'{k}: {v}' for k, v in emails.items()])}\n"
-                
-                metadata = {
-                    'source': filename,
-                    'type': 'organization'
-                }
-                chunks.extend(self.chunk_text(text, metadata))
-        
-        elif 'converted' in filename:
-            # Handle converted Excel files
-            for item in data:
-                if isinstance(item, dict):
-                    text = " ".join([str(v) for v in item.values() if v and str(v) != 'nan'])
-                    if text.strip():
-                        metadata = {
-                            'source': filename,
-                            'type': 'converted_data'
-                        }
-                        chunks.extend(self.chunk_text(text, metadata))
+        data = json.loads(f.read().decode('utf-8-sig'))
+    
+    if isinstance(data, list):
+        yield from data
+    else:
+        yield data
+
+
+# Parsers for the knowledge files, tried in registration order
+PARSER_REGISTRY: List['DocumentParser'] = []
+
+
+def register_parser(parser_cls):
+    """Class decorator adding a DocumentParser to the registry"""
+    PARSER_REGISTRY.append(parser_cls())
+    return parser_cls
+
+
+def find_parser(filename: str, sample_record: Any = None) -> Optional['DocumentParser']:
+    """Find a parser by filename glob, or by schema when a sample record is given"""
+    for parser in PARSER_REGISTRY:
+        if parser.matches_filename(filename):
+            return parser
+    
+    if sample_record is not None:
+        for parser in PARSER_REGISTRY:
+            if parser.matches_schema(sample_record):
+                return parser
+    
+    return None
+
+
+class DocumentParser:
+    """Base class for knowledge file parsers.
+    
+    Subclasses list the filename globs they handle in ``patterns`` and the
+    keys that identify their record schema in ``required_keys``, and turn a
+    single record into text plus metadata in ``parse_record``.
+    """
+    
+    patterns: Tuple[str, ...] = ()
+    required_keys: Tuple[str, ...] = ()
+    
+    def matches_filename(self, filename: str) -> bool:
+        return any(fnmatch.fnmatch(filename, pattern) for pattern in self.patterns)
+    
+    def matches_schema(self, record: Any) -> bool:
+        return (bool(self.required_keys) and isinstance(record, dict)
+                and all(key in record for key in self.required_keys))
+    
+    def parse_record(self, record: Dict, filename: str) -> Optional[Tuple[str, Dict]]:
+        """Return (text, metadata) for a record, or None to skip it"""
+        raise NotImplementedError
+    
+    def iter_chunks(self, records: Iterable[Any], filename: str,
+                    processor: DocumentProcessor) -> Iterator[Dict]:
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            parsed = self.parse_record(record, filename)
+            if parsed:
+                text, metadata = parsed
+                yield from processor.chunk_text(text, metadata)
+
+
+_HTML_TAG_RE = re.compile('<[^<]+?>')
+
+
+@register_parser
+class RagOptimizedParser(DocumentParser):
+    """Comprehensive RAG-optimized entries with title, content and keywords"""
+    
+    patterns = ('vwat_complete_rag_data.json',)
+    required_keys = ('title', 'content')
+    
+    def parse_record(self, record, filename):
+        title = record.get('title', '')
+        content = record.get('content', '')
+        category = record.get('category', '')
+        keywords = record.get('keywords', [])
         
-        return chunks
+        text = f"{title}\n\n{content}"
+        if keywords:
+            text += f"\n\nKeywords: {', '.join(keywords)}"
+        
+        metadata = {
+            'source': filename,
+            'type': 'rag_optimized',
+            'category': category,
+            'id': record.get('id', ''),
+            'keywords': keywords
+        }
+        return text, metadata
+
+
+@register_parser
+class FaqParser(DocumentParser):
+    """Question/answer pairs"""
+    
+    patterns = ('faqs.json', 'faq_converted.json')
+    required_keys = ('q', 'a')
+    
+    def parse_record(self, record, filename):
+        q = record.get('q', record.get('Unnamed: 0', ''))
+        a = record.get('a', record.get('Unnamed: 1', ''))
+        text = f"Question: {q}\nAnswer: {a}"
+        metadata = {
+            'source': filename,
+            'type': 'faq',
+            'question': q,
+            'answer': a
+        }
+        return text, metadata
+
+
+@register_parser
+class ServiceParser(DocumentParser):
+    """Service categories with their offerings"""
+    
+    patterns = ('services.json',)
+    required_keys = ('category', 'short', 'offers')
+    
+    def parse_record(self, record, filename):
+        category = record.get('category', '')
+        short = record.get('short', '')
+        offers = record.get('offers', [])
+        
+        text = f"Service Category: {category}\nDescription: {short}\n"
+        if offers:
+            text += "Offerings:\n" + "\n".join([f"• {offer}" for offer in offers])
+        
+        metadata = {
+            'source': filename,
+            'type': 'service',
+            'category': category
+        }
+        return text, metadata
+
+
+@register_parser
+class ProgramParser(DocumentParser):
+    """Programs with HTML descriptions"""
+    
+    patterns = ('programs.json', 'programs_vietnamese.json')
+    required_keys = ('name', 'category', 'description')
+    
+    def parse_record(self, record, filename):
+        name = record.get('name', '')
+        category = record.get('category', '')
+        desc = record.get('description', '')
+        
+        # Clean HTML from description
+        desc_clean = _HTML_TAG_RE.sub('', desc)
+        
+        text = f"Program: {name}\nCategory: {category}\nDescription: {desc_clean}"
+        metadata = {
+            'source': filename,
+            'type': 'program',
+            'name': name,
+            'category': category
+        }
+        return text, metadata
+
+
+@register_parser
+class OrganizationParser(DocumentParser):
+    """Single organization profile object"""
+    
+    patterns = ('org.json',)
+    required_keys = ('name', 'mission')
+    
+    def parse_record(self, record, filename):
+        text = f"Organization: {record.get('name', '')}\n"
+        text += f"Mission: {record.get('mission', '')}\n"
+        
+        address = record.get('address', {})
+        if address:
+            text += f"Address: {address.get('street', '')}, {address.get('city', '')}, {address.get('province', '')} {address.get('postal_code', '')}\n"
+        
+        hours = record.get('hours', {})
+        if hours:
+            text += f"Hours: {hours.get('monday_friday', '')}\n"
+            if hours.get('saturday') or hours.get('sunday'):
+                text += f"Saturday: {hours.get('saturday', '')}, Sunday: {hours.get('sunday', '')}\n"
+        
+        phones = record.get('phones', [])
+        if phones:
+            numbers = [f"{phone.get('label', '')}: {phone.get('number', '')}" for phone in phones]
+            text += f"Phones: {', '.join(numbers)}\n"
+        
+        emails = record.get('emails', {})
+        if emails:
+            text += f"Emails: {', '.join([f'{k}: {v}' for k, v in emails.items()])}\n"
+        
+        metadata = {
+            'source': filename,
+            'type': 'organization'
+        }
+        return text, metadata
+
+
+@register_parser
+class ContactsParser(DocumentParser):
+    """Team emails and staff directory"""
+    
+    patterns = ('contacts.json',)
+    required_keys = ('staff_directory',)
+    
+    def parse_record(self, record, filename):
+        text = "VWAT Contacts\n"
+        for team, emails in record.get('teams', {}).items():
+            text += f"{team} team: {', '.join(emails)}\n"
+        for staff in record.get('staff_directory', []):
+            text += f"{staff.get('name', '')} ({staff.get('role', '')}): {staff.get('email', '')}, {staff.get('phone', '')}\n"
+        
+        metadata = {
+            'source': filename,
+            'type': 'contacts'
+        }
+        return text, metadata
+
+
+@register_parser
+class ConvertedDataParser(DocumentParser):
+    """Rows of converted Excel files"""
+    
+    patterns = ('*converted*',)
+    
+    def parse_record(self, record, filename):
+        text = " ".join([str(v) for v in record.values() if v and str(v) != 'nan'])
+        if not text.strip():
+            return None
+        metadata = {
+            'source': filename,
+            'type': 'converted_data'
+        }
+        return text, metadata
+
+
+class NearDuplicateDetector:
+    """Streaming MinHash/LSH detection of near-duplicate chunks.
+    
+    Each chunk is reduced to a MinHash signature over word shingles; LSH
+    banding finds earlier chunks sharing a band, and a chunk whose estimated
+    Jaccard similarity with one of them reaches ``threshold`` is reported as
+    a duplicate of it. The first chunk seen in a cluster is its representative.
+    """
+    
+    # Prime just above 2**32 for the (a * h + b) % p hash family
+    _PRIME = 4294967311
+    _WORD_RE = re.compile(r'\w+')
+    
+    def __init__(self, threshold=0.85, num_perm=64, bands=16, shingle_size=3, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        
+        rng = np.random.RandomState(seed)
+        # a, b < 2**31 keep a * h + b below 2**63 for 32-bit shingle hashes
+        self._a = rng.randint(1, 2 ** 31, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, 2 ** 31, size=num_perm).astype(np.uint64)
+        
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = collections.defaultdict(list)
+        self._signatures: List[np.ndarray] = []
+        self._ids: List[str] = []
+    
+    def _shingles(self, text: str) -> np.ndarray:
+        words = self._WORD_RE.findall(unicodedata.normalize('NFC', text).lower())
+        k = min(self.shingle_size, len(words)) or 1
+        shingles = {' '.join(words[i:i + k]) for i in range(max(len(words) - k + 1, 1))}
+        return np.array([zlib.crc32(shingle.encode('utf-8')) for shingle in shingles], dtype=np.uint64)
+    
+    def signature(self, text: str) -> np.ndarray:
+        hashes = self._shingles(text)
+        return ((np.outer(hashes, self._a) + self._b) % self._PRIME).min(axis=0)
+    
+    def find_or_add(self, point_id: str, text: str) -> Optional[str]:
+        """Return the representative ID if ``text`` is a near duplicate, else register it"""
+        signature = self.signature(text)
+        band_keys = [
+            (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+        
+        candidates = set()
+        for key in band_keys:
+            candidates.update(self._buckets.get(key, ()))
+        
+        best_idx, best_similarity = None, 0.0
+        for idx in candidates:
+            similarity = float(np.mean(self._signatures[idx] == signature))
+            if similarity > best_similarity:
+                best_idx, best_similarity = idx, similarity
+        if best_idx is not None and best_similarity >= self.threshold:
+            return self._ids[best_idx]
+        
+        idx = len(self._ids)
+        self._ids.append(point_id)
+        self._signatures.append(signature)
+        for key in band_keys:
+            self._buckets[key].append(idx)
+        return None
+
+
+# Per-process state of ingestion parser workers
+_worker_processor = None
+_worker_queue = None
+_worker_stop = None
+
+
+def _init_parse_worker(chunk_queue, stop_event, processor_kwargs):
+    """Process pool initializer for ingestion parser workers"""
+    global _worker_processor, _worker_queue, _worker_stop
+    _worker_processor = DocumentProcessor(**processor_kwargs)
+    _worker_queue = chunk_queue
+    _worker_stop = stop_event
+
+
+def _worker_put(message):
+    """Put a message on the bounded chunk queue, giving up if ingestion was aborted"""
+    while not _worker_stop.is_set():
+        try:
+            _worker_queue.put(message, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+    raise RuntimeError("Ingestion aborted")
+
+
+def _parse_file_worker(filepath: str) -> int:
+    """Stream the chunks of one file to the indexing process in small batches"""
+    batch = []
+    count = 0
+    for chunk in _worker_processor.iter_json_file(filepath):
+        batch.append(chunk)
+        count += 1
+        if len(batch) >= PARSE_MESSAGE_CHUNKS:
+            _worker_put(('chunks', batch))
+            batch = []
+    if batch:
+        _worker_put(('chunks', batch))
+    _worker_put(('done', os.path.basename(filepath), count))
+    return count
+
+
+class IngestionProgress:
+    """Thread-safe stage counters with periodic throughput reporting"""
+    
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.counts = {'parsed': 0, 'embedded': 0, 'upserted': 0}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._last_report = self._start
+    
+    def add(self, stage: str, n: int = 1):
+        with self._lock:
+            self.counts[stage] += n
+    
+    def report(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self._last_report < self.interval:
+            return
+        self._last_report = now
+        with self._lock:
+            counts = dict(self.counts)
+        elapsed = max(now - self._start, 1e-9)
+        print(f"[ingest] parsed {counts['parsed']} | embedded {counts['embedded']} | "
+              f"upserted {counts['upserted']} | {counts['parsed'] / elapsed:.1f} chunks/s parsed, "
+              f"{counts['embedded'] / elapsed:.1f} chunks/s embedded ({elapsed:.1f}s)")
+
+
+class QdrantWriter(threading.Thread):
+    """Background thread applying index writes from a bounded queue.
+    
+    ``put`` blocks while ``max_pending`` operations are queued, which keeps the
+    embedding stage from running ahead of Qdrant.
+    """
+    
+    def __init__(self, client, collection_name: str, progress: IngestionProgress, max_pending=4):
+        super().__init__(name='qdrant-writer', daemon=True)
+        self.client = client
+        self.collection_name = collection_name
+        self.progress = progress
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+    
+    def put(self, operation: Tuple):
+        while True:
+            if self.error is not None:
+                raise RuntimeError("Qdrant writer failed") from self.error
+            try:
+                self._queue.put(operation, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+    
+    def close(self):
+        """Flush pending writes and stop the thread, re-raising any write error"""
+        if self.is_alive():
+            self._queue.put(None)
+            self.join()
+        if self.error is not None:
+            raise RuntimeError("Qdrant writer failed") from self.error
+    
+    def run(self):
+        while True:
+            operation = self._queue.get()
+            if operation is None:
+                return
+            if self.error is not None:
+                continue  # Drain the queue after a failure
+            
+            try:
+                kind, data = operation
+                if kind == 'upsert':
+                    self.client.upsert(collection_name=self.collection_name, points=data)
+                    self.progress.add('upserted', len(data))
+                elif kind == 'payload':
+                    point_id, payload = data
+                    self.client.overwrite_payload(
+                        collection_name=self.collection_name,
+                        payload=payload,
+                        points=[point_id]
+                    )
+                elif kind == 'set_payload':
+                    point_id, payload = data
+                    self.client.set_payload(
+                        collection_name=self.collection_name,
+                        payload=payload,
+                        points=[point_id]
+                    )
+                elif kind == 'delete':
+                    self.client.delete(
+                        collection_name=self.collection_name,
+                        points_selector=models.PointIdsList(points=data)
+                    )
+            except Exception as e:
+                print(f"Error writing to Qdrant: {e}")
+                self.error = e
+
+
+def iter_chunks_in_pool(filepaths: List[str], workers: int, processor_kwargs: Dict,
+                        progress: IngestionProgress, max_pending=16) -> Iterator[Dict]:
+    """Parse files in a process pool and yield their chunks as they arrive.
+    
+    Workers stream batches through a bounded queue, so at most ``max_pending``
+    batches are held in memory regardless of file size.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    chunk_queue = ctx.Queue(maxsize=max_pending)
+    stop_event = ctx.Event()
+    pending = len(filepaths)
+    
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=ctx,
+        initializer=_init_parse_worker,
+        initargs=(chunk_queue, stop_event, processor_kwargs)
+    )
+    try:
+        futures = [pool.submit(_parse_file_worker, filepath) for filepath in filepaths]
+        while pending:
+            try:
+                message = chunk_queue.get(timeout=1.0)
+            except queue.Empty:
+                for future in futures:
+                    if future.done() and future.exception() is not None:
+                        raise future.exception()
+                continue
+            
+            if message[0] == 'chunks':
+                progress.add('parsed', len(message[1]))
+                yield from message[1]
+            else:
+                _, filename, count = message
+                pending -= 1
+                print(f"Processed {filename}: {count} chunks")
+    finally:
+        if pending:
+            # Unblock workers waiting on a full queue before shutting down
+            stop_event.set()
+            try:
+                while True:
+                    chunk_queue.get_nowait()
+            except queue.Empty:
+                pass
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+class CrossEncoderReranker:
+    """Rerank retrieved documents with a cross-encoder under a hard time budget.
+    
+    All (query, document) pairs are scored in one batched ``predict`` on one
+    of ``workers`` dedicated threads. A request waits for a free worker and
+    for its scores within ``budget_ms`` in total; past that, or when scoring
+    fails, the documents keep their original order (without ``rerank_score``)
+    and the request is counted in ``not_reranked``, so reranking never adds
+    more than the budget and never fails a request.
+    """
+    
+    def __init__(self, model_name='cross-encoder/mmarco-mMiniLMv2-L12-H384-v1', budget_ms=150.0,
+                 max_length=256, workers=2):
+        from sentence_transformers import CrossEncoder
+        
+        self.model_name = model_name
+        self.model = CrossEncoder(model_name, max_length=max_length, device='cpu')
+        self.budget = budget_ms / 1000.0
+        
+        self.reranked = 0
+        self.timeouts = 0  # Scoring did not finish within the budget
+        self.skipped = 0  # No worker became free within the budget
+        self.errors = 0  # predict raised
+        # A worker stays taken until its scoring ends, even after the caller gave up
+        self._busy = threading.Semaphore(workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reranker')
+    
+    def _score(self, query: str, texts: List[str]) -> np.ndarray:
+        try:
+            return np.asarray(self.model.predict([(query, text) for text in texts],
+                                                 batch_size=len(texts), show_progress_bar=False))
+        finally:
+            self._busy.release()
+    
+    def rerank(self, query: str, docs: List[Dict], top_k: int) -> List[Dict]:
+        """Best ``top_k`` documents by cross-encoder score, or the first ``top_k`` past the budget"""
+        if len(docs) <= 1:
+            return docs[:top_k]
+        deadline = time.monotonic() + self.budget
+        if not self._busy.acquire(timeout=self.budget):
+            self.skipped += 1
+            print(f"Not reranked: no reranker worker free within {self.budget * 1000:.0f} ms")
+            return docs[:top_k]
+        
+        try:
+            future = self._executor.submit(self._score, query, [doc['text'] for doc in docs])
+        except BaseException:
+            self._busy.release()
+            raise
+        try:
+            scores = future.result(timeout=max(deadline - time.monotonic(), 0.0))
+            order = np.argsort(-scores, kind='stable')[:top_k]
+            reranked = [dict(docs[i], rerank_score=float(scores[i])) for i in order]
+        except FutureTimeoutError:
+            self.timeouts += 1
+            print(f"Not reranked: scoring took longer than {self.budget * 1000:.0f} ms")
+            return docs[:top_k]
+        except Exception as e:
+            self.errors += 1
+            print(f"Not reranked: reranker failed ({type(e).__name__}: {e})")
+            return docs[:top_k]
+        
+        self.reranked += 1
+        return reranked
+    
+    def stats(self) -> Dict[str, int]:
+        return {
+            'reranked': self.reranked,
+            'not_reranked': self.timeouts + self.skipped + self.errors,
+            'timeouts': self.timeouts,
+            'skipped': self.skipped,
+            'errors': self.errors
+        }
+    
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+# Number of set bits in every byte value, for Hamming distances on packed bits
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class QuantizedIndex:
+    """Quantized in-memory copy of normalized embeddings for a first search pass.
+    
+    'int8' maps every component onto 256 levels between the 0.5% and 99.5%
+    quantiles of a row sample (like Qdrant scalar quantization, 4x smaller
+    than float32, but slower to score: NumPy has no int8 matrix product,
+    so codes are converted back to float32 block by block);
+    'binary' keeps one sign bit per dimension (32x smaller) and scores by
+    Hamming distance. ``search`` rescores the best candidates against the
+    full-precision vectors, which may be a memory-mapped array on disk.
+    """
+    
+    BLOCK_ROWS = 4096
+    SCORE_BLOCK_ROWS = 256  # Converted codes stay in the CPU cache
+    CALIBRATION_ROWS = 10000
+    
+    def __init__(self, vectors: np.ndarray, mode='int8', quantile=0.99):
+        if mode not in ('int8', 'binary'):
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        self.mode = mode
+        
+        if mode == 'int8':
+            tail = (1.0 - quantile) / 2
+            # Sampled rows, so a memory-mapped matrix is not read whole
+            sample = vectors
+            if len(vectors) > self.CALIBRATION_ROWS:
+                sample = vectors[np.linspace(0, len(vectors) - 1, self.CALIBRATION_ROWS).astype(np.int64)]
+            self.low, high = np.quantile(np.asarray(sample, dtype=np.float32), [tail, 1.0 - tail])
+            self.scale = max(float(high - self.low), 1e-9) / 255.0
+            self.codes = np.empty(vectors.shape, dtype=np.int8)
+            for start in range(0, len(vectors), self.BLOCK_ROWS):
+                block = np.asarray(vectors[start:start + self.BLOCK_ROWS], dtype=np.float32)
+                levels = np.clip(np.rint((block - self.low) / self.scale), 0, 255)
+                self.codes[start:start + len(block)] = (levels - 128).astype(np.int8)
+        else:
+            self.codes = np.packbits(np.asarray(vectors) > 0, axis=1)
+    
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+    
+    def approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        """Scores that rank rows like their dot product with ``query``"""
+        if self.mode == 'binary':
+            query_bits = np.packbits(query > 0)
+            differing = np.bitwise_xor(self.codes, query_bits)
+            if hasattr(np, 'bitwise_count'):  # NumPy >= 2.0
+                distances = np.bitwise_count(differing).sum(axis=1, dtype=np.int32)
+            else:
+                distances = _POPCOUNT[differing].sum(axis=1, dtype=np.int32)
+            return -distances.astype(np.float32)
+        
+        # Row offsets (low and the +128 shift) add the same constant to every score
+        query = query.astype(np.float32)
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        buffer = np.empty((self.SCORE_BLOCK_ROWS, self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.codes), self.SCORE_BLOCK_ROWS):
+            codes = self.codes[start:start + self.SCORE_BLOCK_ROWS]
+            block = buffer[:len(codes)]
+            np.copyto(block, codes, casting='unsafe')
+            np.matmul(block, query, out=scores[start:start + len(codes)])
+        return scores
+    
+    def search(self, query: np.ndarray, top_k: int, full_vectors: np.ndarray,
+               oversampling=3.0, candidates_mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k row indices and exact scores: quantized pass, then exact rescoring"""
+        approx = self.approximate_scores(query)
+        if candidates_mask is not None:
+            approx = np.where(candidates_mask, approx, -np.inf)
+        
+        n_candidates = min(len(approx), max(top_k, int(np.ceil(top_k * oversampling))))
+        if n_candidates == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        candidates = np.argpartition(-approx, n_candidates - 1)[:n_candidates]
+        if candidates_mask is not None:
+            candidates = candidates[candidates_mask[candidates]]
+        
+        candidates.sort()  # Sequential reads from a memory-mapped matrix
+        exact = np.asarray(full_vectors[candidates], dtype=np.float32) @ query.astype(np.float32)
+        order = np.argsort(-exact)[:top_k]
+        return candidates[order], exact[order]
+
+
+# Payload fields with a keyword index for filtered search
+PAYLOAD_INDEX_FIELDS = ('type', 'category', 'source', 'sources')
+
+
+def _filter_field(field: str) -> str:
+    # 'sources' also lists the files of collapsed near-duplicates
+    return 'sources' if field == 'source' else field
+
+
+def payload_matches(payload: Dict, filters: Optional[Dict[str, Any]]) -> bool:
+    """Whether a payload satisfies ``{field: value or [values]}`` (all fields must match)"""
+    for field, allowed in (filters or {}).items():
+        allowed = allowed if isinstance(allowed, (list, tuple, set)) else [allowed]
+        values = payload.get(_filter_field(field))
+        if values is None and field == 'source':
+            values = payload.get('source')
+        values = values if isinstance(values, list) else [values]
+        if not any(value in allowed for value in values):
+            return False
+    return True
+
+
+def build_qdrant_filter(filters: Optional[Dict[str, Any]]) -> Optional[models.Filter]:
+    """Qdrant equivalent of ``payload_matches``"""
+    if not filters:
+        return None
+    conditions = []
+    for field, allowed in filters.items():
+        allowed = list(allowed) if isinstance(allowed, (list, tuple, set)) else [allowed]
+        conditions.append(models.FieldCondition(key=_filter_field(field), match=models.MatchAny(any=allowed)))
+    return models.Filter(must=conditions)
+
+
+class Retriever:
+    """Nearest-neighbour search over indexed chunks.
+
+    ``search`` takes a query embedding and optional payload ``filters``
+    (see ``payload_matches``) and returns ``(point_id, score, payload)``
+    tuples, best first, using cosine similarity; ``fetch`` returns the same
+    tuples for given point IDs. ``sparse`` is the BM25
+    index over the same points, if one is available. Implementations must
+    be safe to call from several threads at once.
+    """
+
+    backend = None
+    sparse: Optional[BM25Index] = None
+
+    def search(self, query_vector: np.ndarray, top_k: int,
+               filters: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float, Dict]]:
+        raise NotImplementedError
+
+    def fetch(self, point_ids: List[str], query_vector: np.ndarray) -> List[Tuple[str, float, Dict]]:
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class QdrantRetriever(Retriever):
+    """Search one physical collection of a Qdrant client (owned by the caller)"""
+
+    backend = 'qdrant'
+
+    def __init__(self, client: QdrantClient, collection_name: str,
+                 search_params: Optional[models.SearchParams] = None,
+                 sparse: Optional[BM25Index] = None):
+        self.client = client
+        self.collection_name = collection_name
+        self.search_params = search_params
+        self.sparse = sparse
+
+    def search(self, query_vector: np.ndarray, top_k: int,
+               filters: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float, Dict]]:
+        results = self.client.search(
+            collection_name=self.collection_name,
+            query_vector=np.asarray(query_vector, dtype=np.float32).tolist(),
+            query_filter=build_qdrant_filter(filters),
+            limit=top_k,
+            search_params=self.search_params
+        )
+        return [(str(result.id), result.score, result.payload) for result in results]
+
+    def fetch(self, point_ids: List[str], query_vector: np.ndarray) -> List[Tuple[str, float, Dict]]:
+        records = self.client.retrieve(
+            collection_name=self.collection_name,
+            ids=point_ids,
+            with_payload=True,
+            with_vectors=True
+        )
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        # Stored vectors are normalized by Qdrant for cosine distance
+        return [(str(record.id), float(np.dot(record.vector, query)), record.payload) for record in records]
+
+    def count(self) -> int:
+        return self.client.count(collection_name=self.collection_name, exact=True).count
+
+
+class NumpyRetriever(Retriever):
+    """Brute-force search over a snapshot's memory-mapped vector matrix.
+
+    The normalized float32 vectors in ``vectors.npy`` are mapped read-only,
+    so worker processes serving the same snapshot share one copy through
+    the page cache and take no locks. A query is a single matrix-vector
+    product followed by ``argpartition``; with ``quantization`` the first
+    pass runs over a ``QuantizedIndex`` and only candidates are rescored
+    against the mapped matrix.
+    """
+
+    backend = 'numpy'
+
+    def __init__(self, snapshot_dir: str, quantization=None, rescore_oversampling=3.0):
+        self.snapshot_dir = snapshot_dir
+        self.vectors = np.load(os.path.join(snapshot_dir, 'vectors.npy'), mmap_mode='r')
+
+        ids, payloads = [], []
+        with open(os.path.join(snapshot_dir, 'payloads.jsonl'), 'r', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                ids.append(str(record['id']))
+                payloads.append(record['payload'])
+        if len(payloads) != len(self.vectors):
+            raise RuntimeError(f"Snapshot {snapshot_dir} has {len(self.vectors)} vectors "
+                               f"but {len(payloads)} payloads")
+        self.ids = ids
+        self.rows = {point_id: row for row, point_id in enumerate(ids)}
+        self.payloads = np.empty(len(payloads), dtype=object)
+        self.payloads[:] = payloads
+        self.sparse = load_snapshot_sparse_index(snapshot_dir, ids, payloads)
+
+        self._masks: Dict[str, np.ndarray] = {}
+        self.rescore_oversampling = rescore_oversampling
+        self.quantized = QuantizedIndex(self.vectors, mode=quantization) if quantization else None
+
+    def _filter_mask(self, filters: Dict[str, Any]) -> np.ndarray:
+        """Boolean row mask for a filter, cached because routed filters repeat"""
+        key = json.dumps(filters, sort_keys=True, default=list)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = np.fromiter((payload_matches(payload, filters) for payload in self.payloads),
+                               dtype=bool, count=len(self.payloads))
+            if len(self._masks) >= 64:
+                self._masks.clear()
+            self._masks[key] = mask
+        return mask
+
+    def search(self, query_vector: np.ndarray, top_k: int,
+               filters: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float, Dict]]:
+        mask = self._filter_mask(filters) if filters else None
+        top_k = min(top_k, len(self.payloads) if mask is None else int(mask.sum()))
+        if top_k <= 0:
+            return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        if self.quantized is not None:
+            rows, scores = self.quantized.search(query, top_k, self.vectors, self.rescore_oversampling, mask)
+        else:
+            all_scores = self.vectors @ query
+            if mask is not None:
+                all_scores = np.where(mask, all_scores, -np.inf)
+            rows = np.argpartition(-all_scores, top_k - 1)[:top_k]
+            rows = rows[np.argsort(-all_scores[rows])]
+            scores = all_scores[rows]
+        return [(self.ids[row], float(score), self.payloads[row]) for row, score in zip(rows, scores)]
+
+    def fetch(self, point_ids: List[str], query_vector: np.ndarray) -> List[Tuple[str, float, Dict]]:
+        rows = [self.rows[point_id] for point_id in point_ids if point_id in self.rows]
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = np.asarray(self.vectors[rows], dtype=np.float32) @ query if rows else []
+        return [(self.ids[row], float(score), self.payloads[row]) for row, score in zip(rows, scores)]
+
+    def count(self) -> int:
+        return len(self.payloads)
+
+    def close(self):
+        # Unmap the file so the snapshot directory can be pruned
+        self.vectors = np.empty((0, self.vectors.shape[1]), dtype=np.float32)
+
+
+class ReloadInProgressError(RuntimeError):
+    """Raised when a knowledge base reload is requested while one is running"""
+
+
+def list_snapshots(snapshot_root: str = SNAPSHOT_ROOT) -> List[str]:
+    """Versions of all complete snapshots, oldest first"""
+    if not os.path.isdir(snapshot_root):
+        return []
+    return sorted(
+        name for name in os.listdir(snapshot_root)
+        if os.path.exists(os.path.join(snapshot_root, name, SNAPSHOT_MANIFEST))
+    )
+
+
+def resolve_snapshot(snapshot_root: str = SNAPSHOT_ROOT, version: Optional[str] = None) -> Optional[str]:
+    """Directory of the given snapshot version, or of the current one"""
+    if version is None:
+        try:
+            with open(os.path.join(snapshot_root, SNAPSHOT_POINTER), 'r', encoding='utf-8') as f:
+                version = f.read().strip()
+        except OSError:
+            return None
+    
+    snapshot_dir = os.path.join(snapshot_root, version)
+    if not os.path.exists(os.path.join(snapshot_dir, SNAPSHOT_MANIFEST)):
+        return None
+    return snapshot_dir
+
+
+def set_current_snapshot(snapshot_root: str, version: str):
+    """Atomically point CURRENT at a snapshot version"""
+    if resolve_snapshot(snapshot_root, version) is None:
+        raise ValueError(f"Snapshot {version} does not exist in {snapshot_root}")
+    
+    pointer = os.path.join(snapshot_root, SNAPSHOT_POINTER)
+    tmp_pointer = f"{pointer}.{os.getpid()}.tmp"
+    with open(tmp_pointer, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(tmp_pointer, pointer)
+
+
+def load_snapshot_sparse_index(snapshot_dir: str, ids: List[str], payloads: List[Dict]) -> BM25Index:
+    """BM25 index stored with a snapshot; older snapshots without one are indexed in memory"""
+    path = os.path.join(snapshot_dir, SPARSE_INDEX_FILENAME)
+    if os.path.exists(path):
+        return BM25Index.load(path)
+    return BM25Index.build(ids, [payload.get('text', '') for payload in payloads])
+
+
+def load_snapshot_manifest(snapshot_dir: str) -> Dict:
+    with open(os.path.join(snapshot_dir, SNAPSHOT_MANIFEST), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def hash_file(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
 
 class RAGSystem:
@@ -228,17 +1140,198 @@ class RAGSystem:
     _instance = None
     _lock_file = None
     
+    # Knowledge files indexed from the data directory
+    KNOWLEDGE_FILES = [
+        'faqs.json',
+        'org.json',
+        'contacts.json',
+        'vwat_complete_rag_data.json'
+    ]
+    
     def __init__(self, 
                  embedding_model_name='paraphrase-multilingual-MiniLM-L12-v2',
                  qdrant_path='./qdrant_data',
-                 collection_name='vwat_knowledge'):
+                 collection_name='vwat_knowledge',
+                 embedding_cache_dir='./embedding_cache',
+                 embedding_cache_max_mb=256,
+                 snapshot_dir=None,
+                 qdrant_url=None,
+                 quantization=None,
+                 rescore_oversampling=3.0,
+                 backend=None,
+                 query_cache_size=1024,
+                 query_cache_ttl=3600.0,
+                 embed_batch_size=32,
+                 embed_batch_wait_ms=2.0,
+                 answer_cache_size=512,
+                 answer_cache_ttl=3600.0,
+                 answer_cache_threshold=0.93,
+                 hybrid=True,
+                 rrf_k=60,
+                 context_max_tokens=1500,
+                 context_min_score=0.25,
+                 context_max_doc_tokens=400,
+                 reranker_model=None,
+                 rerank_candidates=20,
+                 rerank_top_k=3,
+                 rerank_budget_ms=150.0,
+                 faq_direct_threshold=0.9,
+                 route_boost=0.05):
+        """
+        With ``snapshot_dir`` the index is loaded read-only from an immutable
+        snapshot (see ``export_snapshot``) instead of opening ``qdrant_path``,
+        so no storage lock is taken and many processes can share the snapshot.
+        The embedding cache in ``embedding_cache_dir`` (None disables it) is
+        then opened read-only too; only indexing processes write to it.
+        ``qdrant_url`` connects to a Qdrant server instead of local storage.
+        
+        ``backend`` selects the retriever: 'numpy' searches a snapshot's
+        memory-mapped vectors directly (the default with ``snapshot_dir``),
+        'qdrant' uses Qdrant (the default otherwise; with a snapshot each
+        process then copies it into its own in-memory collection).
+        
+        ``quantization`` ('int8' or 'binary') keeps only quantized vectors in
+        RAM for the first search pass and the full-precision vectors on disk;
+        the best ``top_k * rescore_oversampling`` candidates are rescored
+        exactly. The embedded (path/snapshot) Qdrant client accepts these
+        settings but always searches full-precision vectors.
+        
+        Up to ``query_cache_size`` query embeddings are kept in memory for
+        ``query_cache_ttl`` seconds (0 disables the query cache). Query
+        embeddings requested concurrently are encoded together in batches of
+        up to ``embed_batch_size`` (1 disables batching), waiting at most
+        ``embed_batch_wait_ms`` for a batch to fill.
+        
+        ``answer_cache_size`` LLM answers (0 disables) are reused for
+        ``answer_cache_ttl`` seconds by later questions in the same language
+        whose embedding similarity reaches ``answer_cache_threshold`` and
+        that retrieve the same documents. The cache is cleared whenever the
+        served index changes.
         
+        With ``hybrid`` dense hits are fused with BM25 hits from an inverted
+        index over the chunk texts using reciprocal-rank fusion (``rrf_k``).
+        
+        ``generate_context`` keeps documents scoring at least
+        ``context_min_score`` (the best one is always kept, first) until
+        ``context_max_tokens`` is reached, trimming documents longer than
+        ``context_max_doc_tokens`` to their most query-relevant sentences
+        (0 disables trimming).
+        
+        With ``reranker_model`` (a cross-encoder such as
+        'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1') ``retrieve`` fetches
+        ``rerank_candidates`` documents and reorders them with the
+        cross-encoder, falling back to retrieval order after
+        ``rerank_budget_ms``; ``get_rag_response`` then keeps only
+        ``rerank_top_k`` documents.
+        
+        Documents found by an intent route (``route_query``) are ranked as if
+        their score were ``route_boost`` higher; their reported score is unchanged.
+        
+        ``match_faq`` lets ``get_rag_response`` answer directly from a FAQ
+        whose stored question has embedding similarity of at least
+        ``faq_direct_threshold`` with the query (0 disables the fast path).
+        """
+        if backend is None:
+            backend = 'numpy' if snapshot_dir else 'qdrant'
+        if quantization not in (None, 'int8', 'binary'):
+            raise ValueError(f"Unknown quantization mode: {quantization}")
+        if backend not in ('qdrant', 'numpy'):
+            raise ValueError(f"Unknown retrieval backend: {backend}")
+        if backend == 'numpy' and not snapshot_dir:
+            raise ValueError("The numpy backend serves index snapshots and needs snapshot_dir")
+        self.backend = backend
+        self.hybrid = hybrid
+        self.rrf_k = rrf_k
+        self.context_max_tokens = context_max_tokens
+        self.context_min_score = context_min_score
+        self.context_max_doc_tokens = context_max_doc_tokens
+        self.rerank_candidates = rerank_candidates
+        self.rerank_top_k = rerank_top_k
+        self.faq_direct_threshold = faq_direct_threshold
+        self._faq_questions: Dict[str, np.ndarray] = {}  # FAQ point ID -> normalized question embedding
+        self.route_boost = route_boost
+        self.quantization = quantization
+        self.rescore_oversampling = rescore_oversampling
+        self.qdrant_url = qdrant_url
+        
+        
+        # Imported here so ingestion worker processes don't have to load torch
+        from sentence_transformers import SentenceTransformer
+        
+        self.embedding_model_name = embedding_model_name
         self.embedding_model = SentenceTransformer(embedding_model_name)
         self.embedding_dim = self.embedding_model.get_sentence_embedding_dimension()
         self.qdrant_path = qdrant_path
         
+        self.reranker = None
+        if reranker_model:
+            self.reranker = CrossEncoderReranker(reranker_model, budget_ms=rerank_budget_ms)
+        
+        # Known texts skip the transformer on both indexing and query paths
+        self.embedding_cache = None
+        if embedding_cache_dir:
+            self.embedding_cache = EmbeddingCache(
+                embedding_cache_dir,
+                model_name=embedding_model_name,
+                dim=self.embedding_dim,
+                max_bytes=embedding_cache_max_mb * 1024 * 1024,
+                read_only=bool(snapshot_dir)
+            )
+        
+        # Repeated questions skip the model (and the disk cache) entirely
+        self.query_cache = None
+        if query_cache_size:
+            self.query_cache = QueryEmbeddingCache(query_cache_size, query_cache_ttl)
+        
+        self.answer_cache = None
+        if answer_cache_size:
+            self.answer_cache = SemanticAnswerCache(
+                self.embedding_dim,
+                max_entries=answer_cache_size,
+                ttl_seconds=answer_cache_ttl,
+                threshold=answer_cache_threshold
+            )
+        
+        self.query_batcher = None
+        if embed_batch_size > 1:
+            self.query_batcher = EmbeddingBatcher(
+                lambda texts: self.embed_texts(texts, show_progress_bar=False),
+                max_batch_size=embed_batch_size,
+                max_wait_ms=embed_batch_wait_ms
+            )
+        
+        # collection_name is the logical name (an alias once the knowledge base
+        # has been hot-reloaded); _active_collection is the physical collection
+        # that retrieve currently reads
+        self.collection_name = collection_name
+        self._active_collection = collection_name
+        self.processor = DocumentProcessor()
+        self.snapshot_dir = snapshot_dir
+        
+        # In-flight retrieve calls per retriever, so a reload can wait for
+        # them before dropping the old collection
+        self._inflight = collections.Counter()
+        self._inflight_cond = threading.Condition()
+        self._reload_lock = threading.Lock()
+        
+        # self.client is used for indexing; retrieve only reads self.retriever
+        self.client = None
+        self.retriever = None
+        
+        if snapshot_dir:
+            self.qdrant_path = None
+            self.retriever = self._load_snapshot(snapshot_dir)
+            return
+        
+        if qdrant_url:
+            self.qdrant_path = None
+            self.client = QdrantClient(url=qdrant_url)
+            print(f"Connected to Qdrant server at {qdrant_url}")
+            self._init_collection()
+            self._init_retriever()
+            return
+        
         # Initialize Qdrant client with retry logic for Windows file locking
-        import time
         max_retries = 5
         retry_delay = 3
         
@@ -266,62 +1359,466 @@ class RAGSystem:
                         "3. Restart your application"
                     ) from e
         
-        self.collection_name = collection_name
-        self.processor = DocumentProcessor()
+        # Initialize collection
+        self._init_collection()
+        self._init_retriever()
+    
+    def _cleanup_stale_locks(self, qdrant_path):
+        """Try to clean up stale lock files if they exist"""
+        import psutil
+        lock_file = os.path.join(qdrant_path, '.lock')
+        
+        if os.path.exists(lock_file):
+            try:
+                # Check if any Python process is actually using the Qdrant path
+                qdrant_in_use = False
+                for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
+                    try:
+                        if proc.info['name'] and 'python' in proc.info['name'].lower():
+                            cmdline = proc.info.get('cmdline', [])
+                            if cmdline and any(qdrant_path in str(arg) for arg in cmdline):
+                                # Check if process is actually alive and responsive
+                                if proc.is_running() and proc.status() != psutil.STATUS_ZOMBIE:
+                                    qdrant_in_use = True
+                                    break
+                    except (psutil.NoSuchProcess, psutil.AccessDenied):
+                        continue
+                
+                # If no active process is using it, try to remove the lock
+                if not qdrant_in_use:
+                    print(f"Attempting to remove stale lock file: {lock_file}")
+                    try:
+                        os.remove(lock_file)
+                        print("Stale lock file removed successfully")
+                    except PermissionError:
+                        print("Lock file is still in use by another process")
+            except Exception as e:
+                print(f"Warning: Could not check for stale locks: {e}")
+    
+    def _vectors_config(self) -> models.VectorParams:
+        return models.VectorParams(
+            size=self.embedding_dim,
+            distance=models.Distance.COSINE,
+            # Quantized collections keep full-precision vectors on disk for rescoring
+            on_disk=True if self.quantization else None
+        )
+    
+    def _quantization_config(self):
+        if self.quantization == 'int8':
+            return models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True
+                )
+            )
+        if self.quantization == 'binary':
+            return models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(always_ram=True)
+            )
+        return None
+    
+    def _search_params(self) -> Optional[models.SearchParams]:
+        """Search with the quantized vectors, then rescore candidates exactly"""
+        if not self.quantization:
+            return None
+        return models.SearchParams(
+            quantization=models.QuantizationSearchParams(
+                ignore=False,
+                rescore=True,
+                oversampling=self.rescore_oversampling
+            )
+        )
+    
+    def _create_collection(self, client, collection: str):
+        client.create_collection(
+            collection_name=collection,
+            vectors_config=self._vectors_config(),
+            quantization_config=self._quantization_config()
+        )
+        if client is self.client:
+            self._create_payload_indexes(collection)
+    
+    def _create_payload_indexes(self, collection: str, existing=()):
+        """Keyword indexes for filtered search (embedded Qdrant has no payload indexes)"""
+        if not self.qdrant_url:
+            return
+        for field in PAYLOAD_INDEX_FIELDS:
+            if field not in existing:
+                self.client.create_payload_index(
+                    collection_name=collection,
+                    field_name=field,
+                    field_schema=models.PayloadSchemaType.KEYWORD
+                )
+    
+    def _init_collection(self):
+        """Initialize Qdrant collection"""
+        # Resolve the alias left behind by a previous hot reload
+        aliases = {alias.alias_name: alias.collection_name
+                   for alias in self.client.get_aliases().aliases}
+        self._active_collection = aliases.get(self.collection_name, self.collection_name)
+        
+        try:
+            info = self.client.get_collection(self._active_collection)
+            print(f"Collection '{self._active_collection}' already exists")
+        except:
+            self._create_collection(self.client, self._active_collection)
+            print(f"Created collection '{self._active_collection}'")
+            return
+        
+        self._create_payload_indexes(self._active_collection, existing=info.payload_schema or {})
+        
+        # Apply a changed quantization mode to an existing server collection
+        # (embedded storage does not keep quantization settings)
+        if self.qdrant_url and info.config.quantization_config != self._quantization_config():
+            self.client.update_collection(
+                collection_name=self._active_collection,
+                quantization_config=self._quantization_config()
+            )
+            print(f"Updated quantization of '{self._active_collection}' to {self.quantization}")
+    
+    def _init_retriever(self):
+        self.retriever = QdrantRetriever(self.client, self._active_collection, self._search_params(),
+                                         self._load_sparse_index(self._active_collection))
+    
+    def _sparse_index_path(self, collection: str) -> Optional[str]:
+        if self.qdrant_path is None:
+            return None
+        return os.path.join(self.qdrant_path, f"sparse_{collection}.npz")
+    
+    def _build_sparse_index(self, collection: str) -> BM25Index:
+        """Index the texts of all points in a collection, saving it next to the vectors"""
+        ids, texts = [], []
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=collection,
+                limit=1024,
+                offset=offset,
+                with_payload=['text'],
+                with_vectors=False
+            )
+            for record in records:
+                ids.append(str(record.id))
+                texts.append(record.payload.get('text', ''))
+            if offset is None:
+                break
+        
+        sparse = BM25Index.build(ids, texts)
+        path = self._sparse_index_path(collection)
+        if path:
+            sparse.save(path)
+        return sparse
+    
+    def _load_sparse_index(self, collection: str) -> Optional[BM25Index]:
+        """Load the saved BM25 index of a collection, rebuilding it when missing or stale"""
+        if not self.hybrid:
+            return None
+        
+        path = self._sparse_index_path(collection)
+        if path and os.path.exists(path):
+            sparse = BM25Index.load(path)
+            if len(sparse) == self.client.count(collection_name=collection, exact=True).count:
+                return sparse
+        return self._build_sparse_index(collection)
+    
+    @contextlib.contextmanager
+    def _acquire_retriever(self):
+        """Pin the current retriever for one read"""
+        with self._inflight_cond:
+            retriever = self.retriever
+            self._inflight[retriever] += 1
+        try:
+            yield retriever
+        finally:
+            with self._inflight_cond:
+                self._inflight[retriever] -= 1
+                if not self._inflight[retriever]:
+                    del self._inflight[retriever]
+                self._inflight_cond.notify_all()
+    
+    def _swap_active(self, retriever: Retriever) -> Retriever:
+        """Point new reads at another retriever; returns the previous one"""
+        with self._inflight_cond:
+            previous = self.retriever
+            self.retriever = retriever
+        # Cached answers were generated from the previous index
+        if self.answer_cache is not None:
+            self.answer_cache.clear()
+        return previous
+    
+    def _wait_for_readers(self, retriever: Retriever, timeout: float) -> bool:
+        """Wait until no retrieve call is reading through the given retriever"""
+        with self._inflight_cond:
+            return self._inflight_cond.wait_for(lambda: self._inflight[retriever] == 0, timeout=timeout)
+    
+    def _is_reload_collection(self, name: str) -> bool:
+        """Whether ``name`` is the served collection name or a collection made by ``reload_knowledge_base``"""
+        return re.fullmatch(rf"{re.escape(self.collection_name)}(_\d{{14}}(_1)*)?", name) is not None
+    
+    def _delete_collection(self, collection: str):
+        self.client.delete_collection(collection)
+        sparse_path = self._sparse_index_path(collection)
+        if sparse_path and os.path.exists(sparse_path):
+            os.remove(sparse_path)
+    
+    def reload_knowledge_base(self, data_dir='./data', warmup_queries: Optional[List[str]] = None,
+                              drain_timeout=30.0) -> Dict[str, Any]:
+        """Rebuild the index next to the live one and switch over without downtime.
+        
+        A new physical collection is indexed and warmed while ``retrieve``
+        keeps serving the old one. New reads are then pointed at the new
+        collection, the ``collection_name`` alias is repointed, and the old
+        collection is deleted once in-flight reads on it have finished. If
+        they outlast ``drain_timeout``, it is left for the next reload to delete.
+        """
+        if self.client is None:
+            raise RuntimeError("The numpy backend serves snapshots; export a new snapshot "
+                               "and switch to it with switch_snapshot instead")
+        if not self._reload_lock.acquire(blocking=False):
+            raise ReloadInProgressError("A knowledge base reload is already running")
+        
+        try:
+            start = time.perf_counter()
+            old_collection = self._active_collection
+            new_retriever = None
+            new_collection = f"{self.collection_name}_{time.strftime('%Y%m%d%H%M%S')}"
+            while self.client.collection_exists(new_collection):
+                new_collection += '_1'
+            
+            print(f"Reloading knowledge base into '{new_collection}'...")
+            try:
+                self.index_documents(data_dir=data_dir, incremental=False, collection_name=new_collection)
+                
+                # Warm the new collection (and the query embedding path) before switching
+                new_retriever = QdrantRetriever(self.client, new_collection, self._search_params(),
+                                                self._load_sparse_index(new_collection))
+                for query in warmup_queries or ["How do I book an appointment?", "Giờ làm việc của VWAT?"]:
+                    new_retriever.search(self.embed_query(query), top_k=1)
+            except Exception:
+                if self.client.collection_exists(new_collection):
+                    self.client.delete_collection(new_collection)
+                raise
+            
+            old_retriever = self._swap_active(new_retriever)
+            self._active_collection = new_collection
+            
+            drained = self._wait_for_readers(old_retriever, drain_timeout)
+            if not drained:
+                print(f"Warning: reads on '{old_collection}' still running after {drain_timeout}s, "
+                      f"leaving it for the next reload to delete")
+            
+            # Collections left by earlier reloads (or by this one, once drained)
+            collections = {collection.name for collection in self.client.get_collections().collections}
+            stale = [name for name in collections
+                     if self._is_reload_collection(name) and name != new_collection
+                     and (drained or name != old_collection)]
+            
+            if self.collection_name not in collections:
+                # Repoint the alias in one atomic call, so it always names a collection
+                operations = []
+                if any(alias.alias_name == self.collection_name for alias in self.client.get_aliases().aliases):
+                    operations.append(models.DeleteAliasOperation(
+                        delete_alias=models.DeleteAlias(alias_name=self.collection_name)
+                    ))
+                operations.append(models.CreateAliasOperation(
+                    create_alias=models.CreateAlias(collection_name=new_collection, alias_name=self.collection_name)
+                ))
+                self.client.update_collection_aliases(change_aliases_operations=operations)
+            elif self.collection_name in stale:
+                # First reload: a plain collection holds the alias name, so it goes first
+                self._delete_collection(self.collection_name)
+                stale.remove(self.collection_name)
+                self.client.update_collection_aliases(change_aliases_operations=[models.CreateAliasOperation(
+                    create_alias=models.CreateAlias(collection_name=new_collection, alias_name=self.collection_name)
+                )])
+            else:
+                print(f"Warning: '{self.collection_name}' is still a plain collection; "
+                      f"the next reload replaces it with an alias")
+            
+            for name in stale:
+                self._delete_collection(name)
+            
+            chunk_count = self.client.count(collection_name=new_collection, exact=True).count
+            elapsed = time.perf_counter() - start
+            print(f"✅ Knowledge base reloaded: '{self.collection_name}' -> '{new_collection}' "
+                  f"({chunk_count} chunks, {elapsed:.1f}s)")
+            return {
+                'collection': new_collection,
+                'previous_collection': old_collection,
+                'chunks': chunk_count,
+                'seconds': round(elapsed, 2)
+            }
+        finally:
+            self._reload_lock.release()
+    
+    def _load_snapshot(self, snapshot_dir: str) -> Retriever:
+        """Open a snapshot with the configured backend; the files are only read"""
+        manifest = load_snapshot_manifest(snapshot_dir)
+        if (manifest.get('embedding_model') != self.embedding_model_name
+                or manifest.get('embedding_dim') != self.embedding_dim):
+            raise RuntimeError(
+                f"Snapshot {manifest.get('version')} was built with {manifest.get('embedding_model')} "
+                f"({manifest.get('embedding_dim')} dims), not {self.embedding_model_name}"
+            )
+        
+        if self.backend == 'numpy':
+            retriever = NumpyRetriever(snapshot_dir, self.quantization, self.rescore_oversampling)
+        else:
+            self.client = self._open_snapshot(snapshot_dir)
+            sparse = None
+            if self.hybrid:
+                ids, payloads = [], []
+                with open(os.path.join(snapshot_dir, 'payloads.jsonl'), 'r', encoding='utf-8') as f:
+                    for line in f:
+                        record = json.loads(line)
+                        ids.append(str(record['id']))
+                        payloads.append(record['payload'])
+                sparse = load_snapshot_sparse_index(snapshot_dir, ids, payloads)
+            retriever = QdrantRetriever(self.client, self.collection_name, self._search_params(), sparse)
+        print(f"Loaded index snapshot {manifest['version']} ({manifest['chunk_count']} chunks, "
+              f"{self.backend} backend)")
+        return retriever
+    
+    def _open_snapshot(self, snapshot_dir: str) -> QdrantClient:
+        """Copy a snapshot into an in-memory Qdrant client (the 'qdrant' snapshot backend).
+        
+        Every process holds its own copy and startup grows with the corpus;
+        the default 'numpy' backend maps the snapshot files instead.
+        """
+        client = QdrantClient(location=':memory:')
+        self._create_collection(client, self.collection_name)
+        
+        vectors = np.load(os.path.join(snapshot_dir, 'vectors.npy'), mmap_mode='r')
+        batch = []
+        with open(os.path.join(snapshot_dir, 'payloads.jsonl'), 'r', encoding='utf-8') as f:
+            for row, line in enumerate(f):
+                record = json.loads(line)
+                batch.append(models.PointStruct(
+                    id=record['id'],
+                    vector=vectors[row].tolist(),
+                    payload=record['payload']
+                ))
+                if len(batch) >= 256:
+                    client.upsert(collection_name=self.collection_name, points=batch)
+                    batch = []
+        if batch:
+            client.upsert(collection_name=self.collection_name, points=batch)
+        return client
+    
+    def switch_snapshot(self, version: Optional[str] = None, snapshot_root: str = SNAPSHOT_ROOT):
+        """Atomically switch to another snapshot (the current one by default).
+        
+        The new snapshot is fully loaded before the client reference is
+        swapped, so concurrent ``retrieve`` calls see either the old or the
+        new index, never a partial one.
+        """
+        snapshot_dir = resolve_snapshot(snapshot_root, version)
+        if snapshot_dir is None:
+            raise ValueError(f"No snapshot {version or SNAPSHOT_POINTER} in {snapshot_root}")
+        
+        # The old snapshot holds no locks; it is dropped once unreferenced
+        self._swap_active(self._load_snapshot(snapshot_dir))
+        self.snapshot_dir = snapshot_dir
+    
+    def export_snapshot(self, data_dir='./data', snapshot_root: str = SNAPSHOT_ROOT,
+                        activate=True, keep=3) -> str:
+        """Write the indexed collection as a new immutable snapshot version.
+        
+        The snapshot directory holds ``vectors.npy`` (float32, one row per
+        point), ``payloads.jsonl`` (point ID and payload per row) and a
+        manifest with the model name, dimension, chunk count and source file
+        hashes. It is written to a temporary directory and renamed into place,
+        then CURRENT is repointed when ``activate`` is set.
+        """
+        source_hashes = {}
+        for filename in self.KNOWLEDGE_FILES:
+            filepath = os.path.join(data_dir, filename)
+            if os.path.exists(filepath):
+                source_hashes[filename] = hash_file(filepath)
+        
+        chunk_count = self.client.count(collection_name=self._active_collection, exact=True).count
+        content_hash = hashlib.sha256(json.dumps(
+            [self.embedding_model_name, chunk_count, source_hashes], sort_keys=True
+        ).encode('utf-8')).hexdigest()[:8]
+        version = f"{time.strftime('%Y%m%d-%H%M%S')}-{content_hash}"
         
-        # Initialize collection
-        self._init_collection()
-    
-    def _cleanup_stale_locks(self, qdrant_path):
-        """Try to clean up stale lock files if they exist"""
-        import psutil
-        lock_file = os.path.join(qdrant_path, '.lock')
+        os.makedirs(snapshot_root, exist_ok=True)
+        final_dir = os.path.join(snapshot_root, version)
+        tmp_dir = os.path.join(snapshot_root, f".tmp-{version}-{os.getpid()}")
+        os.makedirs(tmp_dir)
         
-        if os.path.exists(lock_file):
-            try:
-                # Check if any Python process is actually using the Qdrant path
-                qdrant_in_use = False
-                for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-                    try:
-                        if proc.info['name'] and 'python' in proc.info['name'].lower():
-                            cmdline = proc.info.get('cmdline', [])
-                            if cmdline and any(qdrant_path in str(arg) for arg in cmdline):
-                                # Check if process is actually alive and responsive
-                                if proc.is_running() and proc.status() != psutil.STATUS_ZOMBIE:
-                                    qdrant_in_use = True
-                                    break
-                    except (psutil.NoSuchProcess, psutil.AccessDenied):
-                        continue
-                
-                # If no active process is using it, try to remove the lock
-                if not qdrant_in_use:
-                    print(f"Attempting to remove stale lock file: {lock_file}")
-                    try:
-                        os.remove(lock_file)
-                        print("Stale lock file removed successfully")
-                    except PermissionError:
-                        print("Lock file is still in use by another process")
-            except Exception as e:
-                print(f"Warning: Could not check for stale locks: {e}")
-    
-    def _init_collection(self):
-        """Initialize Qdrant collection"""
-        try:
-            self.client.get_collection(self.collection_name)
-            print(f"Collection '{self.collection_name}' already exists")
-        except:
-            self.client.create_collection(
-                collection_name=self.collection_name,
-                vectors_config=models.VectorParams(
-                    size=self.embedding_dim,
-                    distance=models.Distance.COSINE
+        vectors = np.lib.format.open_memmap(
+            os.path.join(tmp_dir, 'vectors.npy'), mode='w+',
+            dtype=np.float32, shape=(chunk_count, self.embedding_dim)
+        )
+        row = 0
+        offset = None
+        point_ids, texts = [], []
+        with open(os.path.join(tmp_dir, 'payloads.jsonl'), 'w', encoding='utf-8') as f:
+            while True:
+                records, offset = self.client.scroll(
+                    collection_name=self._active_collection,
+                    limit=256,
+                    offset=offset,
+                    with_payload=True,
+                    with_vectors=True
                 )
-            )
-            print(f"Created collection '{self.collection_name}'")
+                for record in records:
+                    vectors[row] = record.vector
+                    f.write(json.dumps({'id': str(record.id), 'payload': record.payload}, ensure_ascii=False) + '\n')
+                    point_ids.append(str(record.id))
+                    texts.append(record.payload.get('text', ''))
+                    row += 1
+                if offset is None:
+                    break
+        vectors.flush()
+        del vectors
+        
+        if row != chunk_count:
+            raise RuntimeError(f"Collection changed during export ({row} of {chunk_count} points)")
+        
+        BM25Index.build(point_ids, texts).save(os.path.join(tmp_dir, SPARSE_INDEX_FILENAME))
+        
+        manifest = {
+            'version': version,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'embedding_model': self.embedding_model_name,
+            'embedding_dim': self.embedding_dim,
+            'chunk_count': chunk_count,
+            'collection': self.collection_name,
+            'source_hashes': source_hashes
+        }
+        with open(os.path.join(tmp_dir, SNAPSHOT_MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        
+        os.rename(tmp_dir, final_dir)
+        print(f"Wrote index snapshot {version} ({chunk_count} chunks)")
+        
+        if activate:
+            set_current_snapshot(snapshot_root, version)
+            print(f"Current snapshot is now {version}")
+        
+        # Prune old versions, never the current one
+        current_dir = resolve_snapshot(snapshot_root)
+        for old_version in list_snapshots(snapshot_root)[:-keep]:
+            old_dir = os.path.join(snapshot_root, old_version)
+            if old_dir != current_dir:
+                shutil.rmtree(old_dir, ignore_errors=True)
+        
+        return version
     
     def close(self):
         """Properly close the Qdrant client and release locks"""
-        if hasattr(self, 'client') and self.client:
+        if getattr(self, 'embedding_cache', None) is not None:
+            self.embedding_cache.close()
+        if getattr(self, 'query_batcher', None) is not None:
+            self.query_batcher.close()
+        if getattr(self, 'reranker', None) is not None:
+            self.reranker.close()
+        if getattr(self, 'retriever', None) is not None:
+            self.retriever.close()
+        if getattr(self, 'client', None):
             try:
                 self.client.close()
                 print("Qdrant client closed successfully")
@@ -332,155 +1829,460 @@ class RAGSystem:
         """Ensure cleanup on deletion"""
         self.close()
     
-    def embed_texts(self, texts: List[str]) -> np.ndarray:
-        """Generate embeddings for texts"""
-        embeddings = self.embedding_model.encode(texts, show_progress_bar=True)
-        return embeddings
+    def embed_texts(self, texts: List[str], show_progress_bar=True) -> np.ndarray:
+        """Generate embeddings for texts, reusing cached vectors where possible"""
+        def encode(batch):
+            return self.embedding_model.encode(batch, show_progress_bar=show_progress_bar)
+        
+        if self.embedding_cache is None:
+            return encode(texts)
+        return self.embedding_cache.embed(texts, encode)
     
-    def index_documents(self, data_dir='./data'):
-        """Index all documents from data directory"""
-        json_files = [
-            'faqs.json',
-            'org.json',
-            'contacts.json',
-            'vwat_complete_rag_data.json'
-
-        ]
+    def embed_query(self, query: str) -> np.ndarray:
+        """Generate the embedding for a single query (read-only when cached)"""
+        if self.query_cache is not None:
+            vector = self.query_cache.get(query)
+            if vector is not None:
+                return vector
+        
+        if self.query_batcher is not None:
+            vector = self.query_batcher.encode(query)
+        else:
+            vector = self.embed_texts([query], show_progress_bar=False)[0]
+        if self.query_cache is not None:
+            self.query_cache.put(query, vector)
+        return vector
+    
+    def _manifest_path(self) -> str:
+        return os.path.join(self.qdrant_path, INDEX_MANIFEST_FILENAME)
+    
+    def _load_manifest(self, collection: str) -> Optional[Dict]:
+        """Load the index manifest if it still describes the given collection"""
+        if self.qdrant_path is None:
+            return None
         
-        all_chunks = []
+        path = self._manifest_path()
+        if not os.path.exists(path):
+            return None
         
-        for filename in json_files:
-            filepath = os.path.join(data_dir, filename)
-            if os.path.exists(filepath):
-                print(f"Processing {filename}...")
-                chunks = self.processor.process_json_file(filepath)
-                all_chunks.extend(chunks)
-                print(f"  Generated {len(chunks)} chunks")
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read index manifest: {e}")
+            return None
         
-        if not all_chunks:
-            print("No chunks to index!")
+        # Any change of model or collection invalidates every stored vector
+        if (manifest.get('embedding_model') != self.embedding_model_name
+                or manifest.get('embedding_dim') != self.embedding_dim
+                or manifest.get('collection') != collection):
+            print("Index manifest does not match current model/collection")
+            return None
+        
+        # The collection may have been wiped or rebuilt outside of the manifest
+        points = manifest.get('points', {})
+        indexed_count = self.client.count(collection_name=collection, exact=True).count
+        if indexed_count != len(points):
+            print(f"Index manifest lists {len(points)} points but collection has {indexed_count}")
+            return None
+        
+        return manifest
+    
+    def _save_manifest(self, points: Dict[str, Dict], collection: str):
+        """Atomically write the index manifest"""
+        if self.qdrant_path is None:
             return
         
-        print(f"\nTotal chunks to index: {len(all_chunks)}")
+        manifest = {
+            'embedding_model': self.embedding_model_name,
+            'embedding_dim': self.embedding_dim,
+            'collection': collection,
+            'points': points
+        }
+        path = self._manifest_path()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    
+    def _reset_collection(self, collection: str):
+        """Drop and recreate a physical collection for a full rebuild"""
+        if self.client.collection_exists(collection):
+            self.client.delete_collection(collection)
+        self._create_collection(self.client, collection)
+    
+    def _iter_file_chunks(self, filepaths: List[str], parse_workers: Optional[int],
+                          progress: IngestionProgress) -> Iterator[Dict]:
+        """Yield chunks of all files, parsed inline or in a process pool"""
+        if parse_workers is None:
+            total_bytes = sum(os.path.getsize(filepath) for filepath in filepaths)
+            if total_bytes >= PARALLEL_PARSE_MIN_BYTES:
+                parse_workers = min(len(filepaths), os.cpu_count() or 1)
+            else:
+                parse_workers = 0
+        
+        if parse_workers > 0:
+            processor_kwargs = {
+                'max_chunk_tokens': self.processor.max_chunk_tokens,
+                'chunk_overlap_tokens': self.processor.chunk_overlap_tokens,
+                'respect_sentences': self.processor.respect_sentences
+            }
+            yield from iter_chunks_in_pool(filepaths, parse_workers, processor_kwargs, progress)
+            return
+        
+        for filepath in filepaths:
+            print(f"Processing {os.path.basename(filepath)}...")
+            count = 0
+            for chunk in self.processor.iter_json_file(filepath):
+                count += 1
+                progress.add('parsed')
+                yield chunk
+            print(f"  Generated {count} chunks")
+    
+    def _embed_and_write(self, items: List[Tuple[str, Dict]], writer: QdrantWriter,
+                         progress: IngestionProgress, upsert_batch_size: int):
+        """Embed one micro-batch of new chunks and hand the points to the writer"""
+        embeddings = self.embed_texts([payload['text'] for _, payload in items], show_progress_bar=False)
+        progress.add('embedded', len(items))
+        
+        points = [
+            models.PointStruct(id=point_id, vector=embedding.tolist(), payload=payload)
+            for (point_id, payload), embedding in zip(items, embeddings)
+        ]
+        for i in range(0, len(points), upsert_batch_size):
+            writer.put(('upsert', points[i:i+upsert_batch_size]))
+    
+    def index_documents(self, data_dir='./data', incremental=True, parse_workers=None,
+                        embed_batch_size=64, upsert_batch_size=100, max_pending_writes=4,
+                        collection_name=None, dedup_threshold=0.85):
+        """Index all documents from data directory.
+        
+        Point IDs are derived from a hash of each chunk's source and text. With
+        ``incremental=True`` only chunks missing from the index manifest are
+        embedded, and points whose chunks no longer exist are deleted.
+        
+        Ingestion is a streaming pipeline: files are parsed (in a process pool
+        when ``parse_workers`` > 0, chosen automatically for large inputs when
+        None), new chunks are embedded in micro-batches of ``embed_batch_size``,
+        and Qdrant writes run on a background thread. Bounded queues between
+        the stages cap how many parsed chunks, embedding batches and pending
+        upserts are held at once. The manifest, the near-duplicate signatures
+        and the texts for the sparse index still grow with the chunk count.
+        
+        ``collection_name`` selects a physical collection other than the one
+        currently served (used by ``reload_knowledge_base``).
+        
+        Chunks whose MinHash similarity with an earlier chunk reaches
+        ``dedup_threshold`` (None disables this) are not indexed; the earlier
+        chunk's point lists every source in its ``sources`` payload field.
+        """
+        collection = collection_name or self._active_collection
+        filepaths = [os.path.join(data_dir, filename) for filename in self.KNOWLEDGE_FILES
+                     if os.path.exists(os.path.join(data_dir, filename))]
+        
+        manifest = self._load_manifest(collection) if incremental else None
+        if manifest is None:
+            print("Performing full rebuild of the index")
+            self._reset_collection(collection)
+            indexed = {}
+        else:
+            indexed = manifest['points']
+        
+        progress = IngestionProgress()
+        writer = QdrantWriter(self.client, collection, progress, max_pending=max_pending_writes)
+        writer.start()
         
-        # Generate embeddings
-        texts = [chunk['text'] for chunk in all_chunks]
-        print("Generating embeddings...")
-        embeddings = self.embed_texts(texts)
+        detector = NearDuplicateDetector(threshold=dedup_threshold) if dedup_threshold else None
         
-        # Prepare points for Qdrant
-        points = []
-        for idx, (chunk, embedding) in enumerate(zip(all_chunks, embeddings)):
-            point = models.PointStruct(
-                id=idx,
-                vector=embedding.tolist(),
-                payload={
+        # Manifest entries of the chunks seen in this run, keyed by stable ID
+        points_manifest = {}
+        # Near-duplicate chunk ID -> representative point ID
+        duplicate_of = {}
+        # Points whose payload was (re)written in full during this run
+        rewritten = set()
+        pending_items = []
+        new_count = 0
+        changed_count = 0
+        try:
+            for chunk in self._iter_file_chunks(filepaths, parse_workers, progress):
+                point_id = compute_chunk_id(chunk)
+                if point_id in points_manifest or point_id in duplicate_of:
+                    continue
+                
+                source = chunk['metadata'].get('source', '')
+                if detector is not None:
+                    representative = detector.find_or_add(point_id, chunk['text'])
+                    if representative is not None:
+                        duplicate_of[point_id] = representative
+                        sources = points_manifest[representative]['sources']
+                        if source not in sources:
+                            sources.append(source)
+                        continue
+                
+                payload = {
                     'text': chunk['text'],
                     'tokens': chunk['tokens'],
-                    **chunk['metadata']
+                    **chunk['metadata'],
+                    'sources': [source]
                 }
-            )
-            points.append(point)
-        
-        # Upload to Qdrant in batches
-        batch_size = 100
-        for i in range(0, len(points), batch_size):
-            batch = points[i:i+batch_size]
-            self.client.upsert(
-                collection_name=self.collection_name,
-                points=batch
-            )
-            print(f"Indexed {min(i+batch_size, len(points))}/{len(points)} chunks")
+                payload_hash = compute_payload_hash(payload)
+                points_manifest[point_id] = {
+                    'source': source,
+                    'sources': [source],
+                    'payload_hash': payload_hash
+                }
+                
+                if point_id not in indexed:
+                    new_count += 1
+                    rewritten.add(point_id)
+                    pending_items.append((point_id, payload))
+                    if len(pending_items) >= embed_batch_size:
+                        self._embed_and_write(pending_items, writer, progress, upsert_batch_size)
+                        pending_items = []
+                elif indexed[point_id].get('payload_hash') != payload_hash:
+                    # Metadata-only changes keep their vectors
+                    changed_count += 1
+                    rewritten.add(point_id)
+                    writer.put(('payload', (point_id, payload)))
+                
+                progress.report()
+            
+            if pending_items:
+                self._embed_and_write(pending_items, writer, progress, upsert_batch_size)
+            
+            # Sources of collapsed duplicates are only known once all chunks are seen
+            for point_id, entry in points_manifest.items():
+                if point_id in rewritten:
+                    stored_sources = [entry['source']]
+                else:
+                    stored_sources = indexed[point_id].get('sources', [entry['source']])
+                if entry['sources'] != stored_sources:
+                    writer.put(('set_payload', (point_id, {'sources': entry['sources']})))
+            
+            orphan_ids = [point_id for point_id in indexed if point_id not in points_manifest]
+            if orphan_ids:
+                writer.put(('delete', orphan_ids))
+        finally:
+            writer.close()
         
-        print(f"\n✅ Successfully indexed {len(points)} chunks!")
+        progress.report(force=True)
+        
+        if not points_manifest and not indexed:
+            print("No chunks to index!")
+            return
+        
+        self._save_manifest(points_manifest, collection)
+        
+        print(f"\nTotal chunks: {len(points_manifest)} "
+              f"({new_count} new, {changed_count} metadata changed, "
+              f"{len(orphan_ids)} removed)")
+        if detector is not None:
+            seen = len(points_manifest) + len(duplicate_of)
+            print(f"Near-duplicates collapsed: {len(duplicate_of)} of {seen} chunks "
+                  f"(index {100.0 * len(duplicate_of) / max(seen, 1):.1f}% smaller)")
+        print(f"\n✅ Successfully indexed {len(points_manifest)} chunks "
+              f"({new_count} embedded)!")
+        
+        # Rebuild the BM25 index over the final collection contents
+        sparse = self._build_sparse_index(collection) if self.hybrid else None
+        if collection == self._active_collection:
+            self._swap_active(QdrantRetriever(self.client, collection, self._search_params(), sparse))
     
-    def retrieve(self, query: str, top_k=5) -> List[Dict]:
-        """Retrieve relevant documents for query"""
-        # Generate query embedding
-        query_embedding = self.embedding_model.encode(query)
+    def retrieve(self, query: str, top_k=5, query_embedding: Optional[np.ndarray] = None,
+                 filters: Optional[Dict[str, Any]] = None, route=True, rerank=True) -> List[Dict]:
+        """Retrieve relevant documents for query.
         
-        # Search in Qdrant
-        results = self.client.search(
-            collection_name=self.collection_name,
-            query_vector=query_embedding.tolist(),
-            limit=top_k
-        )
+        ``filters`` restricts the search to payloads matching
+        ``{field: value or [values]}`` on type, category or source. Without
+        filters and with ``route`` set, the documents of the intent found by
+        ``route_query`` are merged into the results with a ``route_boost``.
+        With a reranker configured and ``rerank`` set, ``rerank_candidates``
+        documents are retrieved and the cross-encoder picks the top-k.
+        """
+        use_reranker = rerank and self.reranker is not None
+        final_top_k = top_k
+        if use_reranker:
+            top_k = max(top_k, self.rerank_candidates)
+        # Generate query embedding unless the caller already has it
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+        
+        route_filters = route_query(query) if filters is None and route else None
+        
+        # Search with the active backend
+        with self._acquire_retriever() as retriever:
+            results = self._search(retriever, query, query_embedding, top_k, filters)
+            if route_filters is not None:
+                routed = self._search(retriever, query, query_embedding, top_k, route_filters)
+                results = self._merge_routed(results, routed, top_k)
         
         # Format results
         retrieved_docs = []
-        for result in results:
+        for point_id, score, payload in results:
             retrieved_docs.append({
-                'text': result.payload['text'],
-                'score': result.score,
-                'source': result.payload.get('source', 'unknown'),
-                'type': result.payload.get('type', 'unknown'),
-                'metadata': result.payload
+                'id': point_id,
+                'text': payload['text'],
+                'score': score,
+                'source': payload.get('source', 'unknown'),
+                'type': payload.get('type', 'unknown'),
+                'metadata': payload
             })
         
+        if use_reranker:
+            retrieved_docs = self.reranker.rerank(query, retrieved_docs, final_top_k)
         return retrieved_docs
     
-    def generate_context(self, retrieved_docs: List[Dict]) -> str:
-        """Generate context string from retrieved documents"""
-        context_parts = []
-        for i, doc in enumerate(retrieved_docs, 1):
-            context_parts.append(f"[Document {i}] (Source: {doc['source']}, Score: {doc['score']:.3f})\n{doc['text']}\n")
+    def _merge_routed(self, results: List[Tuple[str, float, Dict]], routed: List[Tuple[str, float, Dict]],
+                      top_k: int) -> List[Tuple[str, float, Dict]]:
+        """Insert routed hits ahead of the first result they outscore with the boost,
+        keeping the order of the unfiltered results, then cut to top_k"""
+        merged = list(results)
+        seen = {point_id for point_id, _, _ in results}
+        for hit in routed:
+            if hit[0] in seen:
+                continue
+            boosted = hit[1] + self.route_boost
+            position = next((i for i, (_, score, _) in enumerate(merged) if score < boosted), len(merged))
+            merged.insert(position, hit)
+        return merged[:top_k]
+    
+    def _search(self, retriever: Retriever, query: str, query_embedding: np.ndarray, top_k: int,
+                filters: Optional[Dict[str, Any]]) -> List[Tuple[str, float, Dict]]:
+        if self.hybrid and retriever.sparse is not None:
+            return self._hybrid_search(retriever, query, query_embedding, top_k, filters)
+        return retriever.search(query_embedding, top_k, filters)
+    
+    def _hybrid_search(self, retriever: Retriever, query: str, query_embedding: np.ndarray,
+                       top_k: int, filters: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float, Dict]]:
+        """Fuse dense and BM25 rankings with reciprocal-rank fusion.
         
-        return "\n".join(context_parts)
-
-
-class LLMClient:
-    """Client for Ollama/Gemma LLM API"""
+        Each list contributes ``1 / (rrf_k + rank)`` per point; the fused
+        top-k keep their cosine similarity as score, so lexical-only hits
+        are fetched from the retriever and scored against the query.
+        """
+        depth = max(top_k * 4, 20)
+        dense = retriever.search(query_embedding, depth, filters)
+        lexical = retriever.sparse.search(query, depth)
+        hits = {hit[0]: hit for hit in dense}
+        
+        if filters:
+            # The BM25 index is unfiltered; check payloads of lexical-only hits
+            missing = [point_id for point_id, _ in lexical if point_id not in hits]
+            if missing:
+                hits.update((hit[0], hit) for hit in retriever.fetch(missing, query_embedding)
+                            if payload_matches(hit[2], filters))
+            lexical = [(point_id, score) for point_id, score in lexical if point_id in hits]
+        
+        fused = collections.defaultdict(float)
+        for rank, (point_id, _, _) in enumerate(dense, 1):
+            fused[point_id] += 1.0 / (self.rrf_k + rank)
+        for rank, (point_id, _) in enumerate(lexical, 1):
+            fused[point_id] += 1.0 / (self.rrf_k + rank)
+        best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+        
+        missing = [point_id for point_id in best if point_id not in hits]
+        if missing:
+            hits.update((hit[0], hit) for hit in retriever.fetch(missing, query_embedding))
+        return [hits[point_id] for point_id in best if point_id in hits]
     
-    def __init__(self, api_url='https://ollama-gemma-683508575972.us-central1.run.app/'):
-        self.api_url = api_url.rstrip('/')
+    def match_faq(self, query_embedding: np.ndarray, retrieved_docs: List[Dict],
+                  language: str) -> Optional[Dict]:
+        """The retrieved FAQ whose question nearly equals the query, if any.
+        
+        The query is compared with the FAQ's stored question rather than the
+        whole question/answer chunk, and the answer must be in the requested
+        language. The returned document carries ``faq_similarity``.
+        """
+        if not self.faq_direct_threshold:
+            return None
+        
+        faqs = [doc for doc in retrieved_docs
+                if doc['type'] == 'faq' and doc['metadata'].get('question') and doc['metadata'].get('answer')]
+        if not faqs:
+            return None
+        
+        # Each FAQ question is embedded once; point IDs hash the chunk text, so they never go stale
+        missing = [doc for doc in faqs if doc['id'] not in self._faq_questions]
+        if missing:
+            embeddings = self.embed_texts([doc['metadata']['question'] for doc in missing], show_progress_bar=False)
+            embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+            for doc, embedding in zip(missing, embeddings):
+                self._faq_questions[doc['id']] = embedding.astype(np.float32)
+        questions = np.stack([self._faq_questions[doc['id']] for doc in faqs])
+        query = np.asarray(query_embedding, dtype=np.float32)
+        similarities = questions @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        
+        best = int(np.argmax(similarities))
+        doc = faqs[best]
+        if (similarities[best] < self.faq_direct_threshold
+                or detect_query_language(doc['metadata']['answer']) != language):
+            return None
+        return dict(doc, faq_similarity=float(similarities[best]))
     
-    def generate(self, prompt: str, max_tokens=512, temperature=0.7, stream=False) -> str:
-        """Generate response from LLM"""
-        # Try multiple endpoint variations
-        endpoints = [
-            f"{self.api_url}/api/generate",
-            f"{self.api_url}/generate",
-            f"{self.api_url}/v1/completions",
-            f"{self.api_url}/api/chat"
-        ]
+    def _trim_to_relevant(self, text: str, query: str, max_tokens: int) -> str:
+        """Keep the sentences sharing most words with the query, in their original order"""
+        sentences = self.processor.split_sentences(text)
+        query_terms = set(tokenize(query))
+        # Title line first, then by query-term overlap, earlier sentences winning ties
+        ranked = sorted(range(len(sentences)), key=lambda i: (
+            i != 0, -len(query_terms.intersection(tokenize(sentences[i]))), i
+        ))
         
-        for endpoint in endpoints:
-            try:
-                # Try Ollama format
-                response = requests.post(
-                    endpoint,
-                    json={
-                        "model": "gemma3:4b",
-                        "prompt": prompt,
-                        "stream": stream,
-                        "options": {
-                            "temperature": temperature,
-                            "num_predict": max_tokens
-                        }
-                    },
-                    timeout=30,
-                    stream=stream
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    return result.get('response', result.get('text', result.get('content', '')))
-                elif response.status_code == 404:
-                    continue  # Try next endpoint
-                elif response.status_code == 429 or response.status_code == 503:
-                    # Rate limit or quota exceeded - return error to trigger fallback
-                    print(f"Quota limit exceeded (status {response.status_code})")
-                    return "QuotaLimit: API quota exceeded"
-                else:
-                    print(f"API returned status {response.status_code} for {endpoint}")
-                    continue
-            
-            except Exception as e:
-                print(f"Error with endpoint {endpoint}: {str(e)}")
+        keep, used = set(), 0
+        for i in ranked:
+            n_tokens = self.processor.count_tokens(sentences[i]) + 1
+            if used + n_tokens > max_tokens:
                 continue
+            keep.add(i)
+            used += n_tokens
+        return "\n".join(sentences[i] for i in sorted(keep))
+    
+    def select_context(self, retrieved_docs: List[Dict], query: str = '') -> List[Dict]:
+        """Documents that go into the prompt under the score threshold and token budget.
+        
+        The best document (highest ``rerank_score`` when reranked, else
+        ``score``) always comes first, whatever its retrieval position, since
+        routing, fusion and reranking do not sort by score. The others follow
+        in retrieval order if they reach ``context_min_score``.
+        Trimmed documents are returned as copies with a shortened ``text``
+        and ``trimmed`` set; each carries its ``context_tokens``.
+        """
+        if not retrieved_docs:
+            return []
+        best = max(retrieved_docs, key=lambda doc: doc.get('rerank_score', doc['score']))
+        candidates = [best] + [doc for doc in retrieved_docs
+                               if doc is not best and doc['score'] >= self.context_min_score]
+        
+        selected, used = [], 0
+        for doc in candidates:
+            text = doc['text']
+            n_tokens = self.processor.count_tokens(text)
+            limit = self.context_max_tokens - used
+            if self.context_max_doc_tokens:
+                limit = min(limit, self.context_max_doc_tokens)
+            
+            if n_tokens > limit:
+                if not self.context_max_doc_tokens or limit < 32:
+                    break
+                text = self._trim_to_relevant(text, query, limit)
+                n_tokens = self.processor.count_tokens(text)
+                if not text:
+                    break
+                doc = dict(doc, text=text, trimmed=True)
+            
+            selected.append(dict(doc, context_tokens=n_tokens))
+            used += n_tokens
+            if used >= self.context_max_tokens:
+                break
+        return selected
+    
+    def generate_context(self, retrieved_docs: List[Dict], query: str = '') -> str:
+        """Generate context string from the retrieved documents that fit the context budget"""
+        context_parts = []
+        for i, doc in enumerate(self.select_context(retrieved_docs, query), 1):
+            context_parts.append(f"[Document {i}] (Source: {doc['source']}, Score: {doc['score']:.3f})\n{doc['text']}\n")
         
-        # If all endpoints fail, return a helpful fallback message
-        return "I apologize, but I'm having trouble connecting to the AI service. However, based on the information I found, I can help you with your question. Please contact us directly at info@vwat.org or +1-647-343-8928 for immediate assistance."
+        return "\n".join(context_parts)
 
 
 def create_rag_prompt(query: str, context: str, language: str = 'vi') -> str:
@@ -535,132 +2337,161 @@ ANSWER (use only context information, answer in English):"""
     return prompt
 
 
-def detect_query_language(query: str) -> str:
-    """Lightweight detection of whether a query is Vietnamese ('vi') or English ('en').
-    Uses presence of Vietnamese diacritics and a few common words as a heuristic.
-    """
-    # Characters with Vietnamese diacritics
-    vietnamese_chars = set("ăâđêôơưÁÀẢÃẠẮẰẲẴẶẤẦẨẪẬÉÈẺẼẸẾỀỂỄỆÍÌỈĨỊÓÒỎÕỌỐỒỔỖỘỚỜỞỠỢÚÙỦŨỤỨỪỬỮỰÝỲỶỸỴáàảãạắằẳẵặấầẩẫậéèẻẽẹếềểễệíìỉĩịóòỏõọốồổỗộớờởỡợúùủũụứừửữựýỳỷỹỵ")
-    has_vn_char = any(ch in vietnamese_chars for ch in query)
-    if has_vn_char:
-        return 'vi'
-
-    # Common Vietnamese words without diacritics (typed without accents)
-    vietnamese_words = {
-        'vwat','dich','vu','chuong','trinh','ho','tro','nguoi','nhap','cu','tinan','tieng','anh','lien','he','dia','chi','gio','lam','viec'
-    }
-    tokens = {t.strip(".,!?;:").lower() for t in query.split()}
-    if tokens & vietnamese_words:
-        return 'vi'
-
-    return 'en'
-
-def is_query_relevant(query: str, language: str = 'vi') -> bool:
-    """Check if query is related to VWAT services, programs, or organization"""
-    query_lower = query.lower()
-    
-    # Keywords related to VWAT services and topics
-    vwat_keywords = [
-        # English keywords
-        'vwat', 'vietnamese', 'refugee', 'immigrant', 'immigration', 'newcomer',
-        'settlement', 'service', 'program', 'help', 'assist', 'support',
-        'appointment', 'contact', 'address', 'location', 'hours', 'email', 'phone',
-        'employment', 'job', 'work', 'language', 'english', 'esl', 'linc',
-        'housing', 'rent', 'accommodation', 'legal', 'tax', 'health', 'medical',
-        'family', 'youth', 'senior', 'children', 'education', 'school',
-        'citizenship', 'pr card', 'visa', 'document', 'translation',
-        'counseling', 'mental health', 'workshop', 'class', 'training',
-        'toronto', 'organization', 'non-profit', 'volunteer', 'donate',
-        # Vietnamese keywords
-        'dịch vụ', 'chương trình', 'hỗ trợ', 'giúp đỡ', 'người nhập cư', 'tị nạn',
-        'định cư', 'liên hệ', 'địa chỉ', 'giờ làm việc', 'điện thoại',
-        'việc làm', 'công việc', 'tiếng anh', 'nhà ở', 'thuê nhà', 'pháp lý',
-        'thuế', 'sức khỏe', 'y tế', 'gia đình', 'thanh thiếu niên', 'người cao tuổi',
-        'trẻ em', 'giáo dục', 'trường học', 'quốc tịch', 'tư vấn', 'lớp học',
-        'đào tạo', 'tổ chức', 'tình nguyện', 'quyên góp', 'hẹn gặp'
-    ]
-    
-    # Off-topic keywords that indicate irrelevant queries
-    off_topic_keywords = [
-        'weather', 'thời tiết', 'nấu ăn', 'cooking', 'recipe', 'công thức', 'cook', 'pasta', 'food',
-        'sport', 'thể thao', 'movie', 'phim', 'music', 'nhạc', 'football', 'soccer', 'basketball',
-        'game', 'trò chơi', 'shopping', 'mua sắm', 'fashion', 'thời trang',
-        'restaurant', 'nhà hàng', 'travel', 'du lịch', 'vacation', 'nghỉ mát',
-        # Financial/currency queries
-        'usd', 'cad', 'currency', 'exchange rate', 'tỷ giá', 'dollar', 'euro',
-        'stock', 'cổ phiếu', 'crypto', 'bitcoin', 'forex', 'trading'
-    ]
-    
-    # Check for off-topic keywords first
-    for keyword in off_topic_keywords:
-        if keyword in query_lower:
-            return False
-    
-    # Check for VWAT-related keywords
-    for keyword in vwat_keywords:
-        if keyword in query_lower:
-            return True
-    
-    # If no clear match, retrieve documents and check relevance score
-    # This is more lenient for ambiguous queries
-    return True  # Let RAG system handle it if unclear
+# Intent routes: (name, pattern over the diacritic-folded query, payload filter)
+QUERY_ROUTES = [
+    ('contact', re.compile(
+        r"\b(contact|phone|telephone|call us|e-?mail|address|where are you( located)?|directions to"
+        r"|opening hours|office hours|business hours|hours of operation|your hours"
+        r"|(what time|when) do you (open|close)|open on (weekends?|saturdays?|sundays?)"
+        r"|lien he|dien thoai|dia chi|(vwat|van phong) o dau|gio lam viec|gio mo cua"
+        r"|(mo|dong) cua (luc )?may gio)\b"
+    ), {'source': ['org.json', 'contacts.json']}),
+]
+
+
+def route_query(query: str) -> Optional[Dict[str, Any]]:
+    """Payload filter for the first matching intent route, or None"""
+    folded = fold_diacritics(query)
+    for _, pattern, filters in QUERY_ROUTES:
+        if pattern.search(folded):
+            return filters
+    return None
 
 
 # Main functions for Flask integration
 rag_system = None
 llm_client = None
+# Async serving path (asgi.py)
+async_llm_client = None
+rag_executor = None  # Bounded thread pool for embedding, retrieval and answer cache lookups
+# Identical questions in flight at the same time share one answer
+query_flight = SingleFlight()
+async_query_flight = AsyncSingleFlight()
+_flight_states = {}  # Flight key -> retrieval state of the call waiting on the LLM
 
 def initialize_rag():
     """Initialize RAG system (call this once at app startup)"""
     global rag_system, llm_client
     if rag_system is None:
-        rag_system = RAGSystem()
-        llm_client = LLMClient()
+        options = {
+            'quantization': os.environ.get('RAG_QUANTIZATION') or None,
+            'rescore_oversampling': float(os.environ.get('RAG_RESCORE_OVERSAMPLING', 3.0)),
+            'reranker_model': os.environ.get('RAG_RERANKER_MODEL') or None,
+            'rerank_budget_ms': float(os.environ.get('RAG_RERANK_BUDGET_MS', 150.0)),
+            # Serving processes embed only queries, which the in-memory query cache covers
+            'embedding_cache_dir': os.environ.get('RAG_EMBEDDING_CACHE_DIR') or None
+        }
+        # A Qdrant server takes precedence; otherwise prefer the prebuilt
+        # read-only snapshot and fall back to the local Qdrant storage
+        qdrant_url = os.environ.get('QDRANT_URL')
+        snapshot_dir = None if qdrant_url else resolve_snapshot()
+        if qdrant_url:
+            rag_system = RAGSystem(qdrant_url=qdrant_url, **options)
+        elif snapshot_dir:
+            backend = os.environ.get('RAG_BACKEND', 'numpy')
+            rag_system = RAGSystem(snapshot_dir=snapshot_dir, backend=backend, **options)
+        else:
+            if os.environ.get('RAG_BACKEND', 'qdrant') != 'qdrant':
+                print("No index snapshot found, using the Qdrant backend")
+            rag_system = RAGSystem(**options)
+        llm_client = LLMClient(**_llm_client_options())
     return rag_system
 
+def _llm_client_options() -> Dict[str, Any]:
+    """LLM client settings from the environment, shared by the sync and async clients"""
+    hedge_percentile = os.environ.get('LLM_HEDGE_PERCENTILE')
+    return {
+        'api_url': os.environ.get('LLM_API_URL', 'https://ollama-gemma-683508575972.us-central1.run.app/'),
+        'connect_timeout': float(os.environ.get('LLM_CONNECT_TIMEOUT', 3.05)),
+        'read_timeout': float(os.environ.get('LLM_READ_TIMEOUT', 30.0)),
+        'breaker_threshold': int(os.environ.get('LLM_BREAKER_THRESHOLD', 5)),
+        'breaker_reset_timeout': float(os.environ.get('LLM_BREAKER_RESET_SECONDS', 30.0)),
+        'hedge_percentile': float(hedge_percentile) if hedge_percentile else None
+    }
+
+def reload_rag(data_dir='./data', snapshot: Optional[str] = None) -> Dict[str, Any]:
+    """Hot-reload the knowledge base of the running RAG system.
+    
+    With ``snapshot`` ('current' or a version) the system switches to that
+    prebuilt snapshot; otherwise the index is rebuilt from ``data_dir``.
+    """
+    if rag_system is None:
+        initialize_rag()
+    
+    if snapshot:
+        rag_system.switch_snapshot(None if snapshot == 'current' else snapshot)
+        return {'snapshot': os.path.basename(rag_system.snapshot_dir)}
+    return rag_system.reload_knowledge_base(data_dir=data_dir)
+
 def cleanup_rag():
     """Cleanup RAG system resources"""
     global rag_system, llm_client
     if rag_system is not None:
         rag_system.close()
         rag_system = None
+    if llm_client is not None:
+        llm_client.close()
     llm_client = None
 
-def clean_html_artifacts(text: str) -> str:
-    """Remove malformed HTML tags and attributes from LLM responses"""
-    import re
-    
-    # AGGRESSIVE: Remove the exact pattern we're seeing: Website: href="..." target="...">URL
-    text = re.sub(r'Website:\s*href\s*=\s*["\'][^"\'>]*["\']\s*target\s*=\s*["\'][^"\'>]*["\']\s*>\s*(www\.[^\s<]+|https?://[^\s<]+)', 
-                  r'Website: \1', text, flags=re.IGNORECASE)
-    
-    # Remove href attributes that appear as text (various formats)
-    text = re.sub(r'\s*href\s*=\s*["\'][^"\'>]*["\']', '', text, flags=re.IGNORECASE)
-    
-    # Remove target attributes
-    text = re.sub(r'\s*target\s*=\s*["\'][^"\'>]*["\']', '', text, flags=re.IGNORECASE)
-    
-    # Remove any remaining HTML-like attributes (rel, class, etc.)
-    text = re.sub(r'\s+\w+\s*=\s*["\'][^"\'>]*["\']', '', text)
-    
-    # Remove standalone opening/closing angle brackets followed by URLs
-    text = re.sub(r'>\s*(https?://[^\s<]+|www\.[^\s<]+)', r'\1', text)
-    text = re.sub(r'<\s*(https?://[^\s>]+|www\.[^\s>]+)', r'\1', text)
-    
-    # Remove standalone angle brackets that aren't part of valid HTML
-    text = re.sub(r'(?<!<br)>(?![^<]*</)', '', text)
-    
-    # Clean up "Website:" prefix that may have gotten mangled  
-    text = re.sub(r'Website:\s{2,}', 'Website: ', text)
-    
-    # Remove any leftover HTML tags except <br>
-    text = re.sub(r'<(?!br\s*/?)[^>]+>', '', text)
+async def initialize_async_rag():
+    """Initialize the RAG system plus the async LLM client and the bounded
+    executor for the asyncio serving path (call once inside the event loop)"""
+    global async_llm_client, rag_executor
+    loop = asyncio.get_running_loop()
+    # Loading models and the index blocks, so keep it off the event loop
+    await loop.run_in_executor(None, initialize_rag)
+    if rag_executor is None:
+        rag_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('RAG_EXECUTOR_WORKERS', 8)),
+                                          thread_name_prefix='rag')
+    if async_llm_client is None:
+        async_llm_client = AsyncLLMClient(max_connections=int(os.environ.get('LLM_MAX_CONNECTIONS', 100)),
+                                          **_llm_client_options())
+    return rag_system
+
+async def cleanup_async_rag():
+    """Close the async LLM client and the executor (the RAG system itself is closed by cleanup_rag)"""
+    global async_llm_client, rag_executor
+    if async_llm_client is not None:
+        await async_llm_client.close()
+        async_llm_client = None
+    if rag_executor is not None:
+        rag_executor.shutdown(wait=False, cancel_futures=True)
+        rag_executor = None
+
+def _llm_error_message(language: str) -> str:
+    if language == 'vi':
+        return "Xin lỗi, tôi gặp sự cố khi xử lý câu hỏi của bạn. Vui lòng thử lại hoặc liên hệ info@vwat.org / +1-647-343-8928."
+    return "I apologize, I encountered an issue processing your question. Please try again or contact info@vwat.org / +1-647-343-8928."
+
+
+def _retrieval_only_response(retrieved_docs: List[Dict], language: str, max_docs=2, max_chars=500) -> str:
+    """Answer built from the retrieved documents alone, for when the LLM is unavailable"""
+    if language == 'vi':
+        intro = "Xin lỗi, dịch vụ AI hiện không khả dụng. Đây là thông tin liên quan tôi tìm thấy:"
+        outro = "Để được hỗ trợ thêm, vui lòng liên hệ info@vwat.org / +1-647-343-8928."
+    else:
+        intro = "Sorry, the AI service is unavailable right now. Here is related information I found:"
+        outro = "For more help, please contact info@vwat.org / +1-647-343-8928."
     
-    return text.strip()
+    excerpts = []
+    for doc in retrieved_docs[:max_docs]:
+        metadata = doc.get('metadata', {})
+        text = metadata.get('answer') if doc.get('type') == 'faq' else None
+        text = (text or doc['text']).split('\nKeywords:')[0].strip()
+        if len(text) > max_chars:
+            # Cut at the last sentence or line end that fits
+            cut = max(text.rfind('. ', 0, max_chars), text.rfind('\n', 0, max_chars))
+            text = text[:cut + 1] if cut > 0 else text[:max_chars] + '…'
+        excerpts.append(sanitize_response(text))
+    if not excerpts:
+        return _llm_error_message(language)
+    return '<br><br>'.join([intro] + excerpts + [outro])
 
-def get_rag_response(query: str, language: str = 'vi') -> Dict[str, Any]:
-    """Get response using RAG system with language support - LLM-driven responses only"""
-    global rag_system, llm_client
+
+def _prepare_rag_response(query: str, language: str) -> Dict[str, Any]:
+    """Everything before the LLM call. Returns a finished result (off-topic, FAQ or
+    cached answer, with an ``answer_source``) or the prompt and retrieval state"""
+    global rag_system
     
     if rag_system is None:
         initialize_rag()
@@ -674,54 +2505,341 @@ def get_rag_response(query: str, language: str = 'vi') -> Dict[str, Any]:
         return {
             'response': off_topic_response,
             'retrieved_docs': [],
-            'context': ''
+            'context': '',
+            'answer_source': 'off_topic',
+            'prompt_tokens': 0
         }
     
     # Retrieve relevant documents - let LLM decide relevance
-    retrieved_docs = rag_system.retrieve(query, top_k=5)
+    query_embedding = rag_system.embed_query(query)
+    top_k = rag_system.rerank_top_k if rag_system.reranker is not None else 5
+    retrieved_docs = rag_system.retrieve(query, top_k=top_k, query_embedding=query_embedding)
+    
+    # Serve the stored answer when the question is practically a known FAQ
+    faq = rag_system.match_faq(query_embedding, retrieved_docs, language)
+    if faq is not None:
+        print(f"FAQ direct answer (similarity {faq['faq_similarity']:.3f}): {faq['metadata']['question'][:50]}")
+        return {
+            'response': sanitize_response(faq['metadata']['answer']),
+            'retrieved_docs': [faq] + [doc for doc in retrieved_docs if doc['id'] != faq['id']],
+            'context': '',
+            'answer_source': 'faq',
+            'prompt_tokens': 0
+        }
     
-    # Generate context from retrieved documents
-    context = rag_system.generate_context(retrieved_docs)
+    # Generate context from the retrieved documents that fit the token budget
+    context = rag_system.generate_context(retrieved_docs, query)
+    
+    # Reuse the answer to a near-identical question over the same documents
+    doc_ids = [doc['id'] for doc in retrieved_docs]
+    if rag_system.answer_cache is not None:
+        cached_response = rag_system.answer_cache.get(query_embedding, language, doc_ids)
+        if cached_response is not None:
+            return {
+                'response': cached_response,
+                'retrieved_docs': retrieved_docs,
+                'context': context,
+                'answer_source': 'answer_cache',
+                'prompt_tokens': 0
+            }
     
     # Create prompt with language parameter
     prompt = create_rag_prompt(query, context, language)
+    prompt_tokens = rag_system.processor.count_tokens(prompt)
+    print(f"Prompt: {prompt_tokens} tokens")
+    
+    return {
+        'prompt': prompt,
+        'prompt_tokens': prompt_tokens,
+        'retrieved_docs': retrieved_docs,
+        'context': context,
+        'query_embedding': query_embedding,
+        'doc_ids': doc_ids
+    }
+
+
+def _cache_llm_answer(state: Dict[str, Any], language: str, response: str):
+    """Store a sanitized LLM answer for near-identical questions"""
+    if rag_system.answer_cache is not None and response:
+        rag_system.answer_cache.put(state['query_embedding'], language, state['doc_ids'], response)
+
+
+def _fallback_result(state: Dict[str, Any], language: str, error: LLMError) -> Dict[str, Any]:
+    """Retrieval-only result when the LLM failed, timed out or its circuit is open; never cached"""
+    print(f"LLM unavailable ({type(error).__name__}: {error}), answering from retrieval only")
+    return dict(_llm_result(state, _retrieval_only_response(state['retrieved_docs'], language)),
+                answer_source='retrieval_only')
+
+
+def _llm_result(state: Dict[str, Any], response: str) -> Dict[str, Any]:
+    return {
+        'response': response,
+        'retrieved_docs': state['retrieved_docs'],
+        'context': state['context'],
+        'answer_source': 'llm',
+        'prompt_tokens': state['prompt_tokens']
+    }
+
+
+def _llm_answered(state: Dict[str, Any], language: str, text: str) -> Dict[str, Any]:
+    """Result for a whole LLM answer: sanitized and cached, or the apology when empty"""
+    # Clean up any HTML artifacts from the response
+    response = sanitize_response(text)
+    if response:
+        _cache_llm_answer(state, language, response)
+    else:
+        response = _llm_error_message(language)
+    return _llm_result(state, response)
+
+
+def _llm_failed(state: Dict[str, Any], language: str, error: Exception) -> Dict[str, Any]:
+    """Result when the LLM call raised: retrieval-only for ``LLMError``, otherwise the apology"""
+    if isinstance(error, LLMError):
+        return _fallback_result(state, language, error)
+    print(f"LLM generation failed: {str(error)}")
+    return _llm_result(state, _llm_error_message(language))
+
+
+class _StreamedAnswer:
+    """Sanitized text of an LLM answer as it streams, and the events that end the stream"""
+    
+    def __init__(self, state: Dict[str, Any], language: str):
+        self.state = state
+        self.language = language
+        self.sanitizer = StreamSanitizer()
+        self.parts = []
+    
+    def feed(self, delta: str) -> str:
+        """Sanitized text to show for one LLM delta (may be empty)"""
+        text = self.sanitizer.feed(delta)
+        if text:
+            self.parts.append(text)
+        return text
+    
+    def finish(self) -> List[Tuple[str, Any]]:
+        events = []
+        text = self.sanitizer.finish()
+        if text:
+            self.parts.append(text)
+            events.append(('token', text))
+        response = ''.join(self.parts)
+        if response:
+            _cache_llm_answer(self.state, self.language, response)
+        else:
+            response = _llm_error_message(self.language)
+            events.append(('token', response))
+        events.append(('done', _llm_result(self.state, response)))
+        return events
+    
+    def failed(self, error: Exception) -> List[Tuple[str, Any]]:
+        if isinstance(error, LLMError) and not self.parts:
+            result = _fallback_result(self.state, self.language, error)
+            return [('token', result['response']), ('done', result)]
+        print(f"LLM streaming failed: {str(error)}")
+        # Keep what was already shown and append the apology
+        error_text = ('<br><br>' if self.parts else '') + _llm_error_message(self.language)
+        self.parts.append(error_text)
+        return [('token', error_text), ('done', _llm_result(self.state, ''.join(self.parts)))]
+
+
+def _flight_key(query: str, language: str) -> Tuple[str, str]:
+    return normalize_query(query), language
+
+
+def _flight_timeout(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else max(deadline - time.monotonic(), 0.0)
+
+
+def _flight_timeout_result(query: str, language: str) -> Dict[str, Any]:
+    """Retrieval-only answer for a caller whose deadline passed while it waited on an
+    identical question: from that call's retrieved documents, without retrieving again"""
+    state = _flight_states.get(_flight_key(query, language))
+    if state is None:
+        # Still retrieving: nothing to answer from yet
+        state = {'retrieved_docs': [], 'context': '', 'prompt_tokens': 0}
+    return _fallback_result(state, language,
+                            DeadlineExceededError("Request deadline passed waiting for an identical question"))
+
+
+@contextlib.contextmanager
+def _waiting_on_llm(query: str, language: str, state: Dict[str, Any]):
+    """Share ``state`` with callers coalesced onto this question while the LLM answers"""
+    key = _flight_key(query, language)
+    _flight_states[key] = state
+    try:
+        yield
+    finally:
+        if _flight_states.get(key) is state:
+            del _flight_states[key]
+
+
+def get_rag_response(query: str, language: str = 'vi', deadline: Optional[float] = None) -> Dict[str, Any]:
+    """Get response using RAG system with language support - LLM-driven responses only.
+    
+    ``deadline`` (a ``time.monotonic()`` timestamp) bounds the LLM call; when the
+    LLM fails, times out or its circuit is open, the answer is built from the
+    retrieved documents instead (``answer_source: 'retrieval_only'``).
+    
+    Concurrent calls for the same question (after ``normalize_query``) and
+    language share one retrieval and LLM call; each gets its own shallow copy
+    of the result, or the same exception. A caller whose deadline passes while
+    it waits answers from the documents that call retrieved.
+    """
+    try:
+        return dict(query_flight.do(_flight_key(query, language), _get_rag_response, query, language, deadline,
+                                    timeout=_flight_timeout(deadline)))
+    except SingleFlightTimeout:
+        return _flight_timeout_result(query, language)
+
+
+def _get_rag_response(query: str, language: str, deadline: Optional[float]) -> Dict[str, Any]:
+    state = _prepare_rag_response(query, language)
+    if 'answer_source' in state:
+        return state
     
     # Generate response using LLM
     try:
-        response = llm_client.generate(prompt)
-        
-        # Clean up any HTML artifacts from the response
-        if response and "Error" not in response:
-            # FIRST: Clean HTML artifacts BEFORE doing anything else
-            response = clean_html_artifacts(response)
-            # SECOND: Convert newlines to HTML breaks for proper display
-            response = response.replace('\n', '<br>')
-            # THIRD: Clean again in case any HTML slipped through
-            response = clean_html_artifacts(response)
-        else:
-            # If LLM returns an error, provide graceful fallback
-            error_msg = "Xin lỗi, tôi gặp sự cố khi xử lý câu hỏi của bạn. Vui lòng thử lại hoặc liên hệ info@vwat.org / +1-647-343-8928." if language == 'vi' else "I apologize, I encountered an issue processing your question. Please try again or contact info@vwat.org / +1-647-343-8928."
-            response = error_msg
+        with _waiting_on_llm(query, language, state):
+            text = llm_client.generate(state['prompt'], deadline=deadline)
+    except Exception as e:
+        return _llm_failed(state, language, e)
+    return _llm_answered(state, language, text)
+
+
+def stream_rag_response(query: str, language: str = 'vi',
+                        deadline: Optional[float] = None) -> Iterator[Tuple[str, Any]]:
+    """Streaming variant of ``get_rag_response``.
+
+    Yields ``('token', text)`` for each sanitized piece of the answer as the
+    LLM produces it, then ``('done', result)`` with the same dict
+    ``get_rag_response`` returns (``response`` holds the whole answer).
+    Off-topic, FAQ, cached and retrieval-only answers arrive as a single token.
+    """
+    state = _prepare_rag_response(query, language)
+    if 'answer_source' in state:
+        yield 'token', state['response']
+        yield 'done', state
+        return
     
+    answer = _StreamedAnswer(state, language)
+    try:
+        for delta in llm_client.generate_stream(state['prompt'], deadline=deadline):
+            text = answer.feed(delta)
+            if text:
+                yield 'token', text
+        events = answer.finish()
     except Exception as e:
-        print(f"LLM generation failed: {str(e)}")
-        error_msg = "Xin lỗi, tôi gặp sự cố khi xử lý câu hỏi của bạn. Vui lòng thử lại hoặc liên hệ info@vwat.org / +1-647-343-8928." if language == 'vi' else "I apologize, I encountered an issue processing your question. Please try again or contact info@vwat.org / +1-647-343-8928."
-        response = error_msg
+        events = answer.failed(e)
+    yield from events
+
+
+async def get_rag_response_async(query: str, language: str = 'vi',
+                                 deadline: Optional[float] = None) -> Dict[str, Any]:
+    """``get_rag_response`` for the asyncio serving path.
     
-    return {
-        'response': response,
-        'retrieved_docs': retrieved_docs,
-        'context': context
-    }
+    Embedding, retrieval and cache lookups run on ``rag_executor``, so at most
+    ``RAG_EXECUTOR_WORKERS`` threads do CPU work however many chats are in
+    flight; the LLM call is awaited and holds no thread at all. Identical
+    questions in flight are coalesced as in ``get_rag_response``.
+    """
+    try:
+        return dict(await async_query_flight.do(_flight_key(query, language), _get_rag_response_async,
+                                                query, language, deadline, timeout=_flight_timeout(deadline)))
+    except SingleFlightTimeout:
+        return _flight_timeout_result(query, language)
+
 
+async def _prepare_rag_response_async(query: str, language: str) -> Dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(rag_executor, _prepare_rag_response, query, language)
+
+
+async def _get_rag_response_async(query: str, language: str, deadline: Optional[float]) -> Dict[str, Any]:
+    state = await _prepare_rag_response_async(query, language)
+    if 'answer_source' in state:
+        return state
+    
+    try:
+        with _waiting_on_llm(query, language, state):
+            text = await async_llm_client.generate(state['prompt'], deadline=deadline)
+    except Exception as e:
+        return _llm_failed(state, language, e)
+    return _llm_answered(state, language, text)
+
+
+async def stream_rag_response_async(query: str, language: str = 'vi',
+                                    deadline: Optional[float] = None) -> AsyncIterator[Tuple[str, Any]]:
+    """``stream_rag_response`` for the asyncio serving path (see ``get_rag_response_async``)"""
+    state = await _prepare_rag_response_async(query, language)
+    if 'answer_source' in state:
+        yield 'token', state['response']
+        yield 'done', state
+        return
+    
+    answer = _StreamedAnswer(state, language)
+    try:
+        async for delta in async_llm_client.generate_stream(state['prompt'], deadline=deadline):
+            text = answer.feed(delta)
+            if text:
+                yield 'token', text
+        events = answer.finish()
+    except Exception as e:
+        events = answer.failed(e)
+    for event in events:
+        yield event
 
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Build or refresh the VWAT RAG index")
+    parser.add_argument('--data-dir', default='./data', help="Directory with the knowledge JSON files")
+    parser.add_argument('--full', action='store_true', help="Re-embed every chunk instead of only changed ones")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Parser processes (0 parses inline; default picks by input size)")
+    parser.add_argument('--dedup-threshold', type=float, default=0.85,
+                        help="MinHash similarity at which chunks are collapsed (0 disables)")
+    parser.add_argument('--snapshot-root', default=SNAPSHOT_ROOT, help="Directory of versioned index snapshots")
+    parser.add_argument('--no-snapshot', action='store_true', help="Do not export a snapshot after indexing")
+    parser.add_argument('--embedding-cache-dir', default='./embedding_cache',
+                        help="On-disk embedding cache reused across runs ('' disables it)")
+    parser.add_argument('--activate', metavar='VERSION',
+                        help="Only point CURRENT at an existing snapshot version (e.g. to roll back)")
+    parser.add_argument('--reload', metavar='APP_URL',
+                        help="Ask a running app (e.g. http://localhost:8000) to hot-reload its knowledge base; "
+                             "needs RAG_ADMIN_TOKEN")
+    parser.add_argument('--reload-snapshot', metavar='VERSION',
+                        help="With --reload: switch to this snapshot ('current' for CURRENT) instead of rebuilding")
+    args = parser.parse_args()
+    
+    if args.activate:
+        set_current_snapshot(args.snapshot_root, args.activate)
+        print(f"Current snapshot is now {args.activate}")
+        raise SystemExit(0)
+    
+    if args.reload:
+        token = os.environ.get('RAG_ADMIN_TOKEN', '')
+        if not token:
+            raise SystemExit("Set RAG_ADMIN_TOKEN to the token configured on the app")
+        response = requests.post(
+            f"{args.reload.rstrip('/')}/admin/reload",
+            json={'snapshot': args.reload_snapshot} if args.reload_snapshot else {},
+            headers={'Authorization': f"Bearer {token}"},
+            timeout=600
+        )
+        print(f"Reload returned {response.status_code}: {response.text}")
+        raise SystemExit(0 if response.ok else 1)
+    
     # Initialize and index documents
     print("Initializing RAG system...")
-    rag = RAGSystem()
+    rag = RAGSystem(embedding_cache_dir=args.embedding_cache_dir or None)
     
     print("\nIndexing documents...")
-    rag.index_documents()
+    rag.index_documents(data_dir=args.data_dir, incremental=not args.full, parse_workers=args.workers,
+                        dedup_threshold=args.dedup_threshold or None)
+    
+    if not args.no_snapshot:
+        print("\nExporting index snapshot...")
+        rag.export_snapshot(data_dir=args.data_dir, snapshot_root=args.snapshot_root)
     
     print("\n✅ RAG system initialized and documents indexed!")
     print("\nTesting retrieval...")
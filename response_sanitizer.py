@@ -0,0 +1,171 @@
+"""
+Response sanitizer for the VWAT RAG system
+Strips HTML artifacts the LLM copies from the knowledge base and turns
+newlines into <br> in a single pass, for whole answers or streamed chunks
+"""
+
+import re
+from typing import List, Sequence, Union
+
+# Artifacts that contain "="
+_ATTRIBUTE_TOKENS = r'''
+    # Website: href="..." target="...">www.vwat.org  ->  Website: www.vwat.org
+    (?P<website>(?i:Website:\s*href\s*=\s*["'][^"'>]*["']\s*target\s*=\s*["'][^"'>]*["']\s*>\s*
+        (?P<website_url>www\.[^\s<>]+|https?://[^\s<>]+)))
+    # href/target and any other attribute left as text (rel="...", class="...")
+  | (?P<attribute>(?i:\s*(?:href|target))\s*=\s*["'][^"'>]*["']|\s+\w+\s*=\s*["'][^"'>]*["'])
+'''
+
+_MARKUP_TOKENS = r'''
+    (?P<website_spacing>Website:\s{2,})
+    # Angle bracket glued to a URL
+  | >\s*(?P<url_after_gt>https?://[^\s<>]+|www\.[^\s<>]+)
+  | <\s*(?P<url_after_lt>https?://[^\s<>]+|www\.[^\s<>]+)
+  | (?P<br>(?i:<br\s*/?>))
+  | (?P<tag></?[A-Za-z!][^<>]*>)
+  | (?P<stray_gt>>)
+'''
+
+# One alternation, scanned once; earlier alternatives win at the same position.
+# The lookahead lists every character a token can start with, so plain text
+# is skipped without trying each alternative.
+_SANITIZE_RE = re.compile(rf"(?=[\s<>hHtTwW])(?:{_ATTRIBUTE_TOKENS}|{_MARKUP_TOKENS})", re.VERBOSE)
+# Same scan for text without "=", which is most answers
+_MARKUP_RE = re.compile(rf"(?=[<>W])(?:{_MARKUP_TOKENS})", re.VERBOSE)
+
+
+def _replace(match: re.Match) -> str:
+    kind = match.lastgroup
+    if kind == 'website':
+        return f"Website: {match.group('website_url')}"
+    if kind == 'website_spacing':
+        return 'Website: '
+    if kind in ('url_after_gt', 'url_after_lt'):
+        return match.group(kind)
+    if kind == 'br':
+        return '<br>'
+    return ''
+
+
+def _prefix_pattern(*steps) -> str:
+    """Regex matching any non-empty prefix of the sequence ``steps``.
+
+    A step is a regex for one character (or a starred class, which may
+    stop anywhere), or a list of alternative step sequences.
+    """
+    if not steps:
+        return ''
+    head, rest = steps[0], steps[1:]
+    if isinstance(head, list):
+        return '(?:' + '|'.join(_prefix_pattern(*alternative, *rest) for alternative in head) + ')'
+    tail = _prefix_pattern(*rest)
+    return f"{head}(?:{tail})?" if tail else head
+
+
+def _chars(literal: str) -> List[str]:
+    return [re.escape(ch) for ch in literal]
+
+
+_WS = r'\s*'
+_QUOTE = r'["\']'
+_VALUE = r'[^"\'>]*'
+_URL_START = [_chars('www.'), _chars('http') + ['s?'] + _chars('://')]
+
+# Tails that may still become (or extend) a match once more text arrives.
+# Over-matching only delays output, so this is case-insensitive throughout.
+_PARTIAL_RE = re.compile(r'(?=[\s<>hHtTwW])(?:' + '|'.join([
+    _prefix_pattern(*_chars('website:'), _WS, *_chars('href'), _WS, '=', _WS, _QUOTE, _VALUE, _QUOTE,
+                    _WS, *_chars('target'), _WS, '=', _WS, _QUOTE, _VALUE, _QUOTE,
+                    _WS, '>', _WS, _URL_START, r'[^\s<>]*'),
+    _prefix_pattern([_chars('href'), _chars('target')], _WS, '=', _WS, _QUOTE, _VALUE, _QUOTE),
+    # Also holds back trailing whitespace and the last word, which may be an attribute name
+    _prefix_pattern(r'\s', r'\s*', r'\w*', _WS, '=', _WS, _QUOTE, _VALUE, _QUOTE),
+    _prefix_pattern('>', _WS, _URL_START, r'[^\s<>]*'),
+    _prefix_pattern('<', _WS, _URL_START, r'[^\s<>]*'),
+    r'<[^<>]*',
+]) + r')\Z', re.IGNORECASE)
+
+
+def _sanitize(text: str) -> str:
+    # Newlines become <br> only after stripping, so blank lines left at either
+    # end by removed artifacts disappear instead of turning into <br>
+    text = text.strip()
+    pattern = _SANITIZE_RE if '=' in text else _MARKUP_RE
+    return pattern.sub(_replace, text).strip().replace('\n', '<br>')
+
+
+def sanitize_response(text: Union[str, Sequence[str]]) -> Union[str, List[str]]:
+    """Clean an answer for display: strip HTML artifacts and turn newlines into <br>.
+    Accepts one answer or a list of answers.
+    """
+    if isinstance(text, str):
+        return _sanitize(text)
+    return [_sanitize(t) for t in text]
+
+
+class StreamSanitizer:
+    """Incremental ``sanitize_response`` over streamed LLM output.
+
+    ``feed`` returns the cleaned text that is final so far and keeps back
+    any tail that could still grow into an artifact (an open ``<``, a
+    half-written ``href="...``, a URL or trailing whitespace), so tags split
+    across chunks are removed whole. Joining every ``feed`` result and
+    ``finish()`` gives exactly ``sanitize_response`` of the whole text.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._pending_space = ''  # Output whitespace kept until more text follows
+        self._started = False  # Any text emitted yet
+        self._input_started = False  # Any non-whitespace input seen yet
+
+    def _emit(self, cleaned: str) -> str:
+        if not self._started:
+            cleaned = cleaned.lstrip()
+            if not cleaned:
+                return ''
+            self._started = True
+        stripped = cleaned.rstrip()
+        if not stripped:
+            self._pending_space += cleaned
+            return ''
+        out = self._pending_space + stripped
+        self._pending_space = cleaned[len(stripped):]
+        return out.replace('\n', '<br>')
+
+    def feed(self, chunk: str) -> str:
+        buffer = self._buffer + chunk
+        if not self._input_started:
+            # Leading whitespace of the answer is stripped before scanning
+            buffer = buffer.lstrip()
+            if not buffer:
+                return ''
+            self._input_started = True
+
+        pieces = []
+        pos = 0
+        hold = -1
+        while True:
+            if hold < pos:
+                partial = _PARTIAL_RE.search(buffer, pos)
+                hold = partial.start() if partial else len(buffer)
+            match = _SANITIZE_RE.search(buffer, pos)
+            if match is None or match.start() >= hold:
+                pieces.append(buffer[pos:hold])
+                pos = hold
+                break
+            pieces.append(buffer[pos:match.start()])
+            pieces.append(_replace(match))
+            pos = match.end()
+
+        self._buffer = buffer[pos:]
+        return self._emit(''.join(pieces))
+
+    def finish(self) -> str:
+        """Flush the held-back tail at the end of the stream"""
+        tail = _SANITIZE_RE.sub(_replace, self._buffer.rstrip()).rstrip()
+        out = self._emit(tail) if tail else ''
+        # Trailing whitespace is stripped, as in sanitize_response
+        self._buffer = ''
+        self._pending_space = ''
+        return out
@@ -0,0 +1,117 @@
+"""
+Single-flight request coalescing for the VWAT RAG system
+Concurrent calls with the same key share one in-flight computation, so a
+question asked by many users at once is retrieved and generated only once
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class SingleFlightTimeout(TimeoutError):
+    """A caller stopped waiting for the in-flight call it joined"""
+
+
+class SingleFlight:
+    """Coalesce concurrent calls per key across threads.
+
+    The first caller of ``do`` for a key runs ``fn`` in its own thread;
+    callers arriving while it runs wait for it and receive the same result
+    (shared, not copied) or the same exception. Nothing is kept once the
+    call finishes, so results are never stale. A waiter gives up after
+    ``timeout`` seconds with ``SingleFlightTimeout``; the call goes on.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self._in_flight = {}  # key -> Future
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            try:
+                return future.result(timeout)
+            except FutureTimeoutError:
+                with self._lock:
+                    self.timeouts += 1
+                raise SingleFlightTimeout(f"No result within {timeout:.2f}s") from None
+
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'in_flight': len(self._in_flight),
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+                'timeouts': self.timeouts
+            }
+
+
+class AsyncSingleFlight:
+    """``SingleFlight`` for coroutines on one event loop.
+
+    The call runs as its own task, so it finishes for the remaining waiters
+    even if the caller that started it is cancelled (a client disconnects).
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self._in_flight = {}  # key -> Task
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()  # Retrieved, even if every waiter is gone
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args,
+                 timeout: Optional[float] = None) -> Any:
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(fn(*args))
+            task.add_done_callback(lambda done: self._finished(key, done))
+            self.calls += 1
+            # Like the threaded leader, the caller that started the call waits for it
+            return await asyncio.shield(task)
+
+        self.coalesced += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise SingleFlightTimeout(f"No result within {timeout:.2f}s") from None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'in_flight': len(self._in_flight),
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'timeouts': self.timeouts
+        }
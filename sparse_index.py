@@ -0,0 +1,123 @@
+"""
+BM25 inverted index for the VWAT RAG system
+Complements dense retrieval on exact tokens (phone numbers, program names such
+as LINC) and on Vietnamese typed without diacritics
+"""
+
+import os
+import re
+import unicodedata
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def fold_diacritics(text: str) -> str:
+    """Lowercase and strip accents, so "Giờ làm việc" matches "gio lam viec" """
+    decomposed = unicodedata.normalize('NFD', text.casefold())
+    stripped = ''.join(ch for ch in decomposed if unicodedata.category(ch) != 'Mn')
+    # đ has no decomposition
+    return stripped.replace('đ', 'd')
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(fold_diacritics(text))
+
+
+class BM25Index:
+    """Immutable BM25 index over chunk texts, stored as flat NumPy arrays.
+
+    Postings are grouped by term: ``offsets[t]:offsets[t + 1]`` slices
+    ``postings`` (document rows) and ``weights`` (the precomputed BM25 term
+    weight for that document), so a query is one scatter-add per query term
+    and an ``argpartition`` over the document scores.
+    """
+
+    def __init__(self, ids: Sequence[str], vocab: Sequence[str], offsets: np.ndarray,
+                 postings: np.ndarray, weights: np.ndarray):
+        self.ids = list(ids)
+        self.vocab = list(vocab)
+        self.offsets = offsets
+        self.postings = postings
+        self.weights = weights
+        self._terms: Dict[str, int] = {term: i for i, term in enumerate(self.vocab)}
+
+    @classmethod
+    def build(cls, ids: Sequence[str], texts: Sequence[str], k1=1.2, b=0.75) -> 'BM25Index':
+        term_docs: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts: Dict[str, int] = {}
+            for token in tokenize(text):
+                counts[token] = counts.get(token, 0) + 1
+            lengths[row] = sum(counts.values())
+            for term, tf in counts.items():
+                term_docs.setdefault(term, []).append((row, tf))
+
+        n_docs = len(texts)
+        avg_length = float(lengths.mean()) if n_docs else 0.0
+        vocab = sorted(term_docs)
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        postings, weights = [], []
+        for i, term in enumerate(vocab):
+            docs = term_docs[term]
+            rows = np.array([row for row, _ in docs], dtype=np.int32)
+            tf = np.array([tf for _, tf in docs], dtype=np.float32)
+            idf = np.log(1.0 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = k1 * (1.0 - b + b * lengths[rows] / max(avg_length, 1e-9))
+            postings.append(rows)
+            weights.append((idf * tf * (k1 + 1.0) / (tf + norm)).astype(np.float32))
+            offsets[i + 1] = offsets[i] + len(docs)
+
+        return cls(
+            ids, vocab, offsets,
+            np.concatenate(postings) if postings else np.zeros(0, dtype=np.int32),
+            np.concatenate(weights) if weights else np.zeros(0, dtype=np.float32)
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """Best ``(point_id, bm25_score)`` pairs for the query, best first"""
+        scores = None
+        for term in set(tokenize(query)):
+            i = self._terms.get(term)
+            if i is None:
+                continue
+            if scores is None:
+                scores = np.zeros(len(self.ids), dtype=np.float32)
+            start, end = self.offsets[i], self.offsets[i + 1]
+            # Rows are unique within one term's postings, so fancy-index add is safe
+            scores[self.postings[start:end]] += self.weights[start:end]
+
+        if scores is None:
+            return []
+        matched = np.flatnonzero(scores)
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        matched = matched[np.argsort(-scores[matched])]
+        return [(self.ids[row], float(scores[row])) for row in matched]
+
+    def save(self, path: str):
+        """Write the index atomically to ``path`` (.npz)"""
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                ids=np.array(self.ids, dtype=str),
+                vocab=np.array(self.vocab, dtype=str),
+                offsets=self.offsets,
+                postings=self.postings,
+                weights=self.weights
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'BM25Index':
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['ids'].tolist(), data['vocab'].tolist(), data['offsets'],
+                       data['postings'], data['weights'])
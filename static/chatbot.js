@@ -229,6 +229,19 @@ function addBotMessage(text, streaming = false) {
     }
 }
 
+// Empty bot message bubble that a streamed answer is written into
+function addStreamingBotMessage() {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'message bot';
+    messageDiv.innerHTML = `
+        <div class="avatar">👩‍💼</div>
+        <div class="message-content"><span class="streaming-text"></span></div>
+    `;
+    chatMessages.appendChild(messageDiv);
+    scrollToBottom();
+    return messageDiv.querySelector('.streaming-text');
+}
+
 function addBotMessageWithOptions(text, options) {
     const messageDiv = document.createElement('div');
     messageDiv.className = 'message bot';
@@ -1057,7 +1070,130 @@ function handleUserInput() {
     
     showTypingIndicator();
     
-    // Use RAG for everything else
+    // Use RAG for everything else, rendered as the answer is generated
+    streamRagResponse(text).catch(error => {
+        if (error.streamStarted) {
+            // Part of the answer is already shown; don't ask twice
+            console.error('Error:', error);
+            removeTypingIndicator();
+            finishProcessing();
+            addBotMessage(t('errorOccurred'));
+        } else {
+            console.warn('Streaming unavailable, using /chat:', error);
+            requestRagResponse(text);
+        }
+    });
+}
+
+function finishProcessing() {
+    isProcessing = false;
+    sendButton.disabled = false;
+}
+
+function showRagSources(data) {
+    // Optionally show sources
+    if (data.sources && data.sources.length > 0) {
+        const sourcesText = 'Sources: ' + data.sources.map(s => s.source).join(', ');
+        console.log(sourcesText);  // Log sources for debugging
+    }
+}
+
+// Stream a RAG answer from /chat/stream (Server-Sent Events over a POST response)
+function streamRagResponse(text) {
+    let contentSpan = null;
+    let finished = false;
+    
+    return fetch('/chat/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ 
+            message: text,
+            language: currentLanguage,  // Send current language to backend
+            user_id: USER_SESSION_ID  // Send user session ID
+        })
+    })
+    .then(response => {
+        if (!response.ok || !response.body || typeof TextDecoder === 'undefined') {
+            throw new Error('Streaming not supported (status ' + response.status + ')');
+        }
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let answer = '';
+        
+        const handleEvent = (rawEvent) => {
+            let event = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    event = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    data += line.slice(5).trim();
+                }
+            });
+            if (!data) {
+                return;
+            }
+            const payload = JSON.parse(data);
+            
+            if (event === 'token') {
+                if (!contentSpan) {
+                    // First token: replace the typing indicator with the answer bubble
+                    removeTypingIndicator();
+                    contentSpan = addStreamingBotMessage();
+                }
+                answer += payload.text;
+                contentSpan.innerHTML = answer;
+                scrollToBottom();
+            } else if (event === 'done') {
+                finished = true;
+                removeTypingIndicator();
+                finishProcessing();
+                
+                if (payload.status === 'success') {
+                    if (!contentSpan) {
+                        contentSpan = addStreamingBotMessage();
+                    }
+                    contentSpan.innerHTML = payload.response;
+                    scrollToBottom();
+                    showRagSources(payload);
+                    
+                    setTimeout(() => {
+                        addBotMessageWithQuickReplies(t('anythingElse'), [t('yes'), t('no')]);
+                    }, 500);
+                } else {
+                    addBotMessage(t('errorProcessing'));
+                }
+            }
+        };
+        
+        const pump = () => reader.read().then(({ done, value }) => {
+            if (done) {
+                if (!finished) {
+                    throw new Error('Stream ended before the answer was complete');
+                }
+                return;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                handleEvent(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+            }
+            return pump();
+        });
+        return pump();
+    })
+    .catch(error => {
+        error.streamStarted = contentSpan !== null || finished;
+        throw error;
+    });
+}
+
+// Non-streaming fallback: wait for the whole answer from /chat
+function requestRagResponse(text) {
     fetch('/chat', {
         method: 'POST',
         headers: {
@@ -1072,18 +1208,12 @@ function handleUserInput() {
     .then(response => response.json())
     .then(data => {
         removeTypingIndicator();
-        isProcessing = false;
-        sendButton.disabled = false;
+        finishProcessing();
         
         if (data.status === 'success') {
             // Use streaming effect for RAG responses
             addBotMessage(data.response, true);
-            
-            // Optionally show sources
-            if (data.sources && data.sources.length > 0) {
-                const sourcesText = 'Sources: ' + data.sources.map(s => s.source).join(', ');
-                console.log(sourcesText);  // Log sources for debugging
-            }
+            showRagSources(data);
             
             // Add follow-up question after streaming completes
             // Calculate total streaming time based on word count
@@ -1099,8 +1229,7 @@ function handleUserInput() {
     })
     .catch(error => {
         removeTypingIndicator();
-        isProcessing = false;
-        sendButton.disabled = false;
+        finishProcessing();
         console.error('Error:', error);
         addBotMessage(t('errorOccurred'));
     });
@@ -0,0 +1,71 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from helpers import start_stand_in_llm
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules live at the repository root
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Streamed by the stand-in LLM; the markup is split across tokens
+ANSWER_TOKENS = ['Hello', ' <str', 'ong>there</strong>.', '\nCall', ' us href="https://www.vwat.org"',
+                 ' at 647-343-8928', '\n']
+
+RETRIEVED_DOCS = [
+    {'id': 'a', 'text': 'VWAT office hours are 9 to 5.', 'score': 0.61, 'source': 'faqs.json', 'type': 'faq',
+     'metadata': {}},
+    {'id': 'b', 'text': 'Call 647-343-8928.', 'score': 0.42, 'source': 'contacts.json', 'type': 'contact',
+     'metadata': {}},
+]
+
+
+@pytest.fixture
+def stand_in_llm():
+    """Local Ollama-compatible server answering with ANSWER_TOKENS"""
+    server, url = start_stand_in_llm(delay_ms=5.0, paths=('/api/generate',), tokens=ANSWER_TOKENS, token_delay_ms=1.0)
+    yield server, url
+    server.shutdown()
+
+
+@pytest.fixture
+def rag(monkeypatch, stand_in_llm):
+    """``rag_system`` answering every question from RETRIEVED_DOCS through the stand-in LLM,
+    without loading the embedding model or an index"""
+    import rag_system
+    from llm_client import LLMClient
+
+    _, url = stand_in_llm
+    client = LLMClient(api_url=url)
+
+    def prepare(query, language):
+        return {
+            'prompt': f"Question: {query}",
+            'prompt_tokens': 4,
+            'retrieved_docs': RETRIEVED_DOCS,
+            'context': '',
+            'query_embedding': None,
+            'doc_ids': [doc['id'] for doc in RETRIEVED_DOCS]
+        }
+
+    monkeypatch.setattr(rag_system, 'rag_system', SimpleNamespace(answer_cache=None, close=lambda: None))
+    monkeypatch.setattr(rag_system, 'llm_client', client)
+    monkeypatch.setattr(rag_system, '_prepare_rag_response', prepare)
+    yield rag_system
+    client.close()
+
+
+@pytest.fixture
+def chat_app(monkeypatch, rag):
+    """Flask test client, with query and conversation logging recorded instead of written to data/"""
+    import app as app_module
+
+    recorded = SimpleNamespace(client=app_module.app.test_client(), queries=[], conversations=[])
+    monkeypatch.setattr(app_module, 'log_user_query', lambda *args: recorded.queries.append(args))
+    monkeypatch.setattr(app_module, 'save_conversation_to_csv',
+                        lambda **kwargs: recorded.conversations.append(kwargs))
+    return recorded
@@ -0,0 +1,134 @@
+"""
+Test support shared by the tests and benchmark.py
+"""
+
+import json
+import os
+import time
+
+
+def legacy_format_response(text):
+    """The regex pipeline sanitize_response replaced, run twice around the <br> conversion"""
+    import re
+
+    def clean(text):
+        text = re.sub(r'Website:\s*href\s*=\s*["\'][^"\'>]*["\']\s*target\s*=\s*["\'][^"\'>]*["\']\s*>\s*(www\.[^\s<]+|https?://[^\s<]+)',
+                      r'Website: \1', text, flags=re.IGNORECASE)
+        text = re.sub(r'\s*href\s*=\s*["\'][^"\'>]*["\']', '', text, flags=re.IGNORECASE)
+        text = re.sub(r'\s*target\s*=\s*["\'][^"\'>]*["\']', '', text, flags=re.IGNORECASE)
+        text = re.sub(r'\s+\w+\s*=\s*["\'][^"\'>]*["\']', '', text)
+        text = re.sub(r'>\s*(https?://[^\s<]+|www\.[^\s<]+)', r'\1', text)
+        text = re.sub(r'<\s*(https?://[^\s>]+|www\.[^\s>]+)', r'\1', text)
+        text = re.sub(r'(?<!<br)>(?![^<]*</)', '', text)
+        text = re.sub(r'Website:\s{2,}', 'Website: ', text)
+        text = re.sub(r'<(?!br\s*/?)[^>]+>', '', text)
+        return text.strip()
+
+    return clean(clean(text).replace('\n', '<br>'))
+
+
+def response_corpus(data_dir='./data'):
+    """Logged chatbot answers plus FAQ and knowledge-base prose"""
+    import csv
+
+    with open(os.path.join(data_dir, 'conversation.csv'), 'r', encoding='utf-8-sig', newline='') as f:
+        responses = [row['Answer'] for row in csv.DictReader(f) if row.get('Answer')]
+    with open(os.path.join(data_dir, 'faqs.json'), 'r', encoding='utf-8') as f:
+        responses += [faq['a'] for faq in json.load(f) if faq.get('a')]
+    with open(os.path.join(data_dir, 'vwat_complete_rag_data.json'), 'r', encoding='utf-8') as f:
+        responses += [item['content'] for item in json.load(f) if item.get('content')]
+    # Artifacts the sanitizer exists for
+    responses += [
+        'Website: href="https://www.vwat.org" target="_blank">www.vwat.org\n\nCall us at 647-343-8928.',
+        'See our site href="https://www.vwat.org" for details rel="noopener" today.',
+        'Programs: > https://www.vwat.org/programs\n- LINC\n- Seniors',
+        'Website:   www.vwat.org\n\n\nEmail: info@vwat.org\n',
+    ]
+    return responses
+
+
+def start_stand_in_llm(delay_ms=20.0, paths=('/generate',), tokens=None, token_delay_ms=0.0):
+    """Local HTTP server speaking the Ollama generate API on ``paths`` (404 elsewhere).
+
+    Non-streaming requests get one JSON answer after ``delay_ms``; with
+    ``"stream": true`` the ``tokens`` are sent as NDJSON lines every
+    ``token_delay_ms``. Returns ``(server, url)``; ``server.paths`` and
+    ``server.delay`` can be changed while it runs, ``server.slow_fraction``
+    of answers (and the next ``server.slow_requests`` answers) take
+    ``server.slow_delay`` instead, and ``server.connections`` counts
+    accepted TCP connections.
+    """
+    import random
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive
+        disable_nagle_algorithm = True  # Headers and body are separate writes
+
+        def setup(self):
+            super().setup()
+            self.server.connections += 1
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body):
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _stream(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i, token in enumerate(self.server.tokens + ['']):
+                time.sleep(self.server.token_delay)
+                if self.path == '/v1/completions':
+                    line = b'data: ' + json.dumps({'choices': [{'text': token}]}).encode('utf-8') + b'\n'
+                else:
+                    done = i == len(self.server.tokens)
+                    line = json.dumps({'response': token, 'done': done}).encode('utf-8') + b'\n'
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+            self.wfile.write(b'0\r\n\r\n')
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if self.path not in self.server.paths:
+                self._send(404, b'{"error": "not found"}')
+            elif request.get('stream'):
+                self._stream()
+            else:
+                with self.server.lock:
+                    slow = self.server.slow_requests > 0 or random.random() < self.server.slow_fraction
+                    self.server.slow_requests -= 1
+                time.sleep(self.server.slow_delay if slow else self.server.delay)
+                text = ''.join(self.server.tokens) or f"Stand-in answer to {len(request.get('prompt', ''))} characters"
+                if self.path == '/v1/completions':
+                    result = {'choices': [{'text': text}]}
+                else:
+                    result = {'response': text, 'done': True}
+                self._send(200, json.dumps(result).encode('utf-8'))
+
+    class Server(ThreadingHTTPServer):
+        request_queue_size = 1024  # Accept bursts of concurrent clients
+
+        def handle_error(self, request, client_address):
+            pass  # Clients that timed out have closed the connection
+
+    server = Server(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.paths = set(paths)
+    server.delay = delay_ms / 1000.0
+    server.slow_fraction = 0.0
+    server.slow_delay = 0.0
+    server.slow_requests = 0
+    server.lock = threading.Lock()
+    server.tokens = list(tokens or [])
+    server.token_delay = token_delay_ms / 1000.0
+    server.connections = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
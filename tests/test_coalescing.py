@@ -0,0 +1,90 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from conftest import RETRIEVED_DOCS
+
+
+@pytest.fixture
+def prepared(rag, monkeypatch):
+    """Questions ``_prepare_rag_response`` was called for"""
+    queries = []
+    prepare = rag._prepare_rag_response
+
+    def counted(query, language):
+        queries.append(query)
+        return prepare(query, language)
+
+    monkeypatch.setattr(rag, '_prepare_rag_response', counted)
+    return queries
+
+
+def test_coalesced_callers_get_their_own_copy(rag, stand_in_llm, prepared):
+    server, _ = stand_in_llm
+    server.delay = 0.2
+    results = [None] * 3
+
+    def ask(i):
+        results[i] = rag.get_rag_response('What are your  HOURS?' if i else 'What are your hours?', 'en')
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join()
+
+    assert len(prepared) == 1
+    assert results[0] == results[1] == results[2]
+    assert results[0]['answer_source'] == 'llm'
+    results[1]['response'] = 'changed'
+    assert results[0]['response'] != 'changed' and results[2]['response'] != 'changed'
+
+
+def test_caller_past_its_deadline_answers_from_the_shared_retrieval(rag, stand_in_llm, prepared):
+    server, _ = stand_in_llm
+    server.delay = 0.5
+    leader = threading.Thread(target=rag.get_rag_response, args=('What are your hours?', 'en'))
+    leader.start()
+    time.sleep(0.05)
+
+    start = time.monotonic()
+    result = rag.get_rag_response('What are your hours?', 'en', deadline=start + 0.1)
+    elapsed = time.monotonic() - start
+    leader.join()
+
+    assert elapsed < 0.3  # Did not wait for the LLM
+    assert len(prepared) == 1  # Nor retrieve again
+    assert result['answer_source'] == 'retrieval_only'
+    assert result['retrieved_docs'] == RETRIEVED_DOCS
+    assert rag.query_flight.stats()['timeouts'] == 1
+    assert rag._flight_states == {}
+
+
+def test_async_caller_past_its_deadline_answers_from_the_shared_retrieval(rag, stand_in_llm, prepared):
+    pytest.importorskip('aiohttp')
+    from llm_client import AsyncLLMClient
+
+    server, url = stand_in_llm
+    server.delay = 0.5
+
+    async def run():
+        rag.async_llm_client = AsyncLLMClient(api_url=url)
+        try:
+            leader = asyncio.ensure_future(rag.get_rag_response_async('What are your hours?', 'en'))
+            await asyncio.sleep(0.05)
+            result = await rag.get_rag_response_async('What are your hours?', 'en',
+                                                      deadline=time.monotonic() + 0.1)
+            return result, await leader
+        finally:
+            await rag.async_llm_client.close()
+            rag.async_llm_client = None
+
+    result, answer = asyncio.run(run())
+    assert len(prepared) == 1
+    assert result['answer_source'] == 'retrieval_only'
+    assert result['retrieved_docs'] == RETRIEVED_DOCS
+    assert answer['answer_source'] == 'llm'
+    assert rag._flight_states == {}
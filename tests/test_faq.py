@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from rag_system import RAGSystem
+
+QUESTIONS = {'What are your office hours?': [1.0, 0.0, 0.0], 'How do I book an appointment?': [0.0, 1.0, 0.0],
+             'Do you offer English classes?': [0.0, 0.0, 1.0]}
+
+
+def _faq(point_id, question, score):
+    return {'id': point_id, 'type': 'faq', 'score': score, 'text': question,
+            'metadata': {'question': question, 'answer': f"Answer to: {question}"}}
+
+
+@pytest.fixture
+def rag():
+    """Only what match_faq reads; embed_texts records what it is asked to embed"""
+    rag = RAGSystem.__new__(RAGSystem)
+    rag.faq_direct_threshold = 0.9
+    rag._faq_questions = {}
+    rag.embedded = []
+
+    def embed_texts(texts, show_progress_bar=True):
+        rag.embedded.extend(texts)
+        return np.array([QUESTIONS[text] for text in texts], dtype=np.float32) * 2.0
+
+    rag.embed_texts = embed_texts
+    return rag
+
+
+def test_question_embeddings_are_computed_once(rag):
+    docs = [_faq('a', 'What are your office hours?', 0.8), _faq('b', 'How do I book an appointment?', 0.7)]
+    query = np.array([0.1, 1.0, 0.0], dtype=np.float32)
+
+    for _ in range(3):
+        match = rag.match_faq(query, docs, 'en')
+        assert match['id'] == 'b'
+        assert match['faq_similarity'] == pytest.approx(1.0 / np.sqrt(1.01))
+    assert rag.embedded == ['What are your office hours?', 'How do I book an appointment?']
+
+    # Only FAQs not seen before are embedded
+    docs.append(_faq('c', 'Do you offer English classes?', 0.6))
+    assert rag.match_faq(np.array([0.0, 0.0, 1.0]), docs, 'en')['id'] == 'c'
+    assert rag.embedded[2:] == ['Do you offer English classes?']
+
+
+def test_no_match_below_the_threshold(rag):
+    docs = [_faq('a', 'What are your office hours?', 0.8)]
+    assert rag.match_faq(np.array([1.0, 1.0, 0.0]), docs, 'en') is None
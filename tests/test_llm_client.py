@@ -0,0 +1,243 @@
+import asyncio
+import time
+
+import pytest
+
+from conftest import ANSWER_TOKENS
+from llm_client import CircuitOpenError, LLMClient, LLMUnavailableError
+
+ANSWER = ''.join(ANSWER_TOKENS)
+
+
+@pytest.fixture
+def client(stand_in_llm):
+    client = LLMClient(api_url=stand_in_llm[1], read_timeout=0.3, failure_threshold=2)
+    yield client
+    client.close()
+
+
+def test_discovers_a_working_endpoint(stand_in_llm, client):
+    server, _ = stand_in_llm
+    server.paths = {'/v1/completions'}
+
+    assert client.endpoint is None
+    assert client.generate('question') == ANSWER
+    stats = client.stats()
+    assert stats['endpoint'] == client.endpoint == '/v1/completions'
+    assert stats['probes'] == 1
+    # Tried in order: /api/generate and /generate answered 404
+    assert stats['endpoints']['/api/generate'] == {'requests': 1, 'errors': 1, 'p50_ms': None, 'p95_ms': None}
+    assert stats['endpoints']['/generate']['errors'] == 1
+    assert stats['endpoints']['/v1/completions']['requests'] == 1
+    assert stats['endpoints']['/v1/completions']['errors'] == 0
+    assert stats['endpoints']['/v1/completions']['p50_ms'] is not None
+    assert '/api/chat' not in stats['endpoints']
+
+
+def test_uses_the_cached_endpoint_without_probing(stand_in_llm, client):
+    server, _ = stand_in_llm
+    server.paths = {'/v1/completions'}
+
+    for _ in range(3):
+        assert client.generate('question') == ANSWER
+    stats = client.stats()
+    assert stats['probes'] == 1
+    assert stats['endpoints']['/api/generate']['requests'] == 1
+    assert stats['endpoints']['/v1/completions']['requests'] == 3
+    assert server.connections == 1  # One pooled keep-alive connection
+
+
+def test_reprobes_at_once_when_the_endpoint_moves(stand_in_llm, client):
+    server, _ = stand_in_llm
+    server.paths = {'/v1/completions'}
+    client.generate('question')
+
+    server.paths = {'/api/generate'}
+    assert client.generate('question') == ANSWER
+    stats = client.stats()
+    assert stats['endpoint'] == '/api/generate'
+    assert stats['probes'] == 2
+    assert stats['endpoints']['/v1/completions']['errors'] == 1
+
+
+def test_reprobes_after_consecutive_failures(stand_in_llm, client):
+    server, _ = stand_in_llm
+    client.generate('question')
+    assert client.endpoint == '/api/generate'
+
+    server.delay = 1.0  # Beyond the read timeout
+    with pytest.raises(LLMUnavailableError):
+        client.generate('question')
+    assert client.endpoint == '/api/generate'  # One failure is not enough to drop it
+    with pytest.raises(LLMUnavailableError):
+        client.generate('question')
+    assert client.endpoint is None
+
+    server.delay = 0.005
+    assert client.generate('question') == ANSWER
+    stats = client.stats()
+    assert stats['endpoint'] == '/api/generate'
+    assert stats['probes'] == 2
+    assert stats['endpoints']['/api/generate']['errors'] == 2
+
+
+def test_unavailable_when_no_endpoint_answers(stand_in_llm, client):
+    server, _ = stand_in_llm
+    server.paths = set()
+
+    with pytest.raises(LLMUnavailableError):
+        client.generate('question')
+    assert client.endpoint is None
+    assert all(stats['errors'] == 1 for stats in client.stats()['endpoints'].values())
+
+
+@pytest.mark.parametrize('path', ['/api/generate', '/v1/completions'])
+def test_stream_deltas_join_to_the_answer(stand_in_llm, client, path):
+    server, _ = stand_in_llm
+    server.paths = {path}
+
+    deltas = list(client.generate_stream('question'))
+    assert len(deltas) > 1
+    assert ''.join(deltas) == ANSWER == client.generate('question')
+    assert client.stats()['probes'] == 1
+
+
+def test_async_client_discovers_and_caches_endpoints(stand_in_llm):
+    pytest.importorskip('aiohttp')
+    from llm_client import AsyncLLMClient
+
+    server, url = stand_in_llm
+    server.paths = {'/v1/completions'}
+
+    async def run():
+        client = AsyncLLMClient(api_url=url, read_timeout=0.3)
+        try:
+            answers = [await client.generate('question') for _ in range(2)]
+            deltas = [delta async for delta in client.generate_stream('question')]
+            server.paths = {'/api/generate'}
+            answers.append(await client.generate('question'))
+            return answers, deltas, client.stats()
+        finally:
+            await client.close()
+
+    answers, deltas, stats = asyncio.run(run())
+    assert answers == [ANSWER] * 3
+    assert ''.join(deltas) == ANSWER
+    assert stats['endpoint'] == '/api/generate'
+    assert stats['probes'] == 2
+    assert stats['endpoints']['/v1/completions']['requests'] == 4
+    assert stats['endpoints']['/v1/completions']['errors'] == 1
+
+
+def test_a_failed_probe_round_is_one_breaker_failure(stand_in_llm):
+    server, url = stand_in_llm
+    client = LLMClient(api_url=url, breaker_threshold=3)
+    try:
+        client.generate('question')
+        server.paths = set()  # Every endpoint answers 404
+
+        for _ in range(2):
+            with pytest.raises(LLMUnavailableError):
+                client.generate('question')
+        assert client.stats()['circuit'] == {'state': 'closed', 'opened': 0, 'rejected': 0}
+        with pytest.raises(LLMUnavailableError):
+            list(client.generate_stream('question'))
+        assert client.stats()['circuit']['state'] == 'open'
+        with pytest.raises(CircuitOpenError):
+            client.generate('question')
+        # The first failed call tried the cached endpoint and then probed; the others only probed
+        errors = {path: stats['errors'] for path, stats in client.stats()['endpoints'].items()}
+        assert errors == {'/api/generate': 4, '/generate': 3, '/v1/completions': 3, '/api/chat': 3}
+    finally:
+        client.close()
+
+
+def test_async_breaker_counts_failures_like_the_sync_client(stand_in_llm):
+    pytest.importorskip('aiohttp')
+    from llm_client import AsyncLLMClient
+
+    server, url = stand_in_llm
+
+    async def run():
+        client = AsyncLLMClient(api_url=url, breaker_threshold=3)
+        try:
+            await client.generate('question')
+            server.paths = set()
+            circuits = []
+            for _ in range(2):
+                with pytest.raises(LLMUnavailableError):
+                    await client.generate('question')
+                circuits.append(client.stats()['circuit']['state'])
+            with pytest.raises(LLMUnavailableError):
+                async for _ in client.generate_stream('question'):
+                    pass
+            circuits.append(client.stats()['circuit']['state'])
+            with pytest.raises(CircuitOpenError):
+                await client.generate('question')
+            return circuits
+        finally:
+            await client.close()
+
+    assert asyncio.run(run()) == ['closed', 'closed', 'open']
+
+
+def _hedging_client(client_class, url):
+    return client_class(api_url=url, read_timeout=0.5, hedge_percentile=50, hedge_min_samples=5,
+                        hedge_max_ratio=1.0, breaker_threshold=1)
+
+
+def test_hedged_request_answers_when_the_primary_is_slow(stand_in_llm):
+    server, url = stand_in_llm
+    client = _hedging_client(LLMClient, url)
+    try:
+        for _ in range(5):
+            client.generate('question')
+        assert client.stats()['hedges'] == 0
+
+        server.slow_delay = 1.0  # Beyond the read timeout: the primary fails after the hedge answered
+        server.slow_requests = 1
+        start = time.monotonic()
+        assert client.generate('question') == ANSWER
+        assert time.monotonic() - start < 0.3
+
+        time.sleep(0.6)  # Let the primary time out in the background
+        stats = client.stats()
+        assert stats['hedges'] == 1
+        assert stats['requests'] == 6
+        assert stats['endpoints']['/api/generate']['requests'] == 7
+        assert stats['endpoints']['/api/generate']['errors'] == 1
+        # Its failure is not the call's: one more failure would open this breaker
+        assert stats['circuit'] == {'state': 'closed', 'opened': 0, 'rejected': 0}
+        assert stats['endpoint'] == '/api/generate'
+        assert client.generate('question') == ANSWER
+    finally:
+        client.close()
+
+
+def test_async_hedged_request_cancels_the_slow_primary(stand_in_llm):
+    pytest.importorskip('aiohttp')
+    from llm_client import AsyncLLMClient
+
+    server, url = stand_in_llm
+
+    async def run():
+        client = _hedging_client(AsyncLLMClient, url)
+        try:
+            for _ in range(5):
+                await client.generate('question')
+            server.slow_delay = 1.0
+            server.slow_requests = 1
+            start = time.monotonic()
+            answer = await client.generate('question')
+            return answer, time.monotonic() - start, client.stats()
+        finally:
+            await client.close()
+
+    answer, elapsed, stats = asyncio.run(run())
+    assert answer == ANSWER
+    assert elapsed < 0.3
+    assert stats['hedges'] == 1
+    assert stats['requests'] == 6
+    # The cancelled primary is neither an endpoint error nor a breaker failure
+    assert stats['endpoints']['/api/generate'] == dict(stats['endpoints']['/api/generate'], requests=6, errors=0)
+    assert stats['circuit'] == {'state': 'closed', 'opened': 0, 'rejected': 0}
@@ -0,0 +1,64 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+DOCS = [{'id': str(i), 'text': f"document {i}", 'score': 1.0 - i / 10} for i in range(5)]
+
+
+class StandInCrossEncoder:
+    """Scores a pair by the document number; ``fail`` and ``delay`` simulate a broken or slow model"""
+
+    fail = None
+    delay = 0.0
+
+    def __init__(self, model_name, max_length, device):
+        pass
+
+    def predict(self, pairs, batch_size, show_progress_bar):
+        time.sleep(self.delay)
+        if self.fail is not None:
+            raise self.fail
+        return np.array([float(text.split()[-1]) for _, text in pairs])
+
+
+@pytest.fixture
+def reranker(monkeypatch):
+    import sys
+
+    from rag_system import CrossEncoderReranker
+
+    monkeypatch.setitem(sys.modules, 'sentence_transformers', SimpleNamespace(CrossEncoder=StandInCrossEncoder))
+    reranker = CrossEncoderReranker(budget_ms=100.0)
+    yield reranker
+    reranker.close()
+
+
+def test_reorders_by_cross_encoder_score(reranker):
+    docs = reranker.rerank('query', DOCS, top_k=3)
+    assert [doc['id'] for doc in docs] == ['4', '3', '2']
+    assert docs[0]['rerank_score'] == 4.0
+    assert reranker.stats()['reranked'] == 1
+
+
+@pytest.mark.parametrize('error', [MemoryError('out of memory'), RuntimeError('bad input'), ValueError('shape')])
+def test_a_failing_model_keeps_the_dense_order(reranker, error):
+    reranker.model.fail = error
+    docs = reranker.rerank('query', DOCS, top_k=3)
+
+    assert docs == DOCS[:3]
+    assert reranker.stats() == {'reranked': 0, 'not_reranked': 1, 'timeouts': 0, 'skipped': 0, 'errors': 1}
+    # The worker was released: the next request is reranked
+    reranker.model.fail = None
+    assert reranker.rerank('query', DOCS, top_k=3)[0]['id'] == '4'
+
+
+def test_slow_model_keeps_the_dense_order_within_the_budget(reranker):
+    reranker.model.delay = 0.3
+    start = time.monotonic()
+    docs = reranker.rerank('query', DOCS, top_k=3)
+
+    assert time.monotonic() - start < 0.25
+    assert docs == DOCS[:3]
+    assert reranker.stats()['timeouts'] == 1
@@ -0,0 +1,72 @@
+import os
+import random
+
+import pytest
+
+from helpers import legacy_format_response, response_corpus
+from response_sanitizer import StreamSanitizer, sanitize_response
+
+CORPUS = response_corpus(os.path.join(os.path.dirname(__file__), os.pardir, 'data'))
+
+# Markup the sanitizer exists for, and what it should become
+PINNED = [
+    ('Website: href="https://www.vwat.org" target="_blank">www.vwat.org\n\nCall us at 647-343-8928.',
+     'Website: www.vwat.org<br><br>Call us at 647-343-8928.'),
+    ('See our site href="https://www.vwat.org" for details rel="noopener" today.',
+     'See our site for details today.'),
+    ('Programs: > https://www.vwat.org/programs\n- LINC\n- Seniors',
+     'Programs: https://www.vwat.org/programs<br>- LINC<br>- Seniors'),
+    ('Website:   www.vwat.org\n\n\nEmail: info@vwat.org\n',
+     'Website: www.vwat.org<br><br><br>Email: info@vwat.org'),
+    ('Visit <https://www.vwat.org> today', 'Visit https://www.vwat.org today'),
+    # The old pipeline left "VWATinfo@vwat.org</a<br/Thanks" and "Line oneLine three"
+    ('Contact <strong>VWAT</strong> at <a href="mailto:info@vwat.org">info@vwat.org</a><br/>Thanks',
+     'Contact VWAT at info@vwat.org<br>Thanks'),
+    ('Line one<BR>Line two\nLine three', 'Line one<br>Line two<br>Line three'),
+    ('\n\n  <p>Xin chào</p>\n', 'Xin chào'),
+]
+
+
+def _stream(text, chunk_sizes):
+    sanitizer = StreamSanitizer()
+    out, i = [], 0
+    for size in chunk_sizes:
+        if i >= len(text):
+            break
+        out.append(sanitizer.feed(text[i:i + size]))
+        i += size
+    if i < len(text):
+        out.append(sanitizer.feed(text[i:]))
+    out.append(sanitizer.finish())
+    return ''.join(out)
+
+
+def test_markup_free_answers_match_legacy_sanitizer():
+    plain = [text for text in CORPUS if '<' not in text]
+    assert plain
+    for text in plain:
+        assert sanitize_response(text) == legacy_format_response(text)
+
+
+@pytest.mark.parametrize('text, expected', PINNED)
+def test_markup_is_stripped(text, expected):
+    assert sanitize_response(text) == expected
+
+
+def test_list_input():
+    texts = [text for text, _ in PINNED]
+    assert sanitize_response(texts) == [expected for _, expected in PINNED]
+
+
+@pytest.mark.parametrize('text', [text for text, _ in PINNED])
+def test_stream_matches_whole_text_per_character(text):
+    assert _stream(text, [1] * len(text)) == sanitize_response(text)
+
+
+def test_stream_matches_whole_text_on_random_chunks():
+    rng = random.Random(0)
+    for text in CORPUS + [text for text, _ in PINNED]:
+        expected = sanitize_response(text)
+        for _ in range(10):
+            # A few characters per chunk, like LLM tokens
+            assert _stream(text, [rng.randint(1, 12) for _ in range(len(text))]) == expected
@@ -0,0 +1,88 @@
+import uuid
+
+import numpy as np
+import pytest
+from qdrant_client import QdrantClient, models
+
+from rag_system import NumpyRetriever, QdrantRetriever, RAGSystem, resolve_snapshot
+
+DIM = 32
+WORDS = ['appointment', 'english', 'class', 'seniors', 'youth', 'employment', 'resume', 'settlement',
+         'newcomer', 'office', 'hours', 'phone', 'tax', 'clinic', 'volunteer', 'lớp', 'tiếng', 'anh']
+TYPES = ['faq', 'contact', 'service']
+
+
+@pytest.fixture(scope='module')
+def backends(tmp_path_factory):
+    """The same small collection served by embedded Qdrant and, through an exported snapshot, by NumPy"""
+    rng = np.random.default_rng(7)
+    client = QdrantClient(location=':memory:')
+    client.create_collection('chunks', vectors_config=models.VectorParams(size=DIM, distance=models.Distance.COSINE))
+
+    points = []
+    for i in range(120):
+        text = ' '.join(rng.choice(WORDS, size=8))
+        source = f"{TYPES[i % 3]}s.json"
+        points.append(models.PointStruct(
+            id=str(uuid.uuid5(uuid.NAMESPACE_URL, f"chunk-{i}")),
+            vector=rng.standard_normal(DIM).astype(np.float32).tolist(),
+            payload={'text': text, 'type': TYPES[i % 3], 'source': source, 'sources': [source], 'metadata': {}}
+        ))
+    client.upsert('chunks', points)
+
+    # Only what export_snapshot and the hybrid search read; there is no embedding model here
+    rag = RAGSystem.__new__(RAGSystem)
+    rag.client = client
+    rag.collection_name = rag._active_collection = 'chunks'
+    rag.embedding_model_name = 'test-model'
+    rag.embedding_dim = DIM
+    rag.hybrid = True
+    rag.rrf_k = 60
+
+    snapshot_root = str(tmp_path_factory.mktemp('snapshots'))
+    rag.export_snapshot(data_dir=snapshot_root, snapshot_root=snapshot_root)
+
+    rag.qdrant_path = None
+    qdrant = QdrantRetriever(client, 'chunks', sparse=rag._build_sparse_index('chunks'))
+    numpy_retriever = NumpyRetriever(resolve_snapshot(snapshot_root))
+    yield rag, qdrant, numpy_retriever, rng
+    numpy_retriever.close()
+    client.close()
+
+
+def _ids(hits):
+    return [hit[0] for hit in hits]
+
+
+@pytest.mark.parametrize('filters', [None, {'type': 'faq'}, {'source': ['contacts.json', 'services.json']}])
+def test_dense_search_parity(backends, filters):
+    _, qdrant, numpy_retriever, rng = backends
+    for _ in range(10):
+        query = rng.standard_normal(DIM).astype(np.float32)
+        expected = qdrant.search(query, 10, filters)
+        hits = numpy_retriever.search(query, 10, filters)
+        assert len(hits) == 10
+        assert _ids(hits) == _ids(expected)
+        assert [hit[1] for hit in hits] == pytest.approx([hit[1] for hit in expected], abs=1e-5)
+        assert [hit[2] for hit in hits] == [hit[2] for hit in expected]
+
+
+@pytest.mark.parametrize('filters', [None, {'type': 'service'}])
+def test_hybrid_search_parity(backends, filters):
+    rag, qdrant, numpy_retriever, rng = backends
+    for query in ['english class hours', 'lớp tiếng anh', 'tax clinic volunteer', 'phone office']:
+        embedding = rng.standard_normal(DIM).astype(np.float32)
+        assert numpy_retriever.sparse.search(query, 5) == qdrant.sparse.search(query, 5) != []
+        expected = rag._search(qdrant, query, embedding, 5, filters)
+        hits = rag._search(numpy_retriever, query, embedding, 5, filters)
+        assert len(hits) == 5
+        assert _ids(hits) == _ids(expected)
+        assert [hit[1] for hit in hits] == pytest.approx([hit[1] for hit in expected], abs=1e-5)
+        if filters:
+            assert all(hit[2]['type'] == 'service' for hit in hits)
+
+
+def test_snapshot_holds_every_point(backends):
+    _, qdrant, numpy_retriever, _ = backends
+    assert numpy_retriever.count() == qdrant.count() == 120
+    assert len(numpy_retriever.sparse) == 120
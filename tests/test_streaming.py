@@ -0,0 +1,146 @@
+import asyncio
+import json
+
+import pytest
+
+from conftest import ANSWER_TOKENS
+from response_sanitizer import sanitize_response
+
+EXPECTED_ANSWER = sanitize_response(''.join(ANSWER_TOKENS))
+
+
+def parse_sse(body: str):
+    """(event, payload) pairs of a Server-Sent Events body"""
+    events = []
+    for block in body.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_streamed_tokens_join_to_the_blocking_answer(rag):
+    events = list(rag.stream_rag_response('What are your hours?', 'en'))
+    tokens = [payload for event, payload in events[:-1]]
+    event, result = events[-1]
+
+    assert event == 'done'
+    assert all(event == 'token' for event, _ in events[:-1])
+    assert len(tokens) > 1
+    assert ''.join(tokens) == result['response'] == EXPECTED_ANSWER
+    assert rag.get_rag_response('What are your hours?', 'en')['response'] == EXPECTED_ANSWER
+    assert result['answer_source'] == 'llm'
+
+
+def test_async_stream_matches_the_async_answer(rag, stand_in_llm):
+    pytest.importorskip('aiohttp')
+    from llm_client import AsyncLLMClient
+
+    async def run():
+        rag.async_llm_client = AsyncLLMClient(api_url=stand_in_llm[1])
+        try:
+            events = [item async for item in rag.stream_rag_response_async('What are your hours?', 'en')]
+            answer = await rag.get_rag_response_async('What are your hours?', 'en')
+        finally:
+            await rag.async_llm_client.close()
+            rag.async_llm_client = None
+        return events, answer
+
+    events, answer = asyncio.run(run())
+    tokens = [payload for event, payload in events if event == 'token']
+    assert ''.join(tokens) == events[-1][1]['response'] == answer['response'] == EXPECTED_ANSWER
+
+
+def test_sse_done_event_has_the_chat_fields(chat_app):
+    request = {'message': 'What are your hours?', 'language': 'en', 'user_id': 'u1'}
+    chat = chat_app.client.post('/chat', json=request).get_json()
+    events = parse_sse(chat_app.client.post('/chat/stream', json=request).get_data(as_text=True))
+    event, done = events[-1]
+
+    assert event == 'done'
+    assert set(done) == set(chat)
+    assert done == chat
+    assert ''.join(payload['text'] for event, payload in events[:-1]) == done['response']
+    # Both endpoints log the same conversation
+    assert chat_app.conversations[0] == chat_app.conversations[1]
+
+
+def test_stream_logs_the_question_once(chat_app):
+    request = {'message': 'What are your hours?', 'language': 'en', 'user_id': 'u1'}
+    response = chat_app.client.post('/chat/stream', json=request, buffered=False)
+    # Not before the first event: a browser that gets none falls back to /chat, which logs it
+    assert chat_app.queries == []
+    response.get_data()
+    assert [query[1:] for query in chat_app.queries] == [('u1', 'en', 'What are your hours?')]
+
+
+def test_failed_stream_still_logs_the_question_once(chat_app, monkeypatch):
+    import app as app_module
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('no index')
+        yield
+
+    monkeypatch.setattr(app_module, 'stream_rag_response', fail)
+    request = {'message': 'What are your hours?', 'language': 'en'}
+    events = parse_sse(chat_app.client.post('/chat/stream', json=request).get_data(as_text=True))
+
+    assert [event for event, _ in events] == ['done']
+    assert events[0][1]['status'] == 'error'
+    assert len(chat_app.queries) == 1
+
+
+def test_empty_message_stream_matches_chat(chat_app):
+    request = {'message': '  ', 'language': 'en'}
+    chat = chat_app.client.post('/chat', json=request).get_json()
+    events = parse_sse(chat_app.client.post('/chat/stream', json=request).get_data(as_text=True))
+    assert events == [('done', chat)]
+
+
+def test_async_server_matches_the_flask_app(chat_app, rag, stand_in_llm, monkeypatch):
+    pytest.importorskip('httpx')
+    pytest.importorskip('aiohttp')
+    import asgi
+    from starlette.testclient import TestClient
+
+    queries = []
+    monkeypatch.setattr(asgi, 'log_user_query', lambda *args: queries.append(args))
+    monkeypatch.setattr(asgi, 'save_conversation_to_csv', lambda **kwargs: None)
+    # The lifespan hook creates the async LLM client from the environment
+    monkeypatch.setenv('LLM_API_URL', stand_in_llm[1])
+    request = {'message': 'What are your hours?', 'language': 'en'}
+    expected = chat_app.client.post('/chat', json=request).get_json()
+
+    with TestClient(asgi.app) as client:
+        chat = client.post('/chat', json=request).json()
+        events = parse_sse(client.post('/chat/stream', json=request).text)
+
+    assert chat == expected
+    assert events[-1] == ('done', expected)
+    assert len(queries) == 2  # Once per request
+    assert ''.join(payload['text'] for event, payload in events[:-1]) == expected['response']
+
+
+def test_llm_outage_answers_alike_on_every_path(rag, stand_in_llm):
+    pytest.importorskip('aiohttp')
+    from llm_client import AsyncLLMClient
+
+    server, url = stand_in_llm
+    server.paths = set()
+
+    async def run():
+        rag.async_llm_client = AsyncLLMClient(api_url=url)
+        try:
+            events = [item async for item in rag.stream_rag_response_async('What are your hours?', 'en')]
+            answer = await rag.get_rag_response_async('What are your hours?', 'en')
+        finally:
+            await rag.async_llm_client.close()
+            rag.async_llm_client = None
+        return events, answer
+
+    async_events, async_answer = asyncio.run(run())
+    events = list(rag.stream_rag_response('What are your hours?', 'en'))
+    answer = rag.get_rag_response('What are your hours?', 'en')
+
+    assert answer['answer_source'] == 'retrieval_only'
+    assert answer == async_answer == events[-1][1] == async_events[-1][1]
+    assert events == async_events == [('token', answer['response']), ('done', answer)]